@@ -1,5 +1,6 @@
 import os
 import asyncio
+import json
 
 from dotenv import load_dotenv
 from logging.config import fileConfig
@@ -11,12 +12,19 @@ from app.db.session import Base
 from app.models import user_model
 from app.models import task_model
 from app.models import group_model
+from app.models import deletion_model
+from app.models import shard_model
 
 load_dotenv()
 
-DATABASE_URL = os.getenv('DATABASE_URL')
-
 config = context.config
+
+# note: every shard carries the full schema, migrate one with `alembic -x shard=N upgrade head`
+SHARD = int(context.get_x_argument(as_dictionary=True).get('shard', 0))
+DATABASE_URL = (
+    json.loads(os.getenv('DATABASE_SHARD_URLS', '[]'))[SHARD - 1] if SHARD else os.getenv('DATABASE_URL')
+)
+
 config.set_main_option('sqlalchemy.url', DATABASE_URL)
 if config.config_file_name is not None:
     fileConfig(config.config_file_name)
@@ -0,0 +1,34 @@
+"""task group keyset index
+
+Revision ID: b8bebbf68f91
+Revises: 31cd3667d47e
+Create Date: 2026-10-18 18:49:35.124266
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8bebbf68f91'
+down_revision: Union[str, None] = '31cd3667d47e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_tasks_group_id_created_at_id',
+            'tasks',
+            ['group_id', 'created_at', 'id'],
+            unique=False,
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_tasks_group_id_created_at_id', table_name='tasks', postgresql_concurrently=True)
@@ -0,0 +1,30 @@
+"""row version columns
+
+Revision ID: 4c1d7e9a2f60
+Revises: b8bebbf68f91
+Create Date: 2026-10-18 19:15:02.418311
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4c1d7e9a2f60'
+down_revision: Union[str, None] = 'b8bebbf68f91'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('tasks', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('groups', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('users', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'version')
+    op.drop_column('groups', 'version')
+    op.drop_column('tasks', 'version')
@@ -0,0 +1,59 @@
+"""task delta sync
+
+Revision ID: 9e3a51c0d7b4
+Revises: 4c1d7e9a2f60
+Create Date: 2026-10-18 19:40:11.902745
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e3a51c0d7b4'
+down_revision: Union[str, None] = '4c1d7e9a2f60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # note: a constant default keeps this a catalog-only change, existing rows sync from watermark 0
+    op.add_column('tasks', sa.Column('change_xid', sa.BigInteger(), server_default='0', nullable=False))
+    op.alter_column('tasks', 'change_xid', server_default=sa.text('pg_current_xact_id()::text::bigint'))
+    op.create_table(
+        'task_tombstones',
+        sa.Column('task_id', sa.Integer(), nullable=False),
+        sa.Column('group_id', sa.Integer(), nullable=True),
+        sa.Column(
+            'change_xid',
+            sa.BigInteger(),
+            server_default=sa.text('pg_current_xact_id()::text::bigint'),
+            nullable=False
+        ),
+        sa.Column('deleted_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('task_id')
+    )
+    op.create_index(
+        'ix_task_tombstones_group_id_change_xid_task_id',
+        'task_tombstones',
+        ['group_id', 'change_xid', 'task_id'],
+        unique=False
+    )
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_tasks_group_id_change_xid_id',
+            'tasks',
+            ['group_id', 'change_xid', 'id'],
+            unique=False,
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_tasks_group_id_change_xid_id', table_name='tasks', postgresql_concurrently=True)
+    op.drop_index('ix_task_tombstones_group_id_change_xid_task_id', table_name='task_tombstones')
+    op.drop_table('task_tombstones')
+    op.drop_column('tasks', 'change_xid')
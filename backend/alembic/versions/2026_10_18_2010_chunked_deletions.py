@@ -0,0 +1,57 @@
+"""chunked deletions
+
+Revision ID: 3f7c2d9b81e5
+Revises: 9e3a51c0d7b4
+Create Date: 2026-10-18 20:10:37.418226
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f7c2d9b81e5'
+down_revision: Union[str, None] = '9e3a51c0d7b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('groups', sa.Column('deleted_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('users', sa.Column('deleted_at', sa.DateTime(timezone=True), nullable=True))
+    op.create_table(
+        'deletions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('entity', sa.String(), nullable=False),
+        sa.Column('entity_id', sa.Integer(), nullable=False),
+        sa.Column('stage', sa.String(), nullable=True),
+        sa.Column('deleted_rows', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('entity', 'entity_id', name='uq_deletions_entity_entity_id')
+    )
+    op.create_index(op.f('ix_deletions_id'), 'deletions', ['id'], unique=False)
+    op.create_index(op.f('ix_deletions_finished_at'), 'deletions', ['finished_at'], unique=False)
+    # note: batches of a group's memberships are picked by group_id, which the primary key does not lead with
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_user_group_group_id',
+            'user_group',
+            ['group_id'],
+            unique=False,
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_user_group_group_id', table_name='user_group', postgresql_concurrently=True)
+    op.drop_index(op.f('ix_deletions_finished_at'), table_name='deletions')
+    op.drop_index(op.f('ix_deletions_id'), table_name='deletions')
+    op.drop_table('deletions')
+    op.drop_column('users', 'deleted_at')
+    op.drop_column('groups', 'deleted_at')
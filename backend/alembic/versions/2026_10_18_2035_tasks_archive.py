@@ -0,0 +1,48 @@
+"""tasks archive
+
+Revision ID: 6a0e4b8c3d21
+Revises: 3f7c2d9b81e5
+Create Date: 2026-10-18 20:35:52.160394
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6a0e4b8c3d21'
+down_revision: Union[str, None] = '3f7c2d9b81e5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'tasks_archive',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(length=256), nullable=False),
+        sa.Column('description', sa.String(length=500), nullable=True),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('priority', sa.String(), nullable=True),
+        sa.Column('assignee_id', sa.Integer(), nullable=True),
+        sa.Column('reporter_id', sa.Integer(), nullable=False),
+        sa.Column('is_done', sa.Boolean(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('group_id', sa.Integer(), nullable=True),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('change_xid', sa.BigInteger(), nullable=False),
+        sa.Column('archived_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_tasks_archive_assignee_id'), 'tasks_archive', ['assignee_id'], unique=False)
+    op.create_index(op.f('ix_tasks_archive_group_id'), 'tasks_archive', ['group_id'], unique=False)
+    op.create_index(op.f('ix_tasks_archive_reporter_id'), 'tasks_archive', ['reporter_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_tasks_archive_reporter_id'), table_name='tasks_archive')
+    op.drop_index(op.f('ix_tasks_archive_group_id'), table_name='tasks_archive')
+    op.drop_index(op.f('ix_tasks_archive_assignee_id'), table_name='tasks_archive')
+    op.drop_table('tasks_archive')
@@ -0,0 +1,106 @@
+"""partition tasks by created_at
+
+Revision ID: c5d18f2e7a94
+Revises: 6a0e4b8c3d21
+Create Date: 2026-10-18 21:00:14.583019
+
+"""
+from datetime import datetime, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.db.partitioning import month_start, monthly_partition_ddl
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5d18f2e7a94'
+down_revision: Union[str, None] = '6a0e4b8c3d21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONTHS_AHEAD = 3
+
+# note: (name on the plain table, name once it is a partition, definition), matched to the parent's indexes on attach
+INDEXES = (
+    ('ix_tasks_id', 'tasks_history_id_idx', '(id)'),
+    ('ix_tasks_assignee_id', 'tasks_history_assignee_id_idx', '(assignee_id)'),
+    ('ix_tasks_reporter_id', 'tasks_history_reporter_id_idx', '(reporter_id)'),
+    ('ix_tasks_created_at', 'tasks_history_created_at_idx', '(created_at)'),
+    ('ix_tasks_group_id_created_at_id', 'tasks_history_group_id_created_at_id_idx', '(group_id, created_at, id)'),
+    ('ix_tasks_group_id_change_xid_id', 'tasks_history_group_id_change_xid_id_idx', '(group_id, change_xid, id)')
+)
+
+FOREIGN_KEYS = (
+    ('tasks_assignee_id_fkey', 'FOREIGN KEY (assignee_id) REFERENCES users(id) ON DELETE SET NULL'),
+    ('tasks_reporter_id_fkey', 'FOREIGN KEY (reporter_id) REFERENCES users(id) ON DELETE CASCADE'),
+    ('tasks_group_id_fkey', 'FOREIGN KEY (group_id) REFERENCES groups(id)')
+)
+
+
+def _drop_swap_leftovers() -> None:
+    op.execute('ALTER TABLE tasks DROP CONSTRAINT IF EXISTS tasks_history_created_at_check')
+    op.execute('DROP INDEX IF EXISTS tasks_history_pkey')
+
+
+def upgrade() -> None:
+    # note: the existing table becomes the partition for everything before next month, so no row is copied.
+    # Everything that scans it runs outside the swap, which itself only touches the catalog
+    boundary = month_start(datetime.now(timezone.utc).date(), 1)
+    with op.get_context().autocommit_block():
+        # note: created_at was nullable, it becomes part of the primary key
+        op.execute('UPDATE tasks SET created_at = now() WHERE created_at IS NULL')
+        try:
+            op.execute('CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS tasks_history_pkey ON tasks (id, created_at)')
+            op.execute('ALTER TABLE tasks DROP CONSTRAINT IF EXISTS tasks_history_created_at_check')
+            op.execute(
+                'ALTER TABLE tasks ADD CONSTRAINT tasks_history_created_at_check '
+                f"CHECK (created_at IS NOT NULL AND created_at < '{boundary} 00:00:00+00') NOT VALID"
+            )
+            op.execute('ALTER TABLE tasks VALIDATE CONSTRAINT tasks_history_created_at_check')
+        except Exception:
+            # note: these steps commit one by one, leave the plain table as it was for the next attempt
+            _drop_swap_leftovers()
+            raise
+
+    op.execute('ALTER TABLE tasks ALTER COLUMN created_at SET NOT NULL')
+    op.execute('ALTER TABLE tasks DROP CONSTRAINT tasks_pkey')
+    op.execute('ALTER TABLE tasks ADD CONSTRAINT tasks_history_pkey PRIMARY KEY USING INDEX tasks_history_pkey')
+    for name, history_name, _ in INDEXES:
+        op.execute(f'ALTER INDEX {name} RENAME TO {history_name}')
+    op.execute('ALTER TABLE tasks RENAME TO tasks_history')
+
+    op.execute('CREATE TABLE tasks (LIKE tasks_history INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)')
+    op.execute('ALTER TABLE tasks ADD CONSTRAINT tasks_pkey PRIMARY KEY (id, created_at)')
+    for name, definition in FOREIGN_KEYS:
+        op.execute(f'ALTER TABLE tasks ADD CONSTRAINT {name} {definition}')
+    for name, _, columns in INDEXES:
+        op.execute(f'CREATE INDEX {name} ON tasks {columns}')
+    op.execute(
+        f"ALTER TABLE tasks ATTACH PARTITION tasks_history FOR VALUES FROM (MINVALUE) TO ('{boundary} 00:00:00+00')"
+    )
+    op.execute('ALTER TABLE tasks_history DROP CONSTRAINT tasks_history_created_at_check')
+    op.execute('ALTER SEQUENCE tasks_id_seq OWNED BY tasks.id')
+    for statement in monthly_partition_ddl('tasks', boundary, MONTHS_AHEAD):
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    is_partitioned = op.get_bind().scalar(
+        sa.text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'tasks'::regclass)")
+    )
+    if not is_partitioned:
+        # note: the upgrade stopped before the swap, only what it built ahead of it is left
+        _drop_swap_leftovers()
+        return
+    op.execute('ALTER TABLE tasks DETACH PARTITION tasks_history')
+    op.execute('INSERT INTO tasks_history SELECT * FROM tasks')
+    op.execute('ALTER SEQUENCE tasks_id_seq OWNED BY tasks_history.id')
+    op.execute('DROP TABLE tasks')
+    op.execute('ALTER TABLE tasks_history RENAME TO tasks')
+    for name, history_name, _ in INDEXES:
+        op.execute(f'ALTER INDEX {history_name} RENAME TO {name}')
+    op.execute('ALTER TABLE tasks DROP CONSTRAINT tasks_history_pkey')
+    op.execute('ALTER TABLE tasks ADD CONSTRAINT tasks_pkey PRIMARY KEY (id)')
+    op.alter_column('tasks', 'created_at', existing_type=sa.DateTime(timezone=True), nullable=True)
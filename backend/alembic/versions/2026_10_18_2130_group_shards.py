@@ -0,0 +1,35 @@
+"""group shards
+
+Revision ID: 8b2f6d41e0c7
+Revises: c5d18f2e7a94
+Create Date: 2026-10-18 21:30:41.902716
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b2f6d41e0c7'
+down_revision: Union[str, None] = 'c5d18f2e7a94'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'group_shards',
+        sa.Column('group_id', sa.Integer(), nullable=False),
+        sa.Column('shard', sa.Integer(), nullable=False),
+        sa.Column('frozen', sa.Boolean(), server_default='false', nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('group_id')
+    )
+    op.create_index(op.f('ix_group_shards_shard'), 'group_shards', ['shard'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_group_shards_shard'), table_name='group_shards')
+    op.drop_table('group_shards')
@@ -0,0 +1,78 @@
+"""task keys and default partition
+
+Revision ID: 3f9a6c2e8d15
+Revises: 8b2f6d41e0c7
+Create Date: 2026-10-18 22:00:27.310446
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9a6c2e8d15'
+down_revision: Union[str, None] = '8b2f6d41e0c7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # note: a row past the last partition lands here instead of failing its insert, the worker moves it out when
+    # its month is created
+    op.execute('CREATE TABLE tasks_default (LIKE tasks INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    op.execute('ALTER TABLE tasks ATTACH PARTITION tasks_default DEFAULT')
+
+    op.create_table(
+        'task_keys',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    # note: statement triggers see every row of a bulk insert or delete at once, instead of firing once per row
+    op.execute("""
+        CREATE FUNCTION task_keys_insert() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO task_keys (id, created_at) SELECT id, created_at FROM inserted
+            ON CONFLICT (id) DO UPDATE SET created_at = EXCLUDED.created_at;
+            RETURN NULL;
+        END $$
+    """)
+    op.execute("""
+        CREATE FUNCTION task_keys_delete() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            DELETE FROM task_keys WHERE id IN (SELECT id FROM deleted);
+            RETURN NULL;
+        END $$
+    """)
+    op.execute(
+        'CREATE TRIGGER tasks_keys_insert AFTER INSERT ON tasks REFERENCING NEW TABLE AS inserted '
+        'FOR EACH STATEMENT EXECUTE FUNCTION task_keys_insert()'
+    )
+    op.execute(
+        'CREATE TRIGGER tasks_keys_delete AFTER DELETE ON tasks REFERENCING OLD TABLE AS deleted '
+        'FOR EACH STATEMENT EXECUTE FUNCTION task_keys_delete()'
+    )
+    # note: after the triggers, so rows written while this runs are not missed
+    op.execute(
+        'INSERT INTO task_keys (id, created_at) SELECT id, created_at FROM tasks ON CONFLICT (id) DO NOTHING'
+    )
+
+
+def downgrade() -> None:
+    op.execute('DROP TRIGGER tasks_keys_delete ON tasks')
+    op.execute('DROP TRIGGER tasks_keys_insert ON tasks')
+    op.execute('DROP FUNCTION task_keys_delete()')
+    op.execute('DROP FUNCTION task_keys_insert()')
+    op.drop_table('task_keys')
+    op.execute("""
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM tasks_default) THEN
+                RAISE EXCEPTION 'tasks_default still holds rows, create partitions for them first';
+            END IF;
+        END $$
+    """)
+    op.execute('ALTER TABLE tasks DETACH PARTITION tasks_default')
+    op.execute('DROP TABLE tasks_default')
@@ -0,0 +1,33 @@
+"""task updated_at
+
+Revision ID: 9d4b7e1a5c60
+Revises: 3f9a6c2e8d15
+Create Date: 2026-10-18 22:30:52.174903
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d4b7e1a5c60'
+down_revision: Union[str, None] = '3f9a6c2e8d15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # note: now() is evaluated once for the existing rows, so no partition is rewritten. Tasks already done count
+    # as touched today and are archived no earlier than TASK_ARCHIVE_AFTER_DAYS from now
+    op.add_column(
+        'tasks',
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False)
+    )
+    op.add_column('tasks_archive', sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('tasks_archive', 'updated_at')
+    op.drop_column('tasks', 'updated_at')
@@ -1,16 +1,27 @@
+import asyncio
+import json
 from typing import Annotated, List
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
+from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import AsyncSession
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, StreamingResponse
 
-from app.models.user_model import User
-from app.schemas.group_schema import GroupCreate, GroupResponse, GroupWithUsers
-from app.deps.user_deps import get_current_user
-from app.db.session import get_db
+from app.core.config import settings
+from app.models.task_model import Task
+from app.schemas.group_schema import GroupCreate, GroupResponse, GroupWithUsers, GroupMembershipReport
+from app.schemas.job_schema import JobAccepted
+from app.schemas.user_schema import UserPrincipal
+from app.deps.user_deps import get_current_user, get_streaming_user
+from app.db.session import get_group_db, get_group_read_db, get_redis_db, shard_router
+from app.crud.deletion_crud import deletion
 from app.crud.group_crud import group
+from app.crud.task_crud import task
+from app.jobs.queue import enqueue, status_url
+from app.utils.change_feed import change_hub
+from app.utils.etag import not_modified_response, set_etag
+from app.utils.export import EXPORT_MEDIA_TYPES, DataFormat, encode_export
 from app.utils.exceptions import (
-    UserAlreadyInGroupError,
     UserNotInGroupError,
     GroupNotInDatabaseError,
     UserHaveNoRightsError,
@@ -22,20 +33,23 @@ router = APIRouter()
 @router.post('', response_model=GroupResponse, tags=['group'], status_code=status.HTTP_201_CREATED)
 async def create_group(
     obj_in: GroupCreate,
-    creator: Annotated[User, Depends(get_current_user)],
-    db: Annotated[AsyncSession, Depends(get_db)]
+    creator: Annotated[UserPrincipal, Depends(get_current_user)]
 ):
-    return await group.create_group(obj_in=obj_in, creator=creator, db=db)
+    group_id, shard = await shard_router.allocate_group()
+    async with shard_router.session(shard) as db:
+        return await group.create_group(obj_in=obj_in, creator=creator, db=db, id=group_id)
 
 
 @router.delete('', tags=['group'], status_code=status.HTTP_200_OK)
 async def delete_group(
     group_id: int,
-    current_user: Annotated[User, Depends(get_current_user)],
-    db: Annotated[AsyncSession, Depends(get_db)]
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
+    db: Annotated[AsyncSession, Depends(get_group_db)],
+    redis_client: Annotated[Redis, Depends(get_redis_db)],
+    async_mode: bool = False
 ):
     try:
-        group_del = await group.delete_group(id=group_id, db=db, current_user=current_user)
+        pending = await group.delete_group(id=group_id, db=db, current_user=current_user)
     except UserHaveNoRightsError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -46,6 +60,21 @@ async def delete_group(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f'Group {e.group_id} not found'
         )
+    # note: the group is already gone for readers. A group that takes one batch is purged within the request,
+    # anything longer, or everything in async mode, is left to a worker
+    if not async_mode:
+        pending = await deletion.purge(id=pending.id, db=db, max_batches=1)
+    if async_mode or pending.finished_at is None:
+        job_id = await enqueue(
+            redis_client,
+            'purge_deletion',
+            {'deletion_id': pending.id, 'shard': await shard_router.shard_for_group(group_id)},
+            owner_id=current_user.id
+        )
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content=JobAccepted(job_id=job_id, status_url=status_url(job_id)).model_dump()
+        )
     return JSONResponse(
         status_code=status.HTTP_200_OK,
         content=f'Group {group_id} successfully deleted'
@@ -55,35 +84,103 @@ async def delete_group(
 @router.get('/{group_id}', response_model=GroupWithUsers, tags=['group'])
 async def get_all_users_from_group(
     group_id: int,
-    current_user: Annotated[User, Depends(get_current_user)],
-    db: Annotated[AsyncSession, Depends(get_db)]
+    response: Response,
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
+    db: Annotated[AsyncSession, Depends(get_group_read_db)],
+    if_none_match: Annotated[str | None, Header()] = None
 ):
-    users_in_group = await group.get_all_users(id=group_id, db=db)
+    if not await group.is_member(group_id=group_id, user_id=current_user.id, db=db):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='Not authenticated'
+        )
+    not_modified = await not_modified_response(group, id=group_id, if_none_match=if_none_match, db=db)
+    if not_modified:
+        return not_modified
+    users_in_group = await group.get_cached(id=group_id, db=db)
     if not users_in_group:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Group not found'
         )
-    if current_user.id not in [user.id for user in users_in_group.users]:
+    set_etag(response, group, users_in_group)
+    return users_in_group
+
+
+@router.get('/{group_id}/tasks/export', tags=['group'])
+async def export_group_tasks(
+    group_id: int,
+    current_user: Annotated[UserPrincipal, Depends(get_streaming_user)],
+    db: Annotated[AsyncSession, Depends(get_group_read_db, scope='function')],
+    format: DataFormat = DataFormat.ndjson
+):
+    if not await group.is_member(group_id=group_id, user_id=current_user.id, db=db):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail='Not authenticated'
         )
-    return users_in_group
 
+    # note: the stream outlives the endpoint's session, so it reads through its own session on the same engine
+    async def export_rows():
+        async with AsyncSession(bind=db.bind) as export_db:
+            batches = task.stream_group_tasks(group_id=group_id, db=export_db, batch_size=settings.EXPORT_BATCH_SIZE)
+            async for chunk in encode_export(batches, format, Task.__table__.c.keys()):
+                yield chunk
+
+    return StreamingResponse(
+        export_rows(),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={'Content-Disposition': f'attachment; filename="group-{group_id}-tasks.{format.value}"'}
+    )
+
+
+@router.get('/{group_id}/events', tags=['group'])
+async def stream_group_events(
+    group_id: int,
+    current_user: Annotated[UserPrincipal, Depends(get_streaming_user)],
+    db: Annotated[AsyncSession, Depends(get_group_read_db, scope='function')]
+):
+    if not await group.is_member(group_id=group_id, user_id=current_user.id, db=db):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='Not authenticated'
+        )
+    subscriber = change_hub.subscribe(group_id, current_user.id)
+
+    async def events():
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), settings.CHANGE_FEED_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                if event is None:
+                    yield f'event: close\ndata: {json.dumps({"reason": subscriber.close_reason})}\n\n'
+                    return
+                yield f'event: {event["entity"]}.{event["op"]}\ndata: {json.dumps(event)}\n\n'
+        finally:
+            change_hub.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        events(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
-@router.post('/{group_id}', response_model=GroupWithUsers, tags=['group'], status_code=status.HTTP_200_OK)
+
+@router.post('/{group_id}', response_model=GroupMembershipReport, tags=['group'], status_code=status.HTTP_200_OK)
 async def add_users_to_group(
     group_id: int,
     user_ids: List[int],
-    db: Annotated[AsyncSession, Depends(get_db)]
+    db: Annotated[AsyncSession, Depends(get_group_db)]
 ):
     try:
         add_users = await group.add_user_to_group(id=group_id, user_ids=user_ids, db=db)
-    except UserAlreadyInGroupError as e:
+    except GroupNotInDatabaseError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f'User {e.user_id} already in group {e.group_id}'
+            detail=f'Group {e.group_id} not found'
         )
 
     return add_users
@@ -92,8 +189,8 @@ async def add_users_to_group(
 async def delete_users_from_group(
     group_id: int,
     user_id: int,
-    current_user: Annotated[User, Depends(get_current_user)],
-    db: Annotated[AsyncSession, Depends(get_db)]
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
+    db: Annotated[AsyncSession, Depends(get_group_db)]
 ):
     try:
         delete_user = await group.delete_user_from_group(
@@ -130,8 +227,8 @@ async def delete_users_from_group(
 @router.delete('/leave-group/{group_id}', tags=['group'], status_code=status.HTTP_200_OK)
 async def leave_group(
     group_id: int,
-    current_user: Annotated[User, Depends(get_current_user)],
-    db: Annotated[AsyncSession, Depends(get_db)]
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
+    db: Annotated[AsyncSession, Depends(get_group_db)]
 ):
     try:
         await group.leave_group(group_id=group_id, current_user=current_user, db=db)
@@ -0,0 +1,43 @@
+import json
+from datetime import datetime, timezone
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from redis.asyncio import Redis
+
+from app.db.session import get_redis_db
+from app.deps.user_deps import get_current_user
+from app.jobs.queue import get_job
+from app.schemas.job_schema import JobStatus
+from app.schemas.user_schema import UserPrincipal
+
+router = APIRouter()
+
+
+def _timestamp(value: str) -> datetime:
+    return datetime.fromtimestamp(float(value), tz=timezone.utc)
+
+
+@router.get('/{job_id}', response_model=JobStatus, tags=['job'])
+async def get_job_status(
+    job_id: str,
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
+    redis_client: Annotated[Redis, Depends(get_redis_db)]
+) -> JobStatus:
+    data = await get_job(redis_client, job_id)
+    if not data or (data['owner_id'] != str(current_user.id) and current_user.role != 'admin'):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='Job not found'
+        )
+    return JobStatus(
+        id=job_id,
+        name=data['name'],
+        status=data['status'],
+        attempts=int(data['attempts']),
+        max_attempts=int(data['max_attempts']),
+        result=json.loads(data['result']) if data.get('result') else None,
+        error=data.get('error') or None,
+        created_at=_timestamp(data['created_at']),
+        updated_at=_timestamp(data['updated_at'])
+    )
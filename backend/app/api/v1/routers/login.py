@@ -10,8 +10,8 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.security import (
     create_access_token,
-    verify_password,
-    get_hashed_password,
+    verify_password_async,
+    get_hashed_password_async,
     create_refresh_token,
     decode_token
 )
@@ -21,7 +21,10 @@ from app.db.session import get_db, get_redis_db
 from app.core.config import settings, TokenType
 from app.models.user_model import User
 from app.schemas.token_schema import TokenResponse, RefreshToken
-from app.utils.token import get_valid_tokens, add_tokens_to_redis, delete_tokens
+from app.schemas.user_schema import UserPrincipal
+from app.utils.exceptions import HashingQueueFullError
+from app.utils.token import is_token_valid, rotate_tokens
+from app.utils.token_epoch import get_access_token_claims, revoke_user_tokens
 
 router = APIRouter()
 
@@ -32,11 +35,17 @@ async def login_access_token(
     db: Annotated[AsyncSession, Depends(get_db)],
     oauth_form: OAuth2PasswordRequestForm = Depends()
 ):
-    user_auth = await user.authenticate(
-        email=oauth_form.username,
-        password=oauth_form.password,
-        db=db
-    )
+    try:
+        user_auth = await user.authenticate(
+            email=oauth_form.username,
+            password=oauth_form.password,
+            db=db
+        )
+    except HashingQueueFullError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail='Too many login attempts in progress, try again later'
+        )
     if not user_auth:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -47,37 +56,22 @@ async def login_access_token(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='User is inactive'
         )
+    # note: a login replaces the user's tokens in both modes, stateless access tokens are cut off by the epoch
+    await revoke_user_tokens(redis_client, user_auth.id)
     access_token = create_access_token(
         user_auth.id,
-        timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+        timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES),
+        await get_access_token_claims(redis_client, user_auth)
     )
     refresh_token = create_refresh_token(
         user_auth.id,
         timedelta(minutes=settings.REFRESH_TOKEN_EXPIRE_MINUTES)
     )
-    await delete_tokens(
-        redis_client,
-        user_auth.id,
-        TokenType.access
-    )
-    await delete_tokens(
+    await rotate_tokens(
         redis_client,
         user_auth.id,
-        TokenType.refresh
-    )
-    await add_tokens_to_redis(
-        redis_client,
-        user_auth,
         access_token,
-        TokenType.access,
-        settings.ACCESS_TOKEN_EXPIRE_MINUTES
-    )
-    await add_tokens_to_redis(
-        redis_client,
-        user_auth,
-        refresh_token,
-        TokenType.refresh,
-        settings.REFRESH_TOKEN_EXPIRE_MINUTES
+        refresh_token
     )
     return TokenResponse(access_token=access_token, token_type='bearer')
 
@@ -97,12 +91,13 @@ async def create_new_access_token(
         )
     if payload['type'] == 'refresh':
         user_id = payload['sub']
-        valid_refresh_token = await get_valid_tokens(
+        valid_refresh_token = await is_token_valid(
             redis_client,
             user_id,
+            body.refresh_token,
             TokenType.refresh
         )
-        if not valid_refresh_token or body.refresh_token not in valid_refresh_token:
+        if not valid_refresh_token:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail='Wrong credentials or invalid refresh token'
@@ -110,21 +105,16 @@ async def create_new_access_token(
 
         user_in_db: User = await user.get(db=db, id=int(user_id))
         if user_in_db.is_active:
+            await revoke_user_tokens(redis_client, user_in_db.id)
             access_token = create_access_token(
                 payload['sub'],
-                timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+                timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES),
+                await get_access_token_claims(redis_client, user_in_db)
             )
-            await delete_tokens(
+            await rotate_tokens(
                 redis_client,
-                user_id,
-                TokenType.access
-            )
-            await add_tokens_to_redis(
-                redis_client,
-                user_in_db,
-                access_token,
-                TokenType.access,
-                settings.ACCESS_TOKEN_EXPIRE_MINUTES
+                user_in_db.id,
+                access_token
             )
         else:
             raise HTTPException(
@@ -145,28 +135,37 @@ async def create_new_access_token(
 @router.post('/change-password', tags=['login'])
 async def change_password(
     redis_client: Annotated[Redis, Depends(get_redis_db)],
-    current_user: Annotated[User, Depends(get_current_user)],
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
     db: Annotated[AsyncSession, Depends(get_db)],
     current_password: str = Body(...),
     new_password: str = Body(...),
 ):
-    if not verify_password(current_password, current_user.hashed_password):
+    user_in_db: User = await user.get(db=db, id=current_user.id)
+    try:
+        if not await verify_password_async(current_password, user_in_db.hashed_password):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='Wrong current password'
+            )
+        new_password_hashed = await get_hashed_password_async(new_password)
+    except HashingQueueFullError:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail='Wrong current password'
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail='Too many password operations in progress, try again later'
         )
 
-    new_password_hashed = get_hashed_password(new_password)
-
     await user.update_user(
         id=current_user.id,
         obj_in={'hashed_password': new_password_hashed},
         db=db
     )
 
+    await revoke_user_tokens(redis_client, current_user.id)
+
     access_token = create_access_token(
         current_user.id,
-        timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+        timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES),
+        await get_access_token_claims(redis_client, current_user)
     )
 
     refresh_token = create_refresh_token(
@@ -174,32 +173,11 @@ async def change_password(
         timedelta(minutes=settings.REFRESH_TOKEN_EXPIRE_MINUTES)
     )
 
-    await delete_tokens(
-        redis_client,
-        current_user.id,
-        TokenType.access
-    )
-
-    await delete_tokens(
-        redis_client,
-        current_user.id,
-        TokenType.refresh
-    )
-
-    await add_tokens_to_redis(
-        redis_client=redis_client,
-        user=current_user,
-        token=access_token,
-        token_type=TokenType.access,
-        expire_time=settings.ACCESS_TOKEN_EXPIRE_MINUTES
-    )
-
-    await add_tokens_to_redis(
+    await rotate_tokens(
         redis_client=redis_client,
-        user=current_user,
-        token=refresh_token,
-        token_type=TokenType.refresh,
-        expire_time=settings.REFRESH_TOKEN_EXPIRE_MINUTES
+        user_id=current_user.id,
+        access_token=access_token,
+        refresh_token=refresh_token
     )
 
     return JSONResponse(
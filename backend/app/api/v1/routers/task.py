@@ -1,47 +1,213 @@
-from typing import Annotated
+from typing import Annotated, Any, List
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Query, Request, Response, status
+from pydantic import BaseModel, ValidationError
+from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.responses import JSONResponse
 
-from app.models.user_model import User
-from app.models.task_model import Task
-from app.schemas.task_schema import TaskResponse, TaskCreate, TaskUpdate
-from app.deps.user_deps import get_current_user
-from app.db.session import get_db
+from app.models.task_model import Task, TaskArchive
+from app.schemas.task_schema import (
+    TaskResponse,
+    TaskCreate,
+    TaskUpdate,
+    TaskPage,
+    TaskChanges,
+    TaskBulkUpdate,
+    TaskAssign,
+    TaskBulkResponse,
+    TaskImportReport,
+    BulkItemError
+)
+from app.schemas.job_schema import JobAccepted
+from app.schemas.user_schema import UserPrincipal
+from app.core.config import settings
+from app.deps.user_deps import get_current_admin, get_current_user
+from app.db.session import (
+    get_db,
+    get_group_read_db,
+    get_redis_db,
+    get_task_db,
+    get_task_read_db,
+    shard_router
+)
 from app.crud.task_crud import task
 from app.crud.group_crud import group
-from app.utils.exceptions import TaskNotInDatabaseError
+from app.jobs.queue import enqueue, status_url
+from app.utils.etag import not_modified_response, set_etag
+from app.utils.export import DataFormat
+from app.utils.exceptions import (
+    TaskNotInDatabaseError,
+    InvalidCursorError,
+    RelatedObjectNotFoundError,
+    RequiredValueMissingError,
+    GroupIsMovingError
+)
+from app.utils.task_import import import_tasks
 
 
 router = APIRouter()
 
+BulkItems = Annotated[List[dict[str, Any]], Body(min_length=1, max_length=1000)]
+
+
+def _validate_bulk_items(
+    items: List[dict[str, Any]],
+    schema: type[BaseModel]
+) -> tuple[dict[int, BaseModel], list[BulkItemError]]:
+    valid, errors = {}, []
+    for index, item in enumerate(items):
+        try:
+            valid[index] = schema.model_validate(item)
+        except ValidationError as e:
+            errors.append(BulkItemError(index=index, detail='; '.join(error['msg'] for error in e.errors())))
+    return valid, errors
+
+
 @router.post('', response_model=TaskResponse, tags=['task'], status_code=status.HTTP_201_CREATED)
 async def create_task(
     obj_in: TaskCreate,
-    current_user: Annotated[User, Depends(get_current_user)],
-    db: Annotated[AsyncSession, Depends(get_db)]
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)]
 ) -> Task:
     obj_with_reporter = TaskCreate(
         **obj_in.model_dump(exclude_none=True),
         reporter_id=current_user.id
     )
-    group_in = await group.get_all_users(id=obj_in.group_id, db=db)
-    if current_user.id not in [user.id for user in group_in.users]:
+    try:
+        shard = await shard_router.shard_for_group(obj_in.group_id, write=True)
+    except GroupIsMovingError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f'Group {obj_in.group_id} is being moved, retry shortly'
+        )
+    async with shard_router.session(shard) as db:
+        if not await group.is_member(group_id=obj_in.group_id, user_id=current_user.id, db=db):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='Not authenticated'
+            )
+        try:
+            return await task.create_task(obj_in=obj_with_reporter, db=db, current_user=current_user)
+        except RelatedObjectNotFoundError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='Assignee does not exist'
+            )
+
+
+@router.get('', response_model=TaskPage, tags=['task'])
+async def list_group_tasks(
+    group_id: int,
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
+    db: Annotated[AsyncSession, Depends(get_group_read_db)],
+    cursor: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=200)] = 50
+) -> TaskPage:
+    if not await group.is_member(group_id=group_id, user_id=current_user.id, db=db):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Not authenticated'
         )
-    return await task.create_task(obj_in=obj_with_reporter, db=db, current_user=current_user)
+    try:
+        tasks, next_cursor = await task.list_group_tasks(group_id=group_id, cursor=cursor, limit=limit, db=db)
+    except InvalidCursorError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Invalid cursor'
+        )
+    return TaskPage(items=tasks, next_cursor=next_cursor)
+
+
+@router.get('/changes', response_model=TaskChanges, tags=['task'])
+async def list_task_changes(
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
+    db: Annotated[AsyncSession, Depends(get_db)],
+    since: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100
+) -> TaskChanges:
+    try:
+        tasks, deleted, next_cursor = await task.list_changes(user_id=current_user.id, cursor=since, limit=limit, db=db)
+    except InvalidCursorError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Invalid cursor'
+        )
+    return TaskChanges(items=tasks, deleted=deleted, next_cursor=next_cursor)
+
+
+@router.post('/bulk', response_model=TaskBulkResponse, tags=['task'], status_code=status.HTTP_201_CREATED)
+async def bulk_create_tasks(
+    items: BulkItems,
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
+    db: Annotated[AsyncSession, Depends(get_db)]
+) -> TaskBulkResponse:
+    objs_in, errors = _validate_bulk_items(items, TaskCreate)
+    created, create_errors = await task.bulk_create_tasks(objs_in=objs_in, current_user=current_user, db=db)
+    return TaskBulkResponse(items=created, errors=sorted(errors + create_errors, key=lambda error: error.index))
+
+
+@router.patch('/bulk', response_model=TaskBulkResponse, tags=['task'])
+async def bulk_update_tasks(
+    items: BulkItems,
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
+    db: Annotated[AsyncSession, Depends(get_db)]
+) -> TaskBulkResponse:
+    objs_in, errors = _validate_bulk_items(items, TaskBulkUpdate)
+    updated, update_errors = await task.bulk_update_tasks(objs_in=objs_in, current_user=current_user, db=db)
+    return TaskBulkResponse(items=updated, errors=sorted(errors + update_errors, key=lambda error: error.index))
+
+
+@router.post('/bulk/assign', response_model=TaskBulkResponse, tags=['task'])
+async def bulk_assign_tasks(
+    items: BulkItems,
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
+    db: Annotated[AsyncSession, Depends(get_db)],
+    redis_client: Annotated[Redis, Depends(get_redis_db)],
+    async_mode: bool = False
+) -> TaskBulkResponse:
+    objs_in, errors = _validate_bulk_items(items, TaskAssign)
+    if async_mode:
+        job_id = await enqueue(
+            redis_client,
+            'bulk_assign_tasks',
+            {
+                'items': {index: obj_in.model_dump() for index, obj_in in objs_in.items()},
+                'errors': [error.model_dump() for error in errors],
+                'current_user': current_user.model_dump()
+            },
+            owner_id=current_user.id
+        )
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content=JobAccepted(job_id=job_id, status_url=status_url(job_id)).model_dump()
+        )
+    updated, assign_errors = await task.bulk_assign_users(objs_in=objs_in, current_user=current_user, db=db)
+    return TaskBulkResponse(items=updated, errors=sorted(errors + assign_errors, key=lambda error: error.index))
+
+
+@router.post('/import', response_model=TaskImportReport, tags=['task'])
+async def import_tasks_from_file(
+    request: Request,
+    admin: Annotated[UserPrincipal, Depends(get_current_admin)],
+    db: Annotated[AsyncSession, Depends(get_db)],
+    format: DataFormat = DataFormat.ndjson
+) -> TaskImportReport:
+    return await import_tasks(request.stream(), data_format=format, db=db, batch_size=settings.IMPORT_BATCH_SIZE)
 
 
 @router.patch('/{id}', response_model=TaskResponse, tags=['task'])
 async def update_task(
     id: int,
     obj_in: TaskUpdate,
-    db: Annotated[AsyncSession, Depends(get_db)]
+    db: Annotated[AsyncSession, Depends(get_task_db)]
 ) -> Task:
-    updated_task = await task.update_task(id=id, obj_in=obj_in, db=db)
+    try:
+        updated_task = await task.update_task(id=id, obj_in=obj_in, db=db)
+    except RequiredValueMissingError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'{e.column} cannot be null'
+        )
     if not updated_task:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -51,41 +217,79 @@ async def update_task(
 
 
 @router.delete('/{id}', tags=['task'], status_code=status.HTTP_204_NO_CONTENT)
-async def delete_task(id: int, db: Annotated[AsyncSession, Depends(get_db)]):
-    chosen_task = task.get(db=db, id=id)
-    if not chosen_task:
+async def delete_task(id: int, db: Annotated[AsyncSession, Depends(get_task_db)]):
+    deleted_task = await task.delete_task(id=id, db=db)
+    if not deleted_task:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Task does not exist'
         )
-    await task.delete_task(id=id, db=db)
     return JSONResponse(
         status_code=status.HTTP_204_NO_CONTENT,
         content='Task deleted'
     )
 
 @router.get('/{id}', response_model=TaskResponse, tags=['task']) # get by id
-async def get_tasks_by_id(id: int, db: Annotated[AsyncSession, Depends(get_db)]) -> Task | None:
-    task_db = await task.get(db=db, id=id)
+async def get_tasks_by_id(
+    id: int,
+    response: Response,
+    db: Annotated[AsyncSession, Depends(get_task_read_db)],
+    if_none_match: Annotated[str | None, Header()] = None
+) -> TaskResponse | None:
+    not_modified = await not_modified_response(task, id=id, if_none_match=if_none_match, db=db)
+    if not_modified:
+        return not_modified
+    task_db = await task.get_cached(db=db, id=id)
     if not task_db:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Task does not exist'
         )
+    set_etag(response, task, task_db)
     return task_db
 
-@router.post('/{task_id}', tags=['task'])
+@router.post('/{id}/restore', response_model=TaskResponse, tags=['task'])
+async def restore_task(
+    id: int,
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
+    db: Annotated[AsyncSession, Depends(get_task_db)]
+) -> Task:
+    task_db = await task.get(db=db, id=id)
+    if not isinstance(task_db, TaskArchive):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Task is not archived'
+        )
+    if not await group.is_member(group_id=task_db.group_id, user_id=current_user.id, db=db):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Not authenticated'
+        )
+    restored = await task.restore_task(id=id, db=db)
+    if not restored:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Task is not archived'
+        )
+    return restored
+
+@router.post('/{id}', tags=['task'])
 async def assign_task_to_user(
-    task_id: int,
+    id: int,
     user_id: int,
-    db: Annotated[AsyncSession, Depends(get_db)]
+    db: Annotated[AsyncSession, Depends(get_task_db)]
 ):
     try:
-        assign_task = await task.assign_user_to_task(task_id=task_id, user_id=user_id, db=db)
+        assign_task = await task.assign_user_to_task(task_id=id, user_id=user_id, db=db)
     except TaskNotInDatabaseError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f'Task {e.task_id} was not found'
         )
+    except RelatedObjectNotFoundError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'User {user_id} was not found'
+        )
     return assign_task # todo: add current_user check
 
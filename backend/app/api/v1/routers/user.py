@@ -1,40 +1,67 @@
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
+from fastapi.responses import JSONResponse
+from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models.user_model import User
-from app.schemas.user_schema import UserResponse, UserCreate, UserUpdate
-from app.db.session import get_db
+from app.schemas.job_schema import JobAccepted
+from app.schemas.user_schema import UserPrincipal, UserResponse, UserCreate, UserUpdate
+from app.deps.user_deps import get_current_user
+from app.db.session import get_db, get_read_db, get_redis_db, shard_router
+from app.crud.deletion_crud import deletion
 from app.crud.user_crud import user
+from app.jobs.queue import enqueue, status_url
+from app.utils.etag import not_modified_response, set_etag
+from app.utils.exceptions import HashingQueueFullError, ObjectAlreadyExistsError
+from app.utils.token_epoch import revoke_user_tokens
 
 router = APIRouter()
 
 
 @router.post('/register', response_model=UserResponse, tags=['user'], status_code=status.HTTP_201_CREATED)
 async def create_user(obj_in: UserCreate, db: Annotated[AsyncSession, Depends(get_db)]) -> User:
-    if await user.get(db=db, email=obj_in.email):
+    try:
+        return await user.create_user(obj_in=obj_in, db=db)
+    except ObjectAlreadyExistsError:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='User already exists'
         )
-    return await user.create_user(obj_in=obj_in, db=db)
+    except HashingQueueFullError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail='Too many registrations in progress, try again later'
+        )
 
 @router.get('', response_model=UserResponse, tags=['user'], status_code=status.HTTP_200_OK)
-async def get_user_by_id(id: Annotated[int, Query()], db: Annotated[AsyncSession, Depends(get_db)]) -> User:
-    user_db = await user.get(db=db, id=id)
+async def get_user_by_id(
+    id: Annotated[int, Query()],
+    response: Response,
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    if_none_match: Annotated[str | None, Header()] = None
+) -> UserResponse:
+    not_modified = await not_modified_response(user, id=id, if_none_match=if_none_match, db=db)
+    if not_modified:
+        return not_modified
+    user_db = await user.get_cached(db=db, id=id)
     if not user_db:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='User does not exist'
         )
+    set_etag(response, user, user_db)
     return user_db
 
 @router.delete('/{id}', tags=['user'], status_code=status.HTTP_204_NO_CONTENT)
 async def delete_user(
     id: int,
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
     db: Annotated[AsyncSession, Depends(get_db)],
-    freeze_user: bool = False
+    redis_client: Annotated[Redis, Depends(get_redis_db)],
+    freeze_user: bool = False,
+    async_mode: bool = False
 ):
     if freeze_user:
         updated_user = await user.update_user_is_active(id=id, db=db)
@@ -43,38 +70,67 @@ async def delete_user(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail='User does not exist'
             )
+        await revoke_user_tokens(redis_client, id)
         return updated_user
 
-    deleted_user = await user.delete_user(id=id, db=db)
-    if not deleted_user:
+    pending = await user.delete_user(id=id, db=db)
+    if not pending:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='User does not exist'
         )
-    return deleted_user
+    await revoke_user_tokens(redis_client, id)
+    # note: a user that takes one batch on the primary and has no copies on other shards is purged within the
+    # request, anything longer, or everything in async mode, is left to a worker
+    if not async_mode:
+        pending = await deletion.purge(id=pending.id, db=db, max_batches=1)
+    if async_mode or pending.finished_at is None or shard_router.replicas:
+        job_id = await enqueue(redis_client, 'purge_deletion', {'deletion_id': pending.id}, owner_id=current_user.id)
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content=JobAccepted(job_id=job_id, status_url=status_url(job_id)).model_dump()
+        )
 
 
 @router.patch('/{id}', response_model=UserResponse, tags=['user'], status_code=status.HTTP_200_OK)
 async def update_user(
     id: int,
     obj_in: UserUpdate,
-    db: Annotated[AsyncSession, Depends(get_db)]
+    db: Annotated[AsyncSession, Depends(get_db)],
+    redis_client: Annotated[Redis, Depends(get_redis_db)]
 ) -> User:
-    updated_user = await user.update_user(id=id, obj_in=obj_in, db=db)
+    try:
+        updated_user = await user.update_user(id=id, obj_in=obj_in, db=db)
+    except ObjectAlreadyExistsError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='User with this email already exists'
+        )
+    except HashingQueueFullError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail='Too many password operations in progress, try again later'
+        )
     if not updated_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='User does not exist'
         )
+    await revoke_user_tokens(redis_client, id)
     return updated_user
 
 
 @router.patch('/{id}/is-active', response_model=UserResponse, tags=['user'], status_code=status.HTTP_200_OK)
-async def update_user_is_active(id: int, db: Annotated[AsyncSession, Depends(get_db)]) -> User:
+async def update_user_is_active(
+    id: int,
+    db: Annotated[AsyncSession, Depends(get_db)],
+    redis_client: Annotated[Redis, Depends(get_redis_db)]
+) -> User:
     updated_user = await user.update_user_is_active(id=id, db=db)
     if not updated_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='User does not exist'
         )
+    await revoke_user_tokens(redis_client, id)
     return updated_user
@@ -0,0 +1,32 @@
+import argparse
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from app.core.config import settings
+from app.crud.task_crud import task
+from app.db.session import shard_router
+
+
+async def archive_done_tasks(*, older_than_days: int, batch_size: int) -> int:
+    older_than = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    archived = 0
+    for shard in shard_router.shards:
+        async with shard_router.session(shard) as db:
+            while moved := await task.archive_done_tasks(older_than=older_than, db=db, limit=batch_size):
+                archived += moved
+                await asyncio.sleep(settings.DELETION_BATCH_PAUSE_SECONDS)
+    return archived
+
+
+async def main(older_than_days: int, batch_size: int):
+    archived = await archive_done_tasks(older_than_days=older_than_days, batch_size=batch_size)
+    await shard_router.dispose()
+    print(f'Archived {archived} done tasks')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Move done tasks out of the hot tasks table')
+    parser.add_argument('--older-than-days', type=int, default=settings.TASK_ARCHIVE_AFTER_DAYS)
+    parser.add_argument('--batch-size', type=int, default=settings.TASK_ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+    asyncio.run(main(args.older_than_days, args.batch_size))
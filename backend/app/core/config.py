@@ -14,10 +14,53 @@ class Settings(BaseSettings):
     DATABASE_USER: str
     DATABASE_PASSWORD: str
     DATABASE_NAME: str
+    DATABASE_REPLICA_URL: PostgresDsn | None = None
+    REPLICA_READ_YOUR_WRITES_SECONDS: int = 5
+    REPLICA_HEALTH_CHECK_INTERVAL_SECONDS: float = 5
     SECRET_KEY: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     REFRESH_TOKEN_EXPIRE_MINUTES: int = 420228
     REDIS_URL: RedisDsn
+    REDIS_MAX_CONNECTIONS: int = 100
+    PASSWORD_HASHING_WORKERS: int = 4
+    PASSWORD_HASHING_MAX_PENDING: int = 64
+    PRINCIPAL_CACHE_TTL_SECONDS: int = 30
+    PRINCIPAL_CACHE_MAX_SIZE: int = 10000
+    STATELESS_ACCESS_TOKENS: bool = False
+    MEMBERSHIP_CACHE_ENABLED: bool = False
+    MEMBERSHIP_CACHE_TTL_SECONDS: int = 3600
+    TOKEN_EPOCH_CACHE_TTL_SECONDS: int = 60
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_TTL_SECONDS: int = 30
+    RESPONSE_CACHE_MAX_SIZE: int = 10000
+    RESPONSE_CACHE_REDIS_ENABLED: bool = False
+    RESPONSE_CACHE_REDIS_TTL_SECONDS: int = 300
+    SINGLE_FLIGHT_TIMEOUT_SECONDS: float = 5
+    EXPORT_BATCH_SIZE: int = 1000
+    IMPORT_BATCH_SIZE: int = 5000
+    CHANGE_FEED_QUEUE_SIZE: int = 100
+    CHANGE_FEED_KEEPALIVE_SECONDS: float = 15
+    JOB_VISIBILITY_TIMEOUT_SECONDS: float = 60
+    JOB_MAX_ATTEMPTS: int = 5
+    JOB_RETRY_BACKOFF_SECONDS: float = 2
+    JOB_RETRY_BACKOFF_MAX_SECONDS: float = 300
+    JOB_RESULT_TTL_SECONDS: int = 86400
+    JOB_POLL_INTERVAL_SECONDS: float = 0.5
+    JOB_WORKER_CONCURRENCY: int = 4
+    DELETION_BATCH_SIZE: int = 1000
+    DELETION_BATCH_PAUSE_SECONDS: float = 0.05
+    DELETION_MAX_RESTARTS: int = 3
+    TASK_ARCHIVE_AFTER_DAYS: int = 90
+    TASK_ARCHIVE_BATCH_SIZE: int = 1000
+    TASK_ARCHIVE_INTERVAL_SECONDS: float = 3600
+    TASK_PARTITION_MONTHS_AHEAD: int = 3
+    TASK_PARTITION_CHECK_INTERVAL_SECONDS: float = 3600
+    DATABASE_SHARD_URLS: list[PostgresDsn] = []
+    SHARD_DIRECTORY_CACHE_TTL_SECONDS: float = 60
+    SHARD_DIRECTORY_CACHE_MAX_SIZE: int = 100000
+    SHARD_TASK_ID_BLOCK_SIZE: int = 100_000_000
+    SHARD_MOVE_BATCH_SIZE: int = 1000
+    SHARD_MOVE_FREEZE_SECONDS: float = 5
 
     model_config = SettingsConfigDict(
         env_file= ".env", env_file_encoding='utf-8'
@@ -0,0 +1,210 @@
+import time
+from contextvars import ContextVar
+from typing import Any
+
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.metrics import registry
+
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+request_duration_seconds = registry.histogram(
+    'http_request_duration_seconds',
+    'Time to serve a request, by route template'
+)
+request_db_queries = registry.histogram(
+    'http_request_db_queries',
+    'Database queries run while serving one request',
+    buckets=COUNT_BUCKETS
+)
+request_db_seconds = registry.histogram(
+    'http_request_db_seconds',
+    'Time one request spent waiting on database queries'
+)
+request_redis_calls = registry.histogram(
+    'http_request_redis_calls',
+    'Redis round trips made while serving one request, a pipeline counts once',
+    buckets=COUNT_BUCKETS
+)
+request_redis_seconds = registry.histogram(
+    'http_request_redis_seconds',
+    'Time one request spent waiting on Redis'
+)
+request_pool_wait_seconds = registry.histogram(
+    'http_request_db_pool_wait_seconds',
+    'Time one request spent waiting to check a connection out of a pool'
+)
+db_query_seconds = registry.histogram(
+    'db_query_duration_seconds',
+    'Time from sending a statement to the database to having its result, by database'
+)
+db_pool_wait_seconds = registry.histogram(
+    'db_pool_checkout_wait_seconds',
+    'Time a checkout waited for a free connection, or for a new one to be opened'
+)
+db_pool_checked_out = registry.gauge(
+    'db_pool_checked_out_connections',
+    'Connections currently checked out of a pool'
+)
+redis_commands_total = registry.counter(
+    'redis_commands_total',
+    'Redis round trips by command, a pipeline counts once as PIPELINE'
+)
+redis_command_seconds_total = registry.counter(
+    'redis_command_seconds_total',
+    'Time spent waiting on Redis by command'
+)
+
+
+class RequestStats:
+    __slots__ = ('db_queries', 'db_seconds', 'redis_calls', 'redis_seconds', 'pool_wait_seconds')
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.redis_calls = 0
+        self.redis_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+
+
+# note: set for the duration of a request, tasks it spawns copy the context and so add to the same stats.
+# Background loops run outside any request and only feed the process wide metrics
+current_stats: ContextVar[RequestStats | None] = ContextVar('request_stats', default=None)
+
+_engines: dict[str, AsyncEngine] = {}
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    # note: _do_get is where a checkout queues for a free connection, or opens one while the pool has room.
+    # The pool is named after its database through pool_logging_name, which survives dispose
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            db_pool_wait_seconds.observe(waited, database=self.logging_name)
+            stats = current_stats.get()
+            if stats is not None:
+                stats.pool_wait_seconds += waited
+
+
+def _query_done(connection, database: str):
+    started = connection.info.get('query_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    db_query_seconds.observe(elapsed, database=database)
+    stats = current_stats.get()
+    if stats is not None:
+        stats.db_queries += 1
+        stats.db_seconds += elapsed
+
+
+def instrument_engine(engine: AsyncEngine):
+    sync_engine = engine.sync_engine
+    database = sync_engine.pool.logging_name
+    _engines[database] = engine
+
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        _query_done(connection, database)
+
+    @event.listens_for(sync_engine, 'handle_error')
+    def handle_error(exception_context):
+        if exception_context.connection is not None:
+            _query_done(exception_context.connection, database)
+
+
+@registry.collector
+def _collect_pools():
+    for database, engine in _engines.items():
+        pool = engine.sync_engine.pool
+        if hasattr(pool, 'checkedout'):
+            db_pool_checked_out.set(pool.checkedout(), database=database)
+
+
+def _redis_done(command: str, started: float):
+    elapsed = time.perf_counter() - started
+    redis_commands_total.inc(command=command)
+    redis_command_seconds_total.inc(elapsed, command=command)
+    stats = current_stats.get()
+    if stats is not None:
+        stats.redis_calls += 1
+        stats.redis_seconds += elapsed
+
+
+class InstrumentedRedis(Redis):
+    async def execute_command(self, *args, **options) -> Any:
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            _redis_done(str(args[0]).upper(), started)
+
+    def pipeline(self, transaction: bool = True, shard_hint: str | None = None) -> 'InstrumentedPipeline':
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True) -> list[Any]:
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            _redis_done('PIPELINE', started)
+
+
+def _route_template(scope: Scope) -> str:
+    # note: the route template keeps the label set bounded, anything unrouted shares one label. Routes of an
+    # included router may only know their own part of the path, the prefix is taken back from the request path
+    route = scope.get('route')
+    path = getattr(route, 'path', None)
+    if path is None:
+        return 'unmatched'
+    segments = scope['path'].split('/')
+    return '/'.join(segments[:len(segments) - len(path.split('/')) + 1]) + path
+
+
+class RequestMetricsMiddleware:
+    # note: plain ASGI rather than @app.middleware, which runs every request through an extra task and memory stream
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        status_code = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_stats.reset(token)
+            route = _route_template(scope)
+            method = scope['method']
+            request_duration_seconds.observe(elapsed, method=method, route=route, status=status_code)
+            request_db_queries.observe(stats.db_queries, method=method, route=route)
+            request_db_seconds.observe(stats.db_seconds, method=method, route=route)
+            request_redis_calls.observe(stats.redis_calls, method=method, route=route)
+            request_redis_seconds.observe(stats.redis_seconds, method=method, route=route)
+            request_pool_wait_seconds.observe(stats.pool_wait_seconds, method=method, route=route)
@@ -0,0 +1,144 @@
+from bisect import bisect_left
+from collections import defaultdict
+from collections.abc import Callable
+
+LabelKey = tuple[tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _label_key(labels: dict[str, str]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(key: LabelKey) -> str:
+    if not key:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in key) + '}'
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value))
+
+
+class Metric:
+    type_name = ''
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+
+    def samples(self) -> list[str]:
+        return []
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description)
+        self.values: dict[LabelKey, float] = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels: str):
+        self.values[_label_key(labels)] += amount
+
+    def samples(self) -> list[str]:
+        return [f'{self.name}{_format_labels(key)} {_format_value(value)}' for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    type_name = 'gauge'
+
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description)
+        self.values: dict[LabelKey, float] = defaultdict(float)
+
+    def set(self, value: float, **labels: str):
+        self.values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str):
+        self.values[_label_key(labels)] += amount
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.values[_label_key(labels)] -= amount
+
+    def samples(self) -> list[str]:
+        return [f'{self.name}{_format_labels(key)} {_format_value(value)}' for key, value in self.values.items()]
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name: str, description: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, description)
+        self.buckets = buckets
+        self.counts: dict[LabelKey, list[int]] = defaultdict(lambda: [0] * len(self.buckets))
+        self.sums: dict[LabelKey, float] = defaultdict(float)
+        self.totals: dict[LabelKey, int] = defaultdict(int)
+
+    def observe(self, value: float, **labels: str):
+        key = _label_key(labels)
+        # note: counts are per bucket, they are only made cumulative when rendered
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.counts[key][index] += 1
+        self.sums[key] += value
+        self.totals[key] += 1
+
+    def samples(self) -> list[str]:
+        lines = []
+        for key, total in self.totals.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, self.counts[key]):
+                cumulative += count
+                labels = _format_labels((*key, ('le', _format_value(bound))))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels((*key, ("le", "+Inf")))} {total}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {_format_value(self.sums[key])}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {total}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+        self.collectors: list[Callable[[], None]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f'Metric {metric.name} already registered')
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self.register(Counter(name, description))
+
+    def gauge(self, name: str, description: str) -> Gauge:
+        return self.register(Gauge(name, description))
+
+    def histogram(self, name: str, description: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, description, buckets))
+
+    def collector(self, collect: Callable[[], None]) -> Callable[[], None]:
+        # note: for gauges that are cheaper to read on scrape than to keep up to date
+        self.collectors.append(collect)
+        return collect
+
+    def render(self) -> str:
+        for collect in self.collectors:
+            collect()
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {_escape(metric.description)}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            lines += metric.samples()
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
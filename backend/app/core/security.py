@@ -1,17 +1,40 @@
+import asyncio
 import bcrypt
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from typing import TypeVar
 from jose import jwt
 
 from app.core.config import settings
+from app.core.metrics import registry
+from app.utils.exceptions import HashingQueueFullError
 
 ALGORITHM = 'HS256'
 
-def create_access_token(subject: int, expire_time: timedelta = None) -> str:
+T = TypeVar('T')
+
+hashing_queue_depth = registry.gauge(
+    'password_hashing_queue_depth',
+    'Password hashing calls submitted to the executor and not finished yet'
+)
+hashing_wait_seconds = registry.histogram(
+    'password_hashing_wait_seconds',
+    'Time a password hashing call waited for a free executor thread'
+)
+hashing_rejected_total = registry.counter(
+    'password_hashing_rejected_total',
+    'Password hashing calls rejected because the queue was full'
+)
+
+def create_access_token(subject: int, expire_time: timedelta = None, claims: dict | None = None) -> str:
     if expire_time:
         expire = datetime.now() + expire_time
     else:
         expire = datetime.now() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode = {
+        **(claims or {}),
         'sub': str(subject),
         'exp': expire,
         'type': 'access'
@@ -48,3 +71,47 @@ def verify_password(plain_password: str | bytes, hashed_password: str | bytes) -
     if isinstance(hashed_password, str):
         hashed_password = hashed_password.encode()
     return bcrypt.checkpw(plain_password, hashed_password)
+
+
+
+class HashingPool:
+    def __init__(self, *, max_workers: int, max_pending: int):
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='password-hashing')
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        if self.pending >= self.max_pending:
+            hashing_rejected_total.inc()
+            raise HashingQueueFullError(pending=self.pending)
+        submitted_at = time.perf_counter()
+
+        def timed_call() -> tuple[float, T]:
+            return time.perf_counter() - submitted_at, func(*args)
+
+        self.pending += 1
+        hashing_queue_depth.set(self.pending)
+        try:
+            waited, result = await asyncio.get_running_loop().run_in_executor(self._executor, timed_call)
+        finally:
+            self.pending -= 1
+            hashing_queue_depth.set(self.pending)
+        hashing_wait_seconds.observe(waited)
+        return result
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+hashing_pool = HashingPool(
+    max_workers=settings.PASSWORD_HASHING_WORKERS,
+    max_pending=settings.PASSWORD_HASHING_MAX_PENDING
+)
+
+
+async def get_hashed_password_async(plain_password: str | bytes) -> str:
+    return await hashing_pool.run(get_hashed_password, plain_password)
+
+
+async def verify_password_async(plain_password: str | bytes, hashed_password: str | bytes) -> bool:
+    return await hashing_pool.run(verify_password, plain_password, hashed_password)
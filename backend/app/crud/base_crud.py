@@ -1,41 +1,279 @@
+from collections import defaultdict
+from collections.abc import Awaitable, Callable, Hashable, Sequence
 from typing import Any, Generic, TypeVar
 
 from pydantic import BaseModel
-from sqlalchemy import select
+from sqlalchemy import ColumnElement, Select, Update, cast, column, delete, func, insert, select, tuple_, update, values
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db.session import Base
+from app.core.config import settings
+from app.db.session import Base, read_engine
+from app.models.deletion_model import Deletion
+from app.utils.exceptions import ObjectAlreadyExistsError, RelatedObjectNotFoundError, RequiredValueMissingError
+from app.utils.pagination import decode_cursor, encode_cursor
+from app.utils.response_cache import ResponseCache
+from app.utils.single_flight import SingleFlight
 
 ModelType = TypeVar('ModelType', bound=Base)
 CreateSchemaType = TypeVar('CreateSchemaType', bound=BaseModel)
 UpdateSchemaType = TypeVar('UpdateSchemaType', bound=BaseModel)
+T = TypeVar('T')
+StatementType = TypeVar('StatementType', Select, Update)
+
+UNIQUE_VIOLATION = '23505'
+FOREIGN_KEY_VIOLATION = '23503'
+NOT_NULL_VIOLATION = '23502'
 
 
 class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
-    def __init__(self, model: type[ModelType]):
+    def __init__(self, model: type[ModelType], response_schema: type[BaseModel] | None = None):
         self.model = model
+        self.response_schema = response_schema
+        self.cache = ResponseCache(model.__tablename__, response_schema) if response_schema else None
+        self.flights = SingleFlight(model.__tablename__, timeout=settings.SINGLE_FLIGHT_TIMEOUT_SECONDS)
 
-    async def create(self, *, obj_in: CreateSchemaType, db: AsyncSession) -> ModelType:
-        db_obj = self.model(**obj_in.model_dump())
+    async def create(self, *, obj_in: CreateSchemaType | dict[str, Any], db: AsyncSession) -> ModelType:
+        create_data = obj_in if isinstance(obj_in, dict) else obj_in.model_dump()
         try:
-            db.add(db_obj)
+            response = await db.execute(insert(self.model).values(**create_data).returning(self.model))
+            db_obj = response.scalar_one()
             await db.commit()
-        except IntegrityError:
-            await db.rollback()
+        except IntegrityError as e:
+            await self._raise_integrity_error(e, db=db)
+        await self.on_written(op='created', db_objs=[db_obj])
         return db_obj
 
+    async def _raise_integrity_error(self, e: IntegrityError, *, db: AsyncSession):
+        await db.rollback()
+        typed = self._typed_integrity_error(e)
+        if typed is e:
+            raise e
+        raise typed from e
+
+    def _typed_integrity_error(self, e: IntegrityError) -> Exception:
+        sqlstate = getattr(e.orig, 'sqlstate', None)
+        constraint = getattr(e.orig.__cause__, 'constraint_name', None)
+        column_name = getattr(e.orig.__cause__, 'column_name', None)
+        if sqlstate == UNIQUE_VIOLATION:
+            return ObjectAlreadyExistsError(self.model.__tablename__, constraint)
+        if sqlstate == FOREIGN_KEY_VIOLATION:
+            return RelatedObjectNotFoundError(self.model.__tablename__, constraint)
+        if sqlstate == NOT_NULL_VIOLATION:
+            return RequiredValueMissingError(self.model.__tablename__, column_name)
+        return e
+
+    async def create_many(self, *, objs_in: Sequence[dict[str, Any]], db: AsyncSession) -> list[ModelType]:
+        if not objs_in:
+            return []
+        table = self.model.__table__
+        fields = set().union(*objs_in)
+        defaults = {
+            field: table.c[field].default.arg
+            if table.c[field].default is not None and table.c[field].default.is_scalar else None
+            for field in fields
+        }
+        rows = [{field: obj_in.get(field, defaults[field]) for field in fields} for obj_in in objs_in]
+        # note: executemany with RETURNING is sent as batched multi-row INSERT ... VALUES statements
+        try:
+            response = await db.execute(
+                insert(self.model).returning(self.model, sort_by_parameter_order=True),
+                rows
+            )
+            db_objs = list(response.scalars().all())
+            await db.commit()
+        except IntegrityError as e:
+            await self._raise_integrity_error(e, db=db)
+        await self.on_written(op='created', db_objs=db_objs)
+        return db_objs
+
+    async def update_many(
+        self,
+        *,
+        objs_in: Sequence[dict[str, Any]],
+        db: AsyncSession,
+        where: Sequence[ColumnElement[bool]] = ()
+    ) -> list[ModelType]:
+        by_fields: dict[tuple[str, ...], list[dict[str, Any]]] = defaultdict(list)
+        for obj_in in objs_in:
+            by_fields[tuple(sorted(field for field in obj_in if field != 'id'))].append(obj_in)
+
+        table = self.model.__table__
+        db_objs = []
+        for fields, rows in by_fields.items():
+            if not fields:
+                continue
+            names = ('id', *fields)
+            data = values(
+                *[column(name, table.c[name].type) for name in names],
+                name='data'
+            ).data([tuple(row[name] for name in names) for row in rows])
+            try:
+                response = await db.execute(
+                    update(self.model)
+                    .where(*self.by_id(data.c.id), *where)
+                    .values({name: cast(data.c[name], table.c[name].type) for name in fields})
+                    .values(self.write_values())
+                    .returning(self.model)
+                    .execution_options(synchronize_session=False)
+                )
+            except IntegrityError as e:
+                await self._raise_integrity_error(e, db=db)
+            db_objs.extend(response.scalars().all())
+        await db.commit()
+        await self.invalidate(ids=[db_obj.id for db_obj in db_objs])
+        await self.on_written(op='updated', db_objs=db_objs)
+        return db_objs
+
+    def live(self, statement: StatementType) -> StatementType:
+        # note: rows marked for chunked deletion stay in the table until purged, readers must not see them
+        deleted_at = getattr(self.model, 'deleted_at', None)
+        return statement if deleted_at is None else statement.where(deleted_at.is_(None))
+
+    def by_id(self, id: Any) -> tuple[ColumnElement[bool], ...]:
+        return (self.model.id == id,)
+
     async def get(self, *, db: AsyncSession, **filters) -> ModelType | None:
-        response = await db.execute(select(self.model).filter_by(**filters))
+        query = select(self.model)
+        if 'id' in filters:
+            query = query.where(*self.by_id(filters.pop('id')))
+        response = await db.execute(self.live(query.filter_by(**filters)))
         return response.scalar_one_or_none()
 
+    async def get_cached(self, *, id: int, db: AsyncSession) -> BaseModel | None:
+        if self.cache is None:
+            raise TypeError(f'{type(self).__name__} has no response schema to cache')
+        # note: the cache generation is part of the key so loads started before a write are not shared after it.
+        # A replica may not have the write that emptied the entry yet, so what it returns is served but not stored
+        return await self.cache.get_or_load(
+            id,
+            lambda: self._coalesce(
+                ('response', id, self.cache.generation),
+                lambda db: self._load_response(id=id, db=db),
+                db=db
+            ),
+            store=db.bind is not read_engine
+        )
+
+    async def _coalesce(
+        self,
+        key: Hashable,
+        loader: Callable[[AsyncSession], Awaitable[T]],
+        *,
+        db: AsyncSession
+    ) -> T:
+        # note: the load runs on the session of whichever caller leads, a request never needs a second connection
+        return await self.flights.do((*key, db.bind), lambda: loader(db))
+
+    async def _load_response(self, *, id: int, db: AsyncSession) -> BaseModel | None:
+        db_obj = await self.get(db=db, id=id)
+        return self.response_schema.model_validate(db_obj) if db_obj else None
+
+    async def get_version(self, *, id: int, db: AsyncSession) -> int | None:
+        if self.cache is not None:
+            cached = await self.cache.get(id)
+            if cached is not None:
+                return cached.version
+        return await db.scalar(self.live(select(self.model.version).where(*self.by_id(id))))
+
+    async def invalidate(self, *, ids: Sequence[int]):
+        if self.cache is not None:
+            await self.cache.invalidate(ids)
+
+    def write_values(self) -> dict[str, Any]:
+        return {'version': self.model.version + 1}
+
+    async def on_deleting(self, *, db_objs: Sequence[ModelType], db: AsyncSession):
+        pass
+
+    async def on_written(self, *, op: str, db_objs: Sequence[ModelType]):
+        pass
+
+    async def list_page(
+        self,
+        *,
+        db: AsyncSession,
+        order_by: Sequence[str],
+        cursor: str | None = None,
+        limit: int = 50,
+        **filters
+    ) -> tuple[list[ModelType], str | None]:
+        columns = [getattr(self.model, name) for name in order_by]
+        query = self.live(select(self.model).filter_by(**filters))
+        if cursor:
+            after = decode_cursor(cursor, columns)
+            # note: the row comparison alone neither bounds an index scan nor prunes partitions on the leading column
+            query = query.where(tuple_(*columns) > tuple_(*after), columns[0] >= after[0])
+        response = await db.execute(query.order_by(*columns).limit(limit + 1))
+        items = list(response.scalars().all())
+        if len(items) <= limit:
+            return items, None
+        items = items[:limit]
+        return items, encode_cursor([getattr(items[-1], name) for name in order_by])
+
     async def delete(self, *, id: int, db: AsyncSession) -> ModelType | None:
-        response = await db.execute(select(self.model).where(self.model.id == id))
+        response = await db.execute(
+            delete(self.model)
+            .where(*self.by_id(id))
+            .returning(self.model)
+            .execution_options(synchronize_session=False)
+        )
+        db_obj = response.scalar_one_or_none()
+        if db_obj:
+            await self.on_deleting(db_objs=[db_obj], db=db)
+        await db.commit()
+        if db_obj:
+            await self.invalidate(ids=[id])
+            await self.on_written(op='deleted', db_objs=[db_obj])
+        return db_obj
+
+    async def mark_deleted(self, *, id: int, db: AsyncSession, **values) -> Deletion | None:
+        response = await db.execute(
+            update(self.model)
+            .where(*self.by_id(id), self.model.deleted_at.is_(None))
+            .values(deleted_at=func.now(), **values, **self.write_values())
+            .returning(self.model)
+            .execution_options(synchronize_session=False)
+        )
         db_obj = response.scalar_one_or_none()
         if not db_obj:
             return None
-        await db.delete(db_obj)
+        response = await db.execute(
+            insert(Deletion).values(entity=self.model.__tablename__, entity_id=id).returning(Deletion)
+        )
+        pending = response.scalar_one()
         await db.commit()
+        await self.invalidate(ids=[id])
+        await self.on_written(op='deleted', db_objs=[db_obj])
+        return pending
+
+    async def update_by_id(
+        self,
+        *,
+        id: int,
+        obj_in: UpdateSchemaType | dict[str, Any],
+        db: AsyncSession
+    ) -> ModelType | None:
+        if isinstance(obj_in, dict):
+            update_data = obj_in
+        else:
+            update_data = obj_in.model_dump(exclude_unset=True)
+        if not update_data:
+            return await self.get(db=db, id=id)
+        try:
+            response = await db.execute(
+                self.live(update(self.model).where(*self.by_id(id)))
+                .values(**update_data, **self.write_values())
+                .returning(self.model)
+                .execution_options(synchronize_session=False)
+            )
+            db_obj = response.scalar_one_or_none()
+            await db.commit()
+        except IntegrityError as e:
+            await self._raise_integrity_error(e, db=db)
+        if db_obj:
+            await self.invalidate(ids=[id])
+            await self.on_written(op='updated', db_objs=[db_obj])
         return db_obj
 
     async def update(
@@ -51,9 +289,12 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
             update_data = obj_in.model_dump(exclude_unset=True)
         for field in update_data:
             setattr(obj_current, field, update_data[field])
+        obj_current.version = (obj_current.version or 0) + 1
         try:
             db.add(obj_current)
             await db.commit()
-        except IntegrityError:
-            await db.rollback()
+        except IntegrityError as e:
+            await self._raise_integrity_error(e, db=db)
+        await self.invalidate(ids=[obj_current.id])
+        await self.on_written(op='updated', db_objs=[obj_current])
         return obj_current
@@ -0,0 +1,261 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from typing import NamedTuple
+
+from pydantic import BaseModel
+from sqlalchemy import Row, delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.metrics import registry
+from app.crud.base_crud import CRUDBase
+from app.crud.group_crud import group
+from app.crud.task_crud import task
+from app.db.session import shard_router
+from app.models.deletion_model import Deletion
+from app.models.group_model import Group, user_group
+from app.models.task_model import CURRENT_XID, Task, TaskArchive
+from app.models.user_model import User
+from app.utils import membership_cache
+
+logger = logging.getLogger(__name__)
+
+deletion_rows_total = registry.counter(
+    'deletion_rows_total',
+    'Rows removed or detached by the chunked deletion engine'
+)
+
+
+class Stage(NamedTuple):
+    name: str
+    # note: runs one batch of at most limit rows in the open transaction and returns the rows it touched
+    run: Callable[[int, int, AsyncSession], Awaitable[list[Row]]]
+    # note: called after the batch is committed, for cache invalidation and change events
+    done: Callable[[int, list[Row]], Awaitable[None]]
+
+
+class CRUDDeletion(CRUDBase[Deletion, BaseModel, BaseModel]):
+    def __init__(self, model: type[Deletion]):
+        super().__init__(model)
+        self.stages = {
+            Group.__tablename__: [
+                Stage('tasks', self._delete_group_tasks, self._tasks_deleted),
+                Stage('archived', self._delete_group_archived_tasks, self._tasks_deleted),
+                Stage('members', self._delete_group_members, self._nothing),
+                Stage('row', self._delete_row(Group), self._nothing)
+            ],
+            User.__tablename__: [
+                Stage('assigned', self._unassign_tasks(Task), self._tasks_unassigned),
+                Stage('archived_assigned', self._unassign_tasks(TaskArchive), self._tasks_unassigned),
+                Stage('reported', self._delete_reported_tasks, self._tasks_deleted),
+                Stage('archived_reported', self._delete_reported_archived_tasks, self._tasks_deleted),
+                Stage('members', self._delete_user_members, self._members_deleted),
+                Stage('groups', self._detach_created_groups, self._groups_detached),
+                Stage('row', self._delete_row(User), self._nothing)
+            ]
+        }
+
+    async def list_unfinished(self, *, db: AsyncSession) -> list[int]:
+        response = await db.execute(
+            select(Deletion.id).where(Deletion.finished_at.is_(None)).order_by(Deletion.id)
+        )
+        return list(response.scalars().all())
+
+    async def purge(
+        self,
+        *,
+        id: int,
+        db: AsyncSession,
+        batch_size: int | None = None,
+        max_batches: int | None = None
+    ) -> Deletion | None:
+        batch_size = batch_size or settings.DELETION_BATCH_SIZE
+        pending = await self.get(db=db, id=id)
+        if not pending or pending.finished_at:
+            return pending
+        entity, entity_id = pending.entity, pending.entity_id
+        stages = self.stages[entity]
+        names = [stage.name for stage in stages]
+        index = names.index(pending.stage) if pending.stage else 0
+        batches = restarts = 0
+        # note: every batch commits together with the progress row, so an interrupted purge resumes at its stage
+        while index < len(stages):
+            stage = stages[index]
+            try:
+                rows = await stage.run(entity_id, batch_size, db)
+            except IntegrityError:
+                # note: a writer slipped a dependent in after its stage was done, sweep the stages again. One that
+                # keeps failing is raised for the job to retry with backoff
+                await db.rollback()
+                restarts += 1
+                if restarts > settings.DELETION_MAX_RESTARTS:
+                    raise
+                logger.warning('Deleting %s %s hit a late dependent, restarting its stages', entity, entity_id)
+                index = 0
+                await db.execute(update(Deletion).where(Deletion.id == id).values(stage=names[index]))
+                await db.commit()
+                batches += 1
+                if max_batches is not None and batches >= max_batches:
+                    break
+                await asyncio.sleep(settings.DELETION_BATCH_PAUSE_SECONDS)
+                continue
+            if len(rows) < batch_size:
+                index += 1
+            finished = index == len(stages)
+            await db.execute(
+                update(Deletion)
+                .where(Deletion.id == id)
+                .values(
+                    stage=None if finished else names[index],
+                    deleted_rows=Deletion.deleted_rows + len(rows),
+                    finished_at=func.now() if finished else None
+                )
+            )
+            await db.commit()
+            deletion_rows_total.inc(len(rows), entity=entity, stage=stage.name)
+            if rows:
+                await stage.done(entity_id, rows)
+            # note: only full batches count against max_batches, so stages that fit in one batch still finish
+            if len(rows) == batch_size:
+                batches += 1
+                if max_batches is not None and batches >= max_batches:
+                    break
+            if not finished and settings.DELETION_BATCH_PAUSE_SECONDS:
+                await asyncio.sleep(settings.DELETION_BATCH_PAUSE_SECONDS)
+        return await self.get(db=db, id=id)
+
+    async def purge_replicas(self, *, entity: str, entity_id: int, batch_size: int | None = None) -> int:
+        # note: a user has its own deletion on every shard, for its copy and the tasks and memberships there
+        async def purge(shard: int, db: AsyncSession) -> int:
+            id = await db.scalar(
+                select(Deletion.id).where(Deletion.entity == entity, Deletion.entity_id == entity_id)
+            )
+            pending = await self.purge(id=id, db=db, batch_size=batch_size) if id else None
+            return pending.deleted_rows if pending else 0
+
+        return sum(await shard_router.fan_out(purge, shards=shard_router.replicas))
+
+    @staticmethod
+    async def _delete_tasks(model: type[Task] | type[TaskArchive], where, limit: int, db: AsyncSession) -> list[Row]:
+        response = await db.execute(
+            delete(model)
+            .where(model.id.in_(select(model.id).where(where).limit(limit)))
+            .returning(model.id, model.group_id, model.version)
+            .execution_options(synchronize_session=False)
+        )
+        rows = list(response.all())
+        if rows:
+            await task.on_deleting(db_objs=rows, db=db)
+        return rows
+
+    async def _delete_group_tasks(self, group_id: int, limit: int, db: AsyncSession) -> list[Row]:
+        return await self._delete_tasks(Task, Task.group_id == group_id, limit, db)
+
+    async def _delete_group_archived_tasks(self, group_id: int, limit: int, db: AsyncSession) -> list[Row]:
+        return await self._delete_tasks(TaskArchive, TaskArchive.group_id == group_id, limit, db)
+
+    async def _delete_reported_tasks(self, user_id: int, limit: int, db: AsyncSession) -> list[Row]:
+        return await self._delete_tasks(Task, Task.reporter_id == user_id, limit, db)
+
+    async def _delete_reported_archived_tasks(self, user_id: int, limit: int, db: AsyncSession) -> list[Row]:
+        return await self._delete_tasks(TaskArchive, TaskArchive.reporter_id == user_id, limit, db)
+
+    @staticmethod
+    async def _delete_group_members(group_id: int, limit: int, db: AsyncSession) -> list[Row]:
+        response = await db.execute(
+            delete(user_group)
+            .where(user_group.c.group_id == group_id)
+            .where(user_group.c.user_id.in_(
+                select(user_group.c.user_id).where(user_group.c.group_id == group_id).limit(limit)
+            ))
+            .returning(user_group.c.user_id)
+        )
+        return list(response.all())
+
+    @staticmethod
+    def _unassign_tasks(
+        model: type[Task] | type[TaskArchive]
+    ) -> Callable[[int, int, AsyncSession], Awaitable[list[Row]]]:
+        async def run(user_id: int, limit: int, db: AsyncSession) -> list[Row]:
+            response = await db.execute(
+                update(model)
+                .where(model.id.in_(select(model.id).where(model.assignee_id == user_id).limit(limit)))
+                .values(assignee_id=None, version=model.version + 1, change_xid=CURRENT_XID)
+                .returning(model.id, model.group_id, model.version)
+                .execution_options(synchronize_session=False)
+            )
+            return list(response.all())
+        return run
+
+    @staticmethod
+    async def _delete_user_members(user_id: int, limit: int, db: AsyncSession) -> list[Row]:
+        response = await db.execute(
+            delete(user_group)
+            .where(user_group.c.user_id == user_id)
+            .where(user_group.c.group_id.in_(
+                select(user_group.c.group_id).where(user_group.c.user_id == user_id).limit(limit)
+            ))
+            .returning(user_group.c.group_id)
+        )
+        rows = list(response.all())
+        if rows:
+            # note: groups embed their members, so losing one is a change of the group too
+            await db.execute(
+                update(Group)
+                .where(Group.id.in_([row.group_id for row in rows]))
+                .values(version=Group.version + 1)
+                .execution_options(synchronize_session=False)
+            )
+        return rows
+
+    @staticmethod
+    async def _detach_created_groups(user_id: int, limit: int, db: AsyncSession) -> list[Row]:
+        response = await db.execute(
+            update(Group)
+            .where(Group.id.in_(select(Group.id).where(Group.creator_id == user_id).limit(limit)))
+            .values(creator_id=None, version=Group.version + 1)
+            .returning(Group.id)
+            .execution_options(synchronize_session=False)
+        )
+        return list(response.all())
+
+    @staticmethod
+    def _delete_row(model: type[Group] | type[User]) -> Callable[[int, int, AsyncSession], Awaitable[list[Row]]]:
+        async def run(id: int, limit: int, db: AsyncSession) -> list[Row]:
+            response = await db.execute(
+                delete(model)
+                .where(model.id == id, model.deleted_at.is_not(None))
+                .returning(model.id)
+                .execution_options(synchronize_session=False)
+            )
+            return list(response.all())
+        return run
+
+    @staticmethod
+    async def _tasks_deleted(entity_id: int, rows: list[Row]):
+        await task.invalidate(ids=[row.id for row in rows])
+        await task.on_written(op='deleted', db_objs=rows)
+
+    @staticmethod
+    async def _tasks_unassigned(user_id: int, rows: list[Row]):
+        await task.invalidate(ids=[row.id for row in rows])
+        await task.on_written(op='updated', db_objs=rows)
+
+    @staticmethod
+    async def _members_deleted(user_id: int, rows: list[Row]):
+        await group.invalidate(ids=[row.group_id for row in rows])
+        for row in rows:
+            await membership_cache.remove_members(row.group_id, [user_id])
+
+    @staticmethod
+    async def _groups_detached(user_id: int, rows: list[Row]):
+        await group.invalidate(ids=[row.id for row in rows])
+
+    @staticmethod
+    async def _nothing(entity_id: int, rows: list[Row]):
+        pass
+
+
+deletion = CRUDDeletion(Deletion)
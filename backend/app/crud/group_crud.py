@@ -1,14 +1,18 @@
 from typing import List
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete
+from sqlalchemy import select, delete, exists, literal, update
 from sqlalchemy.orm import selectinload
 
 from app.crud.base_crud import CRUDBase
+from app.models.deletion_model import Deletion
 from app.models.user_model import User
 from app.models.group_model import Group, user_group
-from app.schemas.group_schema import GroupCreate, GroupUpdate
+from app.schemas.group_schema import GroupCreate, GroupUpdate, GroupMembershipReport, GroupWithUsers
+from app.schemas.user_schema import UserPrincipal
+from app.utils import membership_cache
+from app.utils.change_feed import publish_changes
 from app.utils.exceptions import (
-    UserAlreadyInGroupError,
     GroupNotInDatabaseError,
     UserNotInGroupError,
     UserHaveNoRightsError,
@@ -17,23 +21,32 @@ from app.utils.exceptions import (
 
 
 class CRUDGroup(CRUDBase[Group, GroupCreate, GroupUpdate]):
+    async def on_written(self, *, op: str, db_objs: List[Group]):
+        await publish_changes([
+            {'entity': 'group', 'op': op, 'id': db_obj.id, 'group_id': db_obj.id, 'version': db_obj.version}
+            for db_obj in db_objs
+        ])
+
     async def create_group(
         self,
         *,
         obj_in: GroupCreate,
-        creator: User,
-        db: AsyncSession
+        creator: UserPrincipal,
+        db: AsyncSession,
+        id: int | None = None
     ) -> Group:
-        db_group = Group(title=obj_in.title)
-        db_group.users.append(creator)
-        if obj_in.users:
-            response = await db.execute(select(User).where(User.id.in_(obj_in.users)))
-            users = response.scalars().all()
-            db_group.users.extend(users)
-        db_group.creator_id = creator.id
-        db.add(db_group)
+        # note: with sharding the id is allocated on the primary and the group is created on its shard
+        values = {'title': obj_in.title, 'creator_id': creator.id, **({'id': id} if id is not None else {})}
+        response = await db.execute(insert(Group).values(**values).returning(Group))
+        db_group = response.scalar_one()
+        candidates = await self._insert_members(
+            group_id=db_group.id,
+            user_ids=[creator.id, *(obj_in.users or [])],
+            db=db
+        )
         await db.commit()
-        await db.refresh(db_group)
+        # note: a new group has had no removals yet
+        await membership_cache.add_members(db_group.id, candidates, generation='0')
         return db_group
 
 
@@ -41,18 +54,45 @@ class CRUDGroup(CRUDBase[Group, GroupCreate, GroupUpdate]):
         self,
         *,
         id: int,
-        current_user: User,
+        current_user: UserPrincipal,
         db: AsyncSession
-    ):
-        group_obj = await self.get(db=db, id=id)
-        if not group_obj:
-            raise GroupNotInDatabaseError(group_id=id)
-        if current_user.id != group_obj.creator_id:
+    ) -> Deletion:
+        creator_id = await self._get_creator_id(group_id=id, db=db)
+        if current_user.id != creator_id:
             raise UserHaveNoRightsError(current_user.id, id)
-        await db.execute(delete(user_group).where(user_group.c.group_id == id))
-        await db.delete(group_obj)
-        await db.commit()
-        return group_obj
+        # note: only the mark happens here, tasks and memberships are purged in batches by the deletion engine
+        pending = await self.mark_deleted(id=id, db=db)
+        if not pending:
+            raise GroupNotInDatabaseError(group_id=id)
+        await membership_cache.drop_group(id)
+        return pending
+
+
+    async def is_member(
+        self,
+        *,
+        group_id: int,
+        user_id: int,
+        db: AsyncSession
+    ) -> bool:
+        cached, generation = await membership_cache.lookup_member(group_id, user_id)
+        if cached:
+            return True
+        is_member = await self._coalesce(
+            ('is_member', group_id, user_id),
+            lambda db: db.scalar(
+                select(
+                    exists()
+                    .where(user_group.c.group_id == group_id)
+                    .where(user_group.c.user_id == user_id)
+                    .where(Group.id == user_group.c.group_id, Group.deleted_at.is_(None))
+                )
+            ),
+            db=db
+        )
+        if is_member:
+            await membership_cache.add_members(group_id, [user_id], generation=generation)
+        return is_member
 
 
     async def get_all_users(
@@ -61,12 +101,18 @@ class CRUDGroup(CRUDBase[Group, GroupCreate, GroupUpdate]):
         id: int,
         db: AsyncSession
     ):
-        response = await db.execute(select(Group).where(Group.id == id).options(selectinload(Group.users)))
+        response = await db.execute(
+            self.live(select(Group).where(Group.id == id)).options(selectinload(Group.users.and_(User.deleted_at.is_(None))))
+        )
         group = response.scalar_one_or_none()
         if not group:
             return None
         return group
 
+    async def _load_response(self, *, id: int, db: AsyncSession) -> GroupWithUsers | None:
+        group_obj = await self.get_all_users(id=id, db=db)
+        return GroupWithUsers.model_validate(group_obj) if group_obj else None
+
 
     async def add_user_to_group(
         self,
@@ -74,24 +120,56 @@ class CRUDGroup(CRUDBase[Group, GroupCreate, GroupUpdate]):
         id: int,
         user_ids: List[int],
         db: AsyncSession
-    ):
-        response = await db.execute(select(Group).where(Group.id == id).options(selectinload(Group.users)))
-        group = response.scalar_one_or_none()
-        if not group:
-            return None
-
-        response = await db.execute(select(User).where(User.id.in_(user_ids)))
-        users = response.scalars().all()
-        if not users:
-            return None
-        for user in users:
-            if user in group.users:
-                raise UserAlreadyInGroupError(user_id=user.id, group_id=group.id)
-            else:
-                group.users.append(user)
+    ) -> GroupMembershipReport:
+        await self._get_creator_id(group_id=id, db=db)
+        generation = await membership_cache.generation(id)
+        candidates = await self._insert_members(group_id=id, user_ids=user_ids, db=db)
+        if any(candidates.values()):
+            await self._bump_versions(ids=[id], db=db)
         await db.commit()
-        await db.refresh(group)
-        return group
+        await membership_cache.add_members(id, candidates, generation=generation)
+        added = sorted(user_id for user_id, added in candidates.items() if added)
+        if added:
+            await self.invalidate(ids=[id])
+            await publish_changes([
+                {'entity': 'group', 'op': 'members_added', 'id': id, 'group_id': id, 'user_ids': added}
+            ])
+        return GroupMembershipReport(
+            group_id=id,
+            added=added,
+            already_members=sorted(user_id for user_id, added in candidates.items() if not added),
+            not_found=sorted(set(user_ids) - candidates.keys())
+        )
+
+
+    async def remove_users_from_group(
+        self,
+        *,
+        group_id: int,
+        user_ids: List[int],
+        db: AsyncSession
+    ) -> GroupMembershipReport:
+        response = await db.execute(
+            delete(user_group)
+            .where(user_group.c.group_id == group_id)
+            .where(user_group.c.user_id.in_(user_ids))
+            .returning(user_group.c.user_id)
+        )
+        removed = set(response.scalars().all())
+        if removed:
+            await self._bump_versions(ids=[group_id], db=db)
+        await db.commit()
+        await membership_cache.remove_members(group_id, removed)
+        if removed:
+            await self.invalidate(ids=[group_id])
+            await publish_changes([
+                {'entity': 'group', 'op': 'members_removed', 'id': group_id, 'group_id': group_id, 'user_ids': sorted(removed)}
+            ])
+        return GroupMembershipReport(
+            group_id=group_id,
+            removed=sorted(removed),
+            not_found=sorted(set(user_ids) - removed)
+        )
 
 
     async def delete_user_from_group(
@@ -99,47 +177,66 @@ class CRUDGroup(CRUDBase[Group, GroupCreate, GroupUpdate]):
         *,
         group_id: int,
         user_id: int,
-        current_user: User,
+        current_user: UserPrincipal,
         db: AsyncSession
     ):
-        group_obj = await self.get_all_users(db=db, id=group_id)
-        if current_user.id != group_obj.creator_id:
+        creator_id = await self._get_creator_id(group_id=group_id, db=db)
+        if current_user.id != creator_id:
             raise UserHaveNoRightsError(current_user.id, group_id)
-        if not group_obj:
-            raise GroupNotInDatabaseError(group_id=group_id)
         if current_user.id == user_id:
             raise ValueError(f'Wrong ID - {user_id}. You cannot delete yourself.')
 
-        if user_id not in [user.id for user in group_obj.users]:
+        report = await self.remove_users_from_group(group_id=group_id, user_ids=[user_id], db=db)
+        if not report.removed:
             raise UserNotInGroupError(user_id=user_id)
-        await db.execute(
-            delete(user_group)
-            .where(user_group.c.user_id == user_id)
-            .where(user_group.c.group_id == group_id))
-        await db.commit()
 
     async def leave_group(
         self,
         *,
         group_id: int,
-        current_user: User,
+        current_user: UserPrincipal,
         db: AsyncSession
     ):
-        user_group_obj = await self.get_all_users(db=db, id=group_id)
-        if not user_group_obj:
-            raise GroupNotInDatabaseError(group_id=group_id)
-        if current_user.id not in [user.id for user in user_group_obj.users]:
-            raise UserNotInGroupError(user_id=current_user.id)
-
-        group_obj = await self.get(db=db, id=group_id)
-        if current_user.id == group_obj.creator_id:
+        creator_id = await self._get_creator_id(group_id=group_id, db=db)
+        if current_user.id == creator_id:
             raise UserIsGroupCreator(current_user.id, group_id)
-        await db.execute(
-            delete(user_group)
-            .where(user_group.c.group_id == group_id)
-            .where(user_group.c.user_id == current_user.id))
-        await db.commit()
-
 
+        report = await self.remove_users_from_group(group_id=group_id, user_ids=[current_user.id], db=db)
+        if not report.removed:
+            raise UserNotInGroupError(user_id=current_user.id)
 
-group = CRUDGroup(Group)
\ No newline at end of file
+    @staticmethod
+    async def _bump_versions(*, ids: List[int], db: AsyncSession):
+        await db.execute(
+            update(Group)
+            .where(Group.id.in_(ids))
+            .values(version=Group.version + 1)
+            .execution_options(synchronize_session=False)
+        )
+
+    async def _get_creator_id(self, *, group_id: int, db: AsyncSession) -> int | None:
+        response = await db.execute(self.live(select(Group.creator_id).where(Group.id == group_id)))
+        row = response.first()
+        if row is None:
+            raise GroupNotInDatabaseError(group_id=group_id)
+        return row.creator_id
+
+    @staticmethod
+    async def _insert_members(*, group_id: int, user_ids: List[int], db: AsyncSession) -> dict[int, bool]:
+        candidates = select(User.id).where(User.id.in_(user_ids), User.deleted_at.is_(None)).cte('candidates')
+        inserted = (
+            insert(user_group)
+            .from_select(['user_id', 'group_id'], select(candidates.c.id, literal(group_id)))
+            .on_conflict_do_nothing()
+            .returning(user_group.c.user_id)
+            .cte('inserted')
+        )
+        response = await db.execute(
+            select(candidates.c.id, inserted.c.user_id.is_not(None))
+            .outerjoin(inserted, inserted.c.user_id == candidates.c.id)
+        )
+        return dict(response.tuples().all())
+
+
+
+group = CRUDGroup(Group, GroupWithUsers)
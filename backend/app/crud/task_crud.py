@@ -1,27 +1,508 @@
+from collections.abc import AsyncIterator, Awaitable, Callable, Sequence
+from datetime import datetime
+from typing import Any, TypeVar
+
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Column,
+    ColumnElement,
+    Integer,
+    MetaData,
+    Row,
+    String,
+    Table,
+    and_,
+    delete,
+    exists,
+    insert,
+    literal,
+    not_,
+    or_,
+    select,
+    text,
+    tuple_,
+    union_all
+)
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.schema import CreateTable
 
 from app.crud.base_crud import CRUDBase
-from app.models.task_model import Task
-from app.schemas.task_schema import TaskUpdate, TaskCreate
+from app.db.session import shard_router
+from app.models.group_model import Group, user_group
+from app.models.task_model import CURRENT_XID, Task, TaskArchive, TaskKey, TaskTombstone
 from app.models.user_model import User
-from app.utils.exceptions import TaskNotInDatabaseError
+from app.schemas.task_schema import TaskUpdate, TaskCreate, TaskResponse, TaskBulkUpdate, TaskAssign, BulkItemError
+from app.schemas.user_schema import UserPrincipal
+from app.utils.exceptions import (
+    ObjectAlreadyExistsError,
+    RelatedObjectNotFoundError,
+    RequiredValueMissingError,
+    TaskNotInDatabaseError
+)
 from app.crud.group_crud import group
+from app.utils.change_feed import publish_changes
+from app.utils.pagination import decode_cursor, decode_shard_cursors, encode_cursor, encode_shard_cursors
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+WRITE_ERRORS = (ObjectAlreadyExistsError, RelatedObjectNotFoundError, RequiredValueMissingError)
+
+# note: constraint names stay on the server, clients get a fixed message per constraint
+CONSTRAINT_DETAILS = {
+    'tasks_assignee_id_fkey': 'Assignee does not exist',
+    'tasks_reporter_id_fkey': 'Reporter does not exist',
+    'tasks_group_id_fkey': 'Group does not exist'
+}
+
+TASK_COLUMNS = tuple(column.name for column in Task.__table__.columns)
+
+SNAPSHOT_XMIN = text('pg_snapshot_xmin(pg_current_snapshot())::text::bigint')
+
+IMPORT_COLUMNS = (
+    'title', 'description', 'status', 'priority', 'assignee_id', 'reporter_id', 'is_done', 'group_id'
+)
+
+# note: session-local staging table for COPY, emptied by every commit
+task_import_staging = Table(
+    'task_import_staging',
+    MetaData(),
+    Column('row_number', BigInteger, nullable=False),
+    Column('title', String(256), nullable=False),
+    Column('description', String(500)),
+    Column('status', String, nullable=False),
+    Column('priority', String),
+    Column('assignee_id', Integer),
+    Column('reporter_id', Integer, nullable=False),
+    Column('is_done', Boolean, nullable=False),
+    Column('group_id', Integer, nullable=False),
+    prefixes=['TEMPORARY'],
+    postgresql_on_commit='DELETE ROWS'
+)
+
+
+def write_error_detail(e: Exception) -> str:
+    if isinstance(e, RequiredValueMissingError):
+        return f'{e.column or "A required field"} cannot be null'
+    if isinstance(e, ObjectAlreadyExistsError):
+        return 'Task already exists'
+    if isinstance(e, RelatedObjectNotFoundError):
+        return CONSTRAINT_DETAILS.get(e.constraint, 'A referenced object does not exist')
+    return 'Task violates a database constraint'
 
 
 class CRUDTask(CRUDBase[Task, TaskCreate, TaskUpdate]):
+    async def on_written(self, *, op: str, db_objs: Sequence[Task]):
+        await publish_changes([
+            {'entity': 'task', 'op': op, 'id': db_obj.id, 'group_id': db_obj.group_id, 'version': db_obj.version}
+            for db_obj in db_objs
+        ])
+
+    def write_values(self) -> dict[str, Any]:
+        return {**super().write_values(), 'change_xid': CURRENT_XID}
+
+    def by_id(self, id: Any) -> tuple[ColumnElement[bool], ...]:
+        # note: joined through task_keys so only the partition holding the row is scanned
+        return Task.id == id, TaskKey.id == id, Task.created_at == TaskKey.created_at
+
+    def by_ids(self, ids: Sequence[int]) -> tuple[ColumnElement[bool], ...]:
+        return Task.id == TaskKey.id, TaskKey.id.in_(ids), Task.created_at == TaskKey.created_at
+
+    async def get(self, *, db: AsyncSession, **filters) -> Task | TaskArchive | None:
+        # note: archived tasks are read through, writes only ever see the hot table
+        db_obj = await super().get(db=db, **filters)
+        if db_obj is not None:
+            return db_obj
+        response = await db.execute(select(TaskArchive).filter_by(**filters))
+        return response.scalar_one_or_none()
+
+    async def get_version(self, *, id: int, db: AsyncSession) -> int | None:
+        version = await super().get_version(id=id, db=db)
+        if version is not None:
+            return version
+        return await db.scalar(select(TaskArchive.version).where(TaskArchive.id == id))
+
+    async def on_deleting(self, *, db_objs: Sequence[Task], db: AsyncSession):
+        await db.execute(
+            insert(TaskTombstone),
+            [{'task_id': db_obj.id, 'group_id': db_obj.group_id} for db_obj in db_objs]
+        )
+
+    async def list_changes(
+        self,
+        *,
+        user_id: int,
+        db: AsyncSession,
+        cursor: str | None = None,
+        limit: int = 100
+    ) -> tuple[list[Task], list[int], str]:
+        if not shard_router.enabled:
+            return await self._list_shard_changes(user_id=user_id, db=db, cursor=cursor, limit=limit)
+        # note: xids are per database, so the cursor holds one watermark per shard and every shard is read
+        cursors = decode_shard_cursors(cursor, len(shard_router.shards))
+        shard_limit = -(-limit // len(cursors))
+        pages = await shard_router.fan_out(
+            lambda shard, shard_db: self._list_shard_changes(
+                user_id=user_id,
+                db=shard_db,
+                cursor=cursors[shard],
+                limit=shard_limit
+            ),
+            db=db
+        )
+        return (
+            [task_db for tasks, _, _ in pages for task_db in tasks],
+            [id for _, deleted, _ in pages for id in deleted],
+            encode_shard_cursors([next_cursor for _, _, next_cursor in pages])
+        )
+
+    async def _list_shard_changes(
+        self,
+        *,
+        user_id: int,
+        db: AsyncSession,
+        cursor: str | None = None,
+        limit: int = 100
+    ) -> tuple[list[Task], list[int], str]:
+        # note: the cursor is (floor, window start, last xid, last id). Transactions still running when a window
+        # starts have an xid >= its snapshot xmin, so the next window re-reads from there and cannot miss them
+        if cursor:
+            floor, window_start, after_xid, after_id = decode_cursor(
+                cursor,
+                [Task.change_xid, Task.change_xid, Task.change_xid, Task.id]
+            )
+        else:
+            floor, window_start, after_xid, after_id = 0, await db.scalar(select(SNAPSHOT_XMIN)), 0, 0
+
+        group_ids = select(user_group.c.group_id).where(user_group.c.user_id == user_id)
+        changed = select(Task.change_xid, Task.id, literal(False).label('deleted')).where(
+            Task.group_id.in_(group_ids),
+            Task.change_xid >= floor,
+            tuple_(Task.change_xid, Task.id) > tuple_(after_xid, after_id)
+        )
+        removed = select(TaskTombstone.change_xid, TaskTombstone.task_id, literal(True)).where(
+            TaskTombstone.group_id.in_(group_ids),
+            TaskTombstone.change_xid >= floor,
+            tuple_(TaskTombstone.change_xid, TaskTombstone.task_id) > tuple_(after_xid, after_id)
+        )
+        page = union_all(changed, removed).subquery()
+        response = await db.execute(select(page).order_by(page.c.change_xid, page.c.id).limit(limit + 1))
+        rows = response.all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        deleted = [row.id for row in rows if row.deleted]
+        updated_ids = [row.id for row in rows if not row.deleted]
+        tasks = []
+        if updated_ids:
+            response = await db.execute(
+                select(Task).where(*self.by_ids(updated_ids)).order_by(Task.change_xid, Task.id)
+            )
+            tasks = list(response.scalars().all())
+
+        if has_more:
+            next_cursor = encode_cursor([floor, window_start, rows[-1].change_xid, rows[-1].id])
+        else:
+            next_cursor = encode_cursor([window_start, await db.scalar(select(SNAPSHOT_XMIN)), 0, 0])
+        return tasks, deleted, next_cursor
+
     async def create_task(
         self,
         *,
         obj_in: TaskCreate,
-        current_user: User,
+        current_user: UserPrincipal,
         db: AsyncSession
     ) -> Task:
-        db_task = Task(**obj_in.model_dump(exclude_unset=True))
-        db_task.reporter_id = current_user.id
-        db.add(db_task)
-        await db.commit()
-        await db.refresh(db_task)
-        return db_task
+        return await self.create(
+            obj_in={**obj_in.model_dump(exclude_unset=True), 'reporter_id': current_user.id},
+            db=db
+        )
+
+    async def list_group_tasks(
+        self,
+        *,
+        group_id: int,
+        db: AsyncSession,
+        cursor: str | None = None,
+        limit: int = 50
+    ) -> tuple[list[Task], str | None]:
+        return await self.list_page(
+            db=db,
+            order_by=('created_at', 'id'),
+            cursor=cursor,
+            limit=limit,
+            group_id=group_id
+        )
+
+    async def stream_group_tasks(
+        self,
+        *,
+        group_id: int,
+        db: AsyncSession,
+        batch_size: int = 1000
+    ) -> AsyncIterator[Sequence[Row]]:
+        # note: plain rows from a server-side cursor, nothing is added to the identity map. Archived tasks are
+        # still the group's, they are exported with the rest
+        tasks = union_all(
+            select(*Task.__table__.c).where(Task.group_id == group_id),
+            select(*(TaskArchive.__table__.c[name] for name in TASK_COLUMNS)).where(TaskArchive.group_id == group_id)
+        ).subquery()
+        result = await db.stream(
+            select(tasks)
+            .order_by(tasks.c.created_at, tasks.c.id)
+            .execution_options(yield_per=batch_size)
+        )
+        async for rows in result.partitions():
+            yield rows
+
+    async def import_batch(
+        self,
+        *,
+        records: Sequence[tuple],
+        db: AsyncSession
+    ) -> tuple[int, list[BulkItemError]]:
+        group_column = IMPORT_COLUMNS.index('group_id') + 1
+        imported, errors = await self._on_shards(
+            objs_in={record[0]: record for record in records},
+            shards=await shard_router.group_shards({record[0]: record[group_column] for record in records}, write=True),
+            run=lambda records, shard_db: self._import_shard_batch(records=list(records.values()), db=shard_db),
+            db=db
+        )
+        return sum(imported), errors
+
+    async def _import_shard_batch(
+        self,
+        *,
+        records: Sequence[tuple],
+        db: AsyncSession
+    ) -> tuple[int, list[BulkItemError]]:
+        staging = task_import_staging
+        assignee = User.__table__.alias('assignee')
+        group_exists = exists().where(Group.id == staging.c.group_id)
+        reporter_exists = exists().where(User.id == staging.c.reporter_id)
+        assignee_exists = or_(
+            staging.c.assignee_id.is_(None),
+            exists().where(assignee.c.id == staging.c.assignee_id)
+        )
+        try:
+            await db.execute(CreateTable(staging, if_not_exists=True))
+            connection = await db.connection()
+            raw_connection = await connection.get_raw_connection()
+            await raw_connection.driver_connection.copy_records_to_table(
+                staging.name,
+                records=records,
+                columns=['row_number', *IMPORT_COLUMNS]
+            )
+            response = await db.execute(
+                select(staging.c.row_number, group_exists, reporter_exists, assignee_exists)
+                .where(not_(and_(group_exists, reporter_exists, assignee_exists)))
+            )
+            errors = [
+                BulkItemError(
+                    index=row_number,
+                    detail='; '.join(
+                        detail for ok, detail in (
+                            (group_ok, 'Group does not exist'),
+                            (reporter_ok, 'Reporter does not exist'),
+                            (assignee_ok, 'Assignee does not exist')
+                        ) if not ok
+                    )
+                )
+                for row_number, group_ok, reporter_ok, assignee_ok in response.tuples()
+            ]
+            inserted = await db.execute(
+                insert(Task).from_select(
+                    IMPORT_COLUMNS,
+                    select(*[staging.c[name] for name in IMPORT_COLUMNS])
+                    .where(group_exists, reporter_exists, assignee_exists)
+                    .order_by(staging.c.row_number)
+                )
+            )
+            await db.commit()
+        except IntegrityError as e:
+            # note: a referenced row was deleted between the check and the insert. The batch is split in halves
+            # until the failing rows are alone, the others are imported
+            await db.rollback()
+            if len(records) == 1:
+                detail = write_error_detail(self._typed_integrity_error(e))
+                return 0, [BulkItemError(index=records[0][0], detail=detail)]
+            middle = len(records) // 2
+            first_imported, first_errors = await self._import_shard_batch(records=records[:middle], db=db)
+            second_imported, second_errors = await self._import_shard_batch(records=records[middle:], db=db)
+            return first_imported + second_imported, first_errors + second_errors
+        return inserted.rowcount, errors
+
+    @staticmethod
+    async def _on_shards(
+        *,
+        objs_in: dict[int, T],
+        shards: dict[int, int | None],
+        run: Callable[[dict[int, T], AsyncSession], Awaitable[tuple[R, list[BulkItemError]]]],
+        db: AsyncSession
+    ) -> tuple[list[R], list[BulkItemError]]:
+        # note: items are split by the shard of their group and each part runs there, items of a group that is
+        # being moved are rejected for the client to retry
+        errors = [
+            BulkItemError(index=index, detail='Group is being moved to another shard, retry shortly')
+            for index, shard in shards.items() if shard is None
+        ]
+        by_shard: dict[int, dict[int, T]] = {}
+        for index, obj_in in objs_in.items():
+            if shards[index] is not None:
+                by_shard.setdefault(shards[index], {})[index] = obj_in
+        if not by_shard:
+            return [], errors
+        results = await shard_router.fan_out(
+            lambda shard, shard_db: run(by_shard[shard], shard_db),
+            shards=sorted(by_shard),
+            db=db
+        )
+        errors += [error for _, shard_errors in results for error in shard_errors]
+        return [result for result, _ in results], errors
+
+    async def bulk_create_tasks(
+        self,
+        *,
+        objs_in: dict[int, TaskCreate],
+        current_user: UserPrincipal,
+        db: AsyncSession
+    ) -> tuple[list[Task], list[BulkItemError]]:
+        created, errors = await self._on_shards(
+            objs_in=objs_in,
+            shards=await shard_router.group_shards(
+                {index: obj_in.group_id for index, obj_in in objs_in.items()},
+                write=True
+            ),
+            run=lambda objs_in, shard_db: self._bulk_create(objs_in=objs_in, current_user=current_user, db=shard_db),
+            db=db
+        )
+        return [task_db for tasks in created for task_db in tasks], errors
+
+    async def _bulk_create(
+        self,
+        *,
+        objs_in: dict[int, TaskCreate],
+        current_user: UserPrincipal,
+        db: AsyncSession
+    ) -> tuple[list[Task], list[BulkItemError]]:
+        response = await db.execute(
+            select(user_group.c.group_id)
+            .where(user_group.c.user_id == current_user.id)
+            .where(user_group.c.group_id.in_({obj_in.group_id for obj_in in objs_in.values()}))
+            .where(Group.id == user_group.c.group_id, Group.deleted_at.is_(None))
+        )
+        member_of = set(response.scalars().all())
+        existing_users = await self._existing_user_ids(
+            user_ids={obj_in.assignee_id for obj_in in objs_in.values() if obj_in.assignee_id is not None},
+            db=db
+        )
+
+        rows, errors = [], []
+        for index, obj_in in objs_in.items():
+            if obj_in.group_id not in member_of:
+                errors.append(BulkItemError(index=index, detail=f'User is not a member of group {obj_in.group_id}'))
+            elif obj_in.assignee_id is not None and obj_in.assignee_id not in existing_users:
+                errors.append(BulkItemError(index=index, detail=f'User {obj_in.assignee_id} does not exist'))
+            else:
+                rows.append({**obj_in.model_dump(exclude_unset=True), 'reporter_id': current_user.id})
+        return await self.create_many(objs_in=rows, db=db), errors
+
+    async def bulk_update_tasks(
+        self,
+        *,
+        objs_in: dict[int, TaskBulkUpdate],
+        current_user: UserPrincipal,
+        db: AsyncSession
+    ) -> tuple[list[Task], list[BulkItemError]]:
+        rows = {
+            index: {'id': obj_in.id, **obj_in.model_dump(exclude_unset=True, exclude={'id'})}
+            for index, obj_in in objs_in.items()
+        }
+        return await self._bulk_update_on_shards(rows=rows, current_user=current_user, db=db)
+
+    async def bulk_assign_users(
+        self,
+        *,
+        objs_in: dict[int, TaskAssign],
+        current_user: UserPrincipal,
+        db: AsyncSession
+    ) -> tuple[list[Task], list[BulkItemError]]:
+        existing_users = await self._existing_user_ids(
+            user_ids={obj_in.user_id for obj_in in objs_in.values()},
+            db=db
+        )
+        rows, errors = {}, []
+        for index, obj_in in objs_in.items():
+            if obj_in.user_id not in existing_users:
+                errors.append(BulkItemError(index=index, detail=f'User {obj_in.user_id} does not exist'))
+            else:
+                rows[index] = {'id': obj_in.task_id, 'assignee_id': obj_in.user_id}
+        updated, update_errors = await self._bulk_update_on_shards(rows=rows, current_user=current_user, db=db)
+        return updated, sorted(errors + update_errors, key=lambda error: error.index)
+
+    async def _bulk_update_on_shards(
+        self,
+        *,
+        rows: dict[int, dict],
+        current_user: UserPrincipal,
+        db: AsyncSession
+    ) -> tuple[list[Task], list[BulkItemError]]:
+        updated, errors = await self._on_shards(
+            objs_in=rows,
+            shards=await shard_router.task_shards({index: row['id'] for index, row in rows.items()}, write=True),
+            run=lambda rows, shard_db: self._bulk_update(rows=rows, current_user=current_user, db=shard_db),
+            db=db
+        )
+        return [task_db for tasks in updated for task_db in tasks], sorted(errors, key=lambda error: error.index)
+
+    async def _bulk_update(
+        self,
+        *,
+        rows: dict[int, dict],
+        current_user: UserPrincipal,
+        db: AsyncSession
+    ) -> tuple[list[Task], list[BulkItemError]]:
+        errors, seen = [], set()
+        for index, row in list(rows.items()):
+            if row['id'] in seen:
+                errors.append(BulkItemError(index=index, detail=f'Task {row["id"]} is listed more than once'))
+                del rows[index]
+            elif len(row) == 1:
+                errors.append(BulkItemError(index=index, detail='Nothing to update'))
+                del rows[index]
+            seen.add(row['id'])
+
+        where = [Task.group_id.in_(select(user_group.c.group_id).where(user_group.c.user_id == current_user.id))]
+        try:
+            updated = await self.update_many(objs_in=list(rows.values()), db=db, where=where)
+        except WRITE_ERRORS:
+            # note: one bad row rolls back the whole batch, so the batch is retried row by row to blame only that row
+            retried = []
+            for index, row in list(rows.items()):
+                try:
+                    retried += [task_db.id for task_db in await self.update_many(objs_in=[row], db=db, where=where)]
+                except WRITE_ERRORS as e:
+                    errors.append(BulkItemError(index=index, detail=write_error_detail(e)))
+                    del rows[index]
+            # note: each failed row's rollback expired the rows updated before it
+            response = await db.execute(select(Task).where(*self.by_ids(retried)))
+            updated = list(response.scalars().all())
+            await db.commit()
+        updated_ids = {task_db.id for task_db in updated}
+        errors += [
+            BulkItemError(index=index, detail=f'Task {row["id"]} does not exist')
+            for index, row in rows.items() if row['id'] not in updated_ids
+        ]
+        return updated, sorted(errors, key=lambda error: error.index)
+
+    @staticmethod
+    async def _existing_user_ids(*, user_ids: set[int], db: AsyncSession) -> set[int]:
+        if not user_ids:
+            return set()
+        response = await db.execute(select(User.id).where(User.id.in_(user_ids), User.deleted_at.is_(None)))
+        return set(response.scalars().all())
 
     async def update_task(
         self,
@@ -30,10 +511,7 @@ class CRUDTask(CRUDBase[Task, TaskCreate, TaskUpdate]):
         obj_in: TaskUpdate,
         db: AsyncSession
     ) -> Task | None:
-        existing_task = await self.get(db=db, id=id)
-        if not existing_task:
-            return None
-        return await self.update(obj_current=existing_task, obj_in=obj_in, db=db)
+        return await self.update_by_id(id=id, obj_in=obj_in, db=db)
 
     async def delete_task(
         self,
@@ -41,7 +519,71 @@ class CRUDTask(CRUDBase[Task, TaskCreate, TaskUpdate]):
         id: int,
         db: AsyncSession
     ):
-        return await self.delete(db=db, id=id)
+        db_obj = await self.delete(db=db, id=id)
+        if db_obj:
+            return db_obj
+        response = await db.execute(delete(TaskArchive).where(TaskArchive.id == id).returning(TaskArchive))
+        db_obj = response.scalar_one_or_none()
+        if db_obj:
+            await self.on_deleting(db_objs=[db_obj], db=db)
+        await db.commit()
+        if db_obj:
+            await self.invalidate(ids=[id])
+            await self.on_written(op='deleted', db_objs=[db_obj])
+        return db_obj
+
+    async def archive_done_tasks(
+        self,
+        *,
+        older_than: datetime,
+        db: AsyncSession,
+        limit: int = 1000
+    ) -> int:
+        # note: rows locked by a writer are skipped and picked up by a later batch instead of waited on
+        moved = (
+            delete(Task)
+            .where(Task.id.in_(
+                select(Task.id)
+                .where(Task.is_done, Task.updated_at < older_than)
+                .order_by(Task.id)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            ))
+            .returning(*Task.__table__.c)
+            .cte('moved')
+        )
+        response = await db.execute(
+            insert(TaskArchive)
+            .from_select(TASK_COLUMNS, select(*(moved.c[name] for name in TASK_COLUMNS)))
+            .returning(TaskArchive.id)
+        )
+        archived = len(response.all())
+        await db.commit()
+        return archived
+
+    async def restore_task(
+        self,
+        *,
+        id: int,
+        db: AsyncSession
+    ) -> Task | None:
+        # note: a restored task comes back as open work, otherwise the next archive run would move it again
+        restored = delete(TaskArchive).where(TaskArchive.id == id).returning(*TaskArchive.__table__.c).cte('restored')
+        columns = [name for name in TASK_COLUMNS if name not in ('is_done', 'version', 'change_xid', 'updated_at')]
+        response = await db.execute(
+            insert(Task)
+            .from_select(
+                [*columns, 'is_done', 'version'],
+                select(*(restored.c[name] for name in columns), literal(False), restored.c.version + 1)
+            )
+            .returning(Task)
+        )
+        db_obj = response.scalar_one_or_none()
+        await db.commit()
+        if db_obj:
+            await self.invalidate(ids=[id])
+            await self.on_written(op='updated', db_objs=[db_obj])
+        return db_obj
 
     async def assign_user_to_task(
         self,
@@ -50,12 +592,9 @@ class CRUDTask(CRUDBase[Task, TaskCreate, TaskUpdate]):
         user_id: int,
         db: AsyncSession
     ):
-        task_db = await self.get(db=db, id=task_id)
+        task_db = await self.update_by_id(id=task_id, obj_in={'assignee_id': user_id}, db=db)
         if not task_db:
             raise TaskNotInDatabaseError(task_id=task_id)
-        task_db.assignee_id = user_id
-        await db.commit()
-        await db.refresh(task_db)
         return task_db
 
-task = CRUDTask(Task)
\ No newline at end of file
+task = CRUDTask(Task, TaskResponse)
\ No newline at end of file
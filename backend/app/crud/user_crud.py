@@ -1,46 +1,68 @@
+from collections.abc import Sequence
+from typing import Any
+
 from pydantic import EmailStr
+from sqlalchemy import not_, select, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core.security import get_hashed_password, verify_password
+from app.core.security import get_hashed_password_async, verify_password_async
 from app.crud.base_crud import CRUDBase
+from app.crud.group_crud import group
+from app.db.session import shard_router
+from app.models.group_model import Group, user_group
+from app.models.deletion_model import Deletion
 from app.models.user_model import User
-from app.schemas.user_schema import UserCreate, UserUpdate
+from app.schemas.user_schema import UserCreate, UserResponse, UserUpdate
+
+# note: what groups embed of each member. The member's own version is left out, it moves with writes groups
+# do not show, a password change for one
+MEMBER_FIELDS = tuple(name for name in UserResponse.model_fields if name != 'version')
 
 
 class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
+    async def on_written(self, *, op: str, db_objs: Sequence[User]):
+        # note: tasks and memberships on every shard reference users, so each shard keeps a copy of the table
+        await shard_router.replicate(
+            User.__table__,
+            [{column.name: getattr(db_obj, column.key) for column in User.__table__.columns} for db_obj in db_objs]
+        )
+
     async def create_user(
         self,
         *,
         obj_in: UserCreate,
         db: AsyncSession
     ) -> User:
-        db_user = User(**obj_in.model_dump(exclude={'password'}))
-        db_user.hashed_password = get_hashed_password(obj_in.password)
-        db.add(db_user)
-        await db.commit()
-        await db.refresh(db_user)
-        return db_user
+        return await self.create(
+            obj_in={
+                **obj_in.model_dump(exclude={'password'}),
+                'hashed_password': await get_hashed_password_async(obj_in.password)
+            },
+            db=db
+        )
 
     async def update_user(
         self,
         *,
         id: int,
-        obj_in: UserUpdate,
+        obj_in: UserUpdate | dict[str, Any],
         db: AsyncSession
     ) -> User | None:
-        existing_user = await self.get(id=id, db=db)
-        if not existing_user:
-            return None
-        return await self.update(obj_current=existing_user, obj_in=obj_in, db=db)
+        update_data = obj_in if isinstance(obj_in, dict) else obj_in.model_dump(exclude_unset=True)
+        if 'password' in update_data:
+            update_data['hashed_password'] = await get_hashed_password_async(update_data.pop('password'))
+        before = await self._member_values(id=id, db=db) if update_data.keys() & set(MEMBER_FIELDS) else None
+        db_user = await self.update_by_id(id=id, obj_in=update_data, db=db)
+        if db_user and before is not None and before != tuple(getattr(db_user, name) for name in MEMBER_FIELDS):
+            await self._touch_groups(id=id, db=db)
+        return db_user
 
     async def update_user_is_active(self, *, id: int, db: AsyncSession) -> User | None:
-        existing_user = await self.get(id=id, db=db)
-        if not existing_user:
-            return None
-        existing_user.is_active = not existing_user.is_active
-        await db.commit()
-        await db.refresh(existing_user)
-        return existing_user
+        db_user = await self.update_by_id(id=id, obj_in={'is_active': not_(User.is_active)}, db=db)
+        if db_user:
+            await self._touch_groups(id=id, db=db)
+        return db_user
 
     async def authenticate(
         self,
@@ -52,12 +74,49 @@ class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
         existing_user = await self.get(email=str(email), db=db)
         if not existing_user:
             return None
-        if not verify_password(plain_password=password, hashed_password=existing_user.hashed_password):
+        if not await verify_password_async(password, existing_user.hashed_password):
             return None
         return existing_user
 
-    async def delete_user(self, *, id: int, db: AsyncSession) -> User | None:
-        return await self.delete(id=id, db=db)
+    async def delete_user(self, *, id: int, db: AsyncSession) -> Deletion | None:
+        # note: the user is deactivated and hidden at once, tasks, memberships and groups are purged in batches
+        pending = await self.mark_deleted(id=id, db=db, is_active=False)
+        if pending:
+            # note: the copies on other shards were marked by replication, each shard purges its own rows
+            await shard_router.fan_out(
+                lambda shard, shard_db: self._queue_shard_deletion(id=id, db=shard_db),
+                shards=shard_router.replicas
+            )
+        return pending
+
+    @staticmethod
+    async def _queue_shard_deletion(*, id: int, db: AsyncSession):
+        await db.execute(
+            insert(Deletion).values(entity=User.__tablename__, entity_id=id).on_conflict_do_nothing()
+        )
+        await db.commit()
+
+    @staticmethod
+    async def _member_values(*, id: int, db: AsyncSession) -> tuple | None:
+        response = await db.execute(select(*[getattr(User, name) for name in MEMBER_FIELDS]).where(User.id == id))
+        row = response.one_or_none()
+        return tuple(row) if row else None
+
+    async def _touch_groups(self, *, id: int, db: AsyncSession):
+        # note: groups embed their members, so a member change is a change of the group too
+        async def touch(shard: int, shard_db: AsyncSession) -> list[int]:
+            response = await shard_db.execute(
+                update(Group)
+                .where(Group.id.in_(select(user_group.c.group_id).where(user_group.c.user_id == id)))
+                .values(version=Group.version + 1)
+                .returning(Group.id)
+            )
+            await shard_db.commit()
+            return list(response.scalars().all())
+
+        # note: memberships live with their group, so a user's groups are collected from every shard
+        touched = await shard_router.fan_out(touch, db=db)
+        await group.invalidate(ids=[group_id for group_ids in touched for group_id in group_ids])
 
 
-user = CRUDUser(User)
+user = CRUDUser(User, UserResponse)
@@ -0,0 +1,90 @@
+import logging
+from datetime import date, datetime, timezone
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+# note: the upper bound of every partition of a range partitioned table, NULL for a MAXVALUE or DEFAULT partition
+PARTITION_UPPER_BOUNDS = text("""
+    SELECT (regexp_match(pg_get_expr(child.relpartbound, child.oid), 'TO \\(''([^'']+)''\\)'))[1]::timestamptz
+    FROM pg_inherits
+    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE pg_inherits.inhparent = CAST(:table AS regclass)
+""")
+
+
+def month_start(day: date, offset: int = 0) -> date:
+    month = day.month - 1 + offset
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(table: str, start: date) -> str:
+    return f'{table}_p{start:%Y_%m}'
+
+
+def default_partition_name(table: str) -> str:
+    return f'{table}_default'
+
+
+def create_partition_ddl(table: str, start: date, end: date, *, default: str | None = None) -> list[str]:
+    # note: CREATE TABLE ... PARTITION OF locks the parent against every reader and writer, attaching an empty
+    # table only takes SHARE UPDATE EXCLUSIVE on it. Rows of the month already in the default partition are moved
+    # over first, the attach refuses to leave them behind
+    name = partition_name(table, start)
+    bounds = f"'{start} 00:00:00+00'", f"'{end} 00:00:00+00'"
+    statements = [f'CREATE TABLE IF NOT EXISTS {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)']
+    if default:
+        statements.append(
+            f'WITH moved AS (DELETE FROM {default} WHERE created_at >= {bounds[0]} AND created_at < {bounds[1]} '
+            f'RETURNING *) INSERT INTO {name} SELECT * FROM moved'
+        )
+    statements.append(f'ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ({bounds[0]}) TO ({bounds[1]})')
+    return statements
+
+
+def monthly_partition_ddl(table: str, first: date, months: int) -> list[str]:
+    return [
+        statement
+        for offset in range(months)
+        for statement in create_partition_ddl(table, month_start(first, offset), month_start(first, offset + 1))
+    ]
+
+
+async def create_future_partitions(
+    db: AsyncSession,
+    *,
+    table: str,
+    months_ahead: int,
+    lock_timeout_ms: int = 2000
+) -> list[str]:
+    response = await db.execute(PARTITION_UPPER_BOUNDS, {'table': table})
+    bounds = [bound for bound in response.scalars().all() if bound is not None]
+    if not bounds:
+        return []
+    default = default_partition_name(table)
+    if not await db.scalar(text('SELECT to_regclass(:name) IS NOT NULL'), {'name': default}):
+        default = None
+    elif stray := await db.scalar(text(f'SELECT count(*) FROM {default}')):
+        logger.error('%s rows of %s fell past its last partition into %s', stray, table, default)
+    today = datetime.now(timezone.utc).date()
+    # note: a gap left while the worker was down is filled too, its rows are waiting in the default partition
+    start = max(bounds).astimezone(timezone.utc).date()
+    until = month_start(today, months_ahead + 1)
+    if start < month_start(today, 1):
+        logger.error('Partitions of %s end at %s, less than a month ahead', table, start)
+
+    created = []
+    while start < until:
+        end = month_start(start, 1)
+        # note: give up quickly instead of queueing every other query on tasks behind the attach, the next run retries
+        await db.execute(text(f"SET LOCAL lock_timeout = '{lock_timeout_ms}ms'"))
+        for statement in create_partition_ddl(table, start, end, default=default):
+            await db.execute(text(statement))
+        await db.commit()
+        created.append(partition_name(table, start))
+        start = end
+    if created:
+        logger.info('Created partitions %s of %s', ', '.join(created), table)
+    return created
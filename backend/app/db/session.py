@@ -1,27 +1,398 @@
-from collections.abc import AsyncGenerator
-from redis.asyncio import Redis, from_url
+import asyncio
+import logging
+from collections.abc import AsyncGenerator, Awaitable, Callable, Iterable
+from typing import TypeVar
+
+from fastapi import HTTPException, Request, status
+from jose import JWTError
+from redis.asyncio import ConnectionPool, Redis
+from redis.exceptions import RedisError
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from app.core.config import settings
+from app.core.instrumentation import InstrumentedRedis, TimedQueuePool, instrument_engine
+from app.core.security import decode_token
+from app.utils.cache import TTLCache
+from app.utils.exceptions import GroupIsMovingError
+from app.utils.invalidation import publish_invalidation, register_handler
 
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy import Table, bindparam, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
 
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+SHARD_NAMESPACE = 'shard'
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# note: the directory lives on the primary, plain SQL because the models import Base from here
+GROUP_SHARD = text('SELECT shard, frozen FROM group_shards WHERE group_id = :group_id')
+
+ALLOCATE_GROUP = text("""
+    WITH allocated AS (SELECT nextval('groups_id_seq') AS group_id)
+    INSERT INTO group_shards (group_id, shard)
+    SELECT group_id, group_id % :shards FROM allocated
+    RETURNING group_id, shard
+""")
 
-engine = create_async_engine(url=str(settings.DATABASE_URL))
+TASK_GROUPS = text("""
+    SELECT tasks.id, tasks.group_id FROM task_keys
+    JOIN tasks ON tasks.id = task_keys.id AND tasks.created_at = task_keys.created_at
+    WHERE task_keys.id IN :ids
+    UNION ALL
+    SELECT id, group_id FROM tasks_archive WHERE id IN :ids
+""").bindparams(bindparam('ids', expanding=True))
+
+
+engine = create_async_engine(url=str(settings.DATABASE_URL), poolclass=TimedQueuePool, pool_logging_name='primary')
+
+read_engine = (
+    create_async_engine(
+        url=str(settings.DATABASE_REPLICA_URL),
+        pool_pre_ping=True,
+        poolclass=TimedQueuePool,
+        pool_logging_name='replica'
+    )
+    if settings.DATABASE_REPLICA_URL else None
+)
 
 Base = declarative_base()
 
 Session = async_sessionmaker(bind=engine, expire_on_commit=False)
 
+ReadSession = async_sessionmaker(bind=read_engine, expire_on_commit=False) if read_engine else None
 
-async def get_redis_db() -> Redis:
-    redis = await from_url(
-        url=str(settings.REDIS_URL),
-        encoding='utf8',
-        decode_responses=True
+# note: shard 0 is the primary above, every other shard is a database with the same schema
+shard_engines = [
+    engine,
+    *(
+        create_async_engine(url=str(url), poolclass=TimedQueuePool, pool_logging_name=f'shard{shard}')
+        for shard, url in enumerate(settings.DATABASE_SHARD_URLS, start=1)
     )
-    return redis
+]
+
+for instrumented_engine in (*shard_engines, read_engine):
+    if instrumented_engine is not None:
+        instrument_engine(instrumented_engine)
+
+
+redis_pool = ConnectionPool.from_url(
+    url=str(settings.REDIS_URL),
+    encoding='utf8',
+    decode_responses=True,
+    max_connections=settings.REDIS_MAX_CONNECTIONS
+)
+
+redis_client = InstrumentedRedis(connection_pool=redis_pool)
+
+
+class ReplicaHealth:
+    def __init__(self):
+        self.healthy = False
+
+    async def monitor(self, interval: float):
+        while True:
+            try:
+                async with read_engine.connect() as connection:
+                    await connection.execute(text('SELECT 1'))
+                if not self.healthy:
+                    logger.info('Read replica is healthy, routing reads to it')
+                self.healthy = True
+            except (SQLAlchemyError, OSError):
+                if self.healthy:
+                    logger.warning('Read replica health check failed, routing reads to primary')
+                self.healthy = False
+            await asyncio.sleep(interval)
+
+
+replica_health = ReplicaHealth()
+
+
+async def close_redis():
+    await redis_client.aclose()
+    await redis_pool.disconnect()
+
+
+# note: groups, and through them their tasks and members, are placed by a directory table on the primary, so one
+# can be moved without rehashing the others. Users are a reference table copied to every shard. Every shard allocates
+# task ids from its own block, which makes the shard that created a task the first place to look for it
+class ShardRouter:
+    def __init__(self, engines: list):
+        self.engines = engines
+        self.sessions = [Session, *(async_sessionmaker(bind=engine, expire_on_commit=False) for engine in engines[1:])]
+        self.directory: TTLCache[int, tuple[int, bool]] = TTLCache(
+            max_size=settings.SHARD_DIRECTORY_CACHE_MAX_SIZE,
+            ttl=settings.SHARD_DIRECTORY_CACHE_TTL_SECONDS
+        )
+        # note: a task never changes group, so its group is cached for as long as it stays in memory
+        self.task_groups: TTLCache[int, int] = TTLCache(
+            max_size=settings.SHARD_DIRECTORY_CACHE_MAX_SIZE,
+            ttl=settings.SHARD_DIRECTORY_CACHE_TTL_SECONDS * 60
+        )
+        register_handler(SHARD_NAMESPACE, lambda key: self.directory.pop(int(key)), self.directory.clear)
+
+    @property
+    def enabled(self) -> bool:
+        return len(self.sessions) > 1
+
+    @property
+    def shards(self) -> range:
+        return range(len(self.sessions))
+
+    @property
+    def replicas(self) -> range:
+        return range(1, len(self.sessions))
+
+    def session(self, shard: int) -> AsyncSession:
+        return self.sessions[shard]()
+
+    async def locate_group(self, group_id: int) -> tuple[int, bool]:
+        if not self.enabled:
+            return 0, False
+        located = self.directory.get(group_id)
+        if located is None:
+            async with Session() as db:
+                row = (await db.execute(GROUP_SHARD, {'group_id': group_id})).first()
+            located = (row.shard, row.frozen) if row else (0, False)
+            self.directory.set(group_id, located)
+        return located
+
+    async def shard_for_group(self, group_id: int, *, write: bool = False) -> int:
+        shard, frozen = await self.locate_group(group_id)
+        if write and frozen:
+            raise GroupIsMovingError(group_id)
+        return shard
+
+    async def group_shards(self, group_ids: dict[int, int], *, write: bool = False) -> dict[int, int | None]:
+        # note: keyed like the input, None where the group is being moved
+        shards = {}
+        for group_id in set(group_ids.values()):
+            try:
+                shards[group_id] = await self.shard_for_group(group_id, write=write)
+            except GroupIsMovingError:
+                shards[group_id] = None
+        return {key: shards[group_id] for key, group_id in group_ids.items()}
+
+    async def allocate_group(self) -> tuple[int | None, int]:
+        if not self.enabled:
+            return None, 0
+        # note: ids come from the primary's sequence so they stay unique across shards
+        async with Session() as db:
+            row = (await db.execute(ALLOCATE_GROUP, {'shards': len(self.sessions)})).one()
+            await db.commit()
+        self.directory.set(row.group_id, (row.shard, False))
+        return row.group_id, row.shard
+
+    async def place_group(self, group_id: int, *, shard: int, frozen: bool = False):
+        async with Session() as db:
+            await db.execute(
+                text("""
+                    INSERT INTO group_shards (group_id, shard, frozen) VALUES (:group_id, :shard, :frozen)
+                    ON CONFLICT (group_id) DO UPDATE
+                    SET shard = EXCLUDED.shard, frozen = EXCLUDED.frozen, updated_at = now()
+                """),
+                {'group_id': group_id, 'shard': shard, 'frozen': frozen}
+            )
+            await db.commit()
+        await publish_invalidation(redis_client, SHARD_NAMESPACE, group_id)
+
+    def origin_shard(self, task_id: int) -> int:
+        return min(task_id // settings.SHARD_TASK_ID_BLOCK_SIZE, len(self.sessions) - 1)
+
+    async def locate_tasks(self, ids: Iterable[int]) -> dict[int, int]:
+        # note: the group of every task found, looked up on the shard that created it first and on all others after
+        found, missing = {}, set()
+        for id in ids:
+            group_id = self.task_groups.get(id)
+            if group_id is None:
+                missing.add(id)
+            else:
+                found[id] = group_id
+        if not missing:
+            return found
+
+        async def load(db: AsyncSession, ids: list[int]) -> dict[int, int]:
+            response = await db.execute(TASK_GROUPS, {'ids': ids})
+            return {row.id: row.group_id for row in response.all() if row.group_id is not None}
+
+        by_origin: dict[int, list[int]] = {}
+        for id in missing:
+            by_origin.setdefault(self.origin_shard(id), []).append(id)
+        located = {}
+        for groups in await self.fan_out(lambda shard, db: load(db, by_origin[shard]), shards=list(by_origin)):
+            located.update(groups)
+        # note: tasks keep their id when their group is moved, so they may have left the shard that created them
+        elsewhere = sorted(missing - set(located))
+        if elsewhere:
+            for groups in await self.fan_out(lambda shard, db: load(db, elsewhere)):
+                located.update(groups)
+        for id, group_id in located.items():
+            self.task_groups.set(id, group_id)
+        return {**found, **located}
+
+    async def task_shards(self, ids: dict[int, int], *, write: bool = False) -> dict[int, int | None]:
+        # note: tasks that do not exist go to the shard that would have created them, to be reported there
+        if not self.enabled:
+            return {key: 0 for key in ids}
+        groups = await self.locate_tasks(ids.values())
+        shards = await self.group_shards(
+            {key: groups[id] for key, id in ids.items() if id in groups},
+            write=write
+        )
+        return {key: shards[key] if key in shards else self.origin_shard(id) for key, id in ids.items()}
+
+    async def shard_for_task(self, id: int, *, write: bool = False) -> int:
+        shard = (await self.task_shards({id: id}, write=write))[id]
+        if shard is None:
+            raise GroupIsMovingError((await self.locate_tasks([id]))[id])
+        return shard
+
+    async def fan_out(
+        self,
+        load: Callable[[int, AsyncSession], Awaitable[T]],
+        *,
+        shards: Iterable[int] | None = None,
+        db: AsyncSession | None = None
+    ) -> list[T]:
+        # note: runs load on every shard concurrently, each in its own session. The caller's session serves shard 0
+        shards = list(self.shards if shards is None else shards)
+
+        async def run(shard: int) -> T:
+            if shard == 0 and db is not None:
+                return await load(shard, db)
+            async with self.sessions[shard]() as shard_db:
+                return await load(shard, shard_db)
+
+        if len(shards) == 1:
+            return [await run(shards[0])]
+        return list(await asyncio.gather(*(run(shard) for shard in shards)))
+
+    async def replicate(self, table: Table, rows: list[dict]):
+        # note: reference tables are written on the primary and upserted everywhere else
+        if not self.enabled or not rows:
+            return
+        statement = insert(table).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[column.name for column in table.primary_key],
+            set_={name: statement.excluded[name] for name in rows[0] if name not in table.primary_key.columns}
+        )
+
+        async def upsert(shard: int, db: AsyncSession):
+            await db.execute(statement)
+            await db.commit()
+
+        await self.fan_out(upsert, shards=self.replicas)
+
+    async def dispose(self):
+        for shard_engine in self.engines:
+            await shard_engine.dispose()
+
+
+shard_router = ShardRouter(shard_engines)
+
+
+async def get_redis_db() -> Redis:
+    return redis_client
 
 async def get_db() -> AsyncGenerator:
     async with Session() as db:
         yield db
+
+
+def _group_is_moving(group_id: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=f'Group {group_id} is being moved, retry shortly',
+        headers={'Retry-After': str(int(settings.SHARD_MOVE_FREEZE_SECONDS) or 1)}
+    )
+
+
+async def get_group_db(request: Request, group_id: int) -> AsyncGenerator:
+    try:
+        shard = await shard_router.shard_for_group(group_id, write=request.method not in SAFE_METHODS)
+    except GroupIsMovingError:
+        raise _group_is_moving(group_id)
+    async with shard_router.session(shard) as db:
+        yield db
+
+
+async def get_task_db(request: Request, id: int) -> AsyncGenerator:
+    try:
+        shard = await shard_router.shard_for_task(id, write=request.method not in SAFE_METHODS)
+    except GroupIsMovingError as e:
+        raise _group_is_moving(e.group_id)
+    async with shard_router.session(shard) as db:
+        yield db
+
+
+def _primary_pin_key(request: Request) -> str:
+    authorization = request.headers.get('Authorization', '')
+    scheme, _, token = authorization.partition(' ')
+    if scheme.lower() == 'bearer' and token:
+        try:
+            return f'user:{decode_token(token)["sub"]}:primary_pin'
+        except (JWTError, KeyError):
+            pass
+    client_host = request.client.host if request.client else 'unknown'
+    return f'client:{client_host}:primary_pin'
+
+
+async def pin_to_primary(request: Request):
+    try:
+        await redis_client.set(_primary_pin_key(request), 1, ex=settings.REPLICA_READ_YOUR_WRITES_SECONDS)
+    except RedisError:
+        logger.warning('Could not pin client to primary after write')
+
+
+class PrimaryPinMiddleware:
+    # note: the pin is set before the response starts, so the client cannot read from the replica before it exists
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if read_engine is None or scope['type'] != 'http' or scope['method'] in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_after_pin(message: Message):
+            if message['type'] == 'http.response.start' and message['status'] < 400:
+                await pin_to_primary(Request(scope))
+            await send(message)
+
+        await self.app(scope, receive, send_after_pin)
+
+
+async def _is_pinned_to_primary(request: Request) -> bool:
+    try:
+        return bool(await redis_client.exists(_primary_pin_key(request)))
+    except RedisError:
+        return True
+
+
+async def _read_session(request: Request) -> async_sessionmaker:
+    if ReadSession is None or not replica_health.healthy or await _is_pinned_to_primary(request):
+        return Session
+    return ReadSession
+
+
+async def get_read_db(request: Request) -> AsyncGenerator:
+    async with (await _read_session(request))() as db:
+        yield db
+
+
+# note: the read replica only mirrors the primary, reads of groups on other shards go to their shard
+async def get_group_read_db(request: Request, group_id: int) -> AsyncGenerator:
+    shard = await shard_router.shard_for_group(group_id)
+    async with (await _read_session(request) if shard == 0 else shard_router.sessions[shard])() as db:
+        yield db
+
+
+async def get_task_read_db(request: Request, id: int) -> AsyncGenerator:
+    shard = await shard_router.shard_for_task(id)
+    async with (await _read_session(request) if shard == 0 else shard_router.sessions[shard])() as db:
+        yield db
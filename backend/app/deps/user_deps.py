@@ -10,18 +10,49 @@ from app.models.user_model import User
 from app.core.security import decode_token
 from app.db.session import get_db, get_redis_db
 from app.crud.user_crud import user
-from app.core.config import TokenType
-from app.utils.token import get_valid_tokens, delete_tokens, add_tokens_to_redis
+from app.core.config import settings, TokenType
+from app.schemas.user_schema import UserPrincipal
+from app.utils.principal_cache import principal_cache
+from app.utils.token import is_token_valid, hash_token
+from app.utils.token_epoch import get_token_epoch
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='/api/v1/login/access-token')
 
 
+async def _get_stateless_principal(payload: dict, redis_client: Redis) -> UserPrincipal:
+    if payload['type'] != 'access' or payload['epoch'] != await get_token_epoch(redis_client, payload['sub']):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Wrong credentials'
+        )
+    if not payload['active']:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='User is inactive'
+        )
+    return UserPrincipal(id=int(payload['sub']), is_active=payload['active'], role=payload['role'])
+
+
 async def get_current_user(
     access_token: Annotated[str, Depends(oauth2_scheme)],
     redis_client: Annotated[Redis, Depends(get_redis_db)],
     db: Annotated[AsyncSession, Depends(get_db)]
-) -> User:
+) -> UserPrincipal:
+    return await _get_principal(access_token, redis_client, db)
+
+
+# note: for streaming responses. A request scoped session is only closed once the stream ends, this one is
+# closed as soon as the endpoint returns so a long lived stream does not hold a pooled connection
+async def get_streaming_user(
+    access_token: Annotated[str, Depends(oauth2_scheme)],
+    redis_client: Annotated[Redis, Depends(get_redis_db)],
+    db: Annotated[AsyncSession, Depends(get_db, scope='function')]
+) -> UserPrincipal:
+    return await _get_principal(access_token, redis_client, db)
+
+
+async def _get_principal(access_token: str, redis_client: Redis, db: AsyncSession) -> UserPrincipal:
     try:
         payload = decode_token(access_token)
     except ExpiredSignatureError:
@@ -30,9 +61,16 @@ async def get_current_user(
             detail='Token is expired'
         )
 
+    if settings.STATELESS_ACCESS_TOKENS and 'epoch' in payload:
+        return await _get_stateless_principal(payload, redis_client)
+
+    token_hash = hash_token(access_token)
+    principal = principal_cache.get(token_hash)
+    if principal is not None:
+        return principal
+
     user_id = payload['sub']
-    valid_access_token = await get_valid_tokens(redis_client, user_id, TokenType.access)
-    if not valid_access_token or access_token not in valid_access_token:
+    if not await is_token_valid(redis_client, user_id, access_token, TokenType.access):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Wrong credentials'
@@ -51,4 +89,18 @@ async def get_current_user(
             detail='User is inactive'
         )
 
-    return user_in_db
+    principal = UserPrincipal.model_validate(user_in_db)
+    principal_cache.set(token_hash, principal)
+    return principal
+
+
+async def get_current_admin(
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)]
+) -> UserPrincipal:
+    if current_user.role != 'admin':
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail='Admin rights required'
+        )
+    return current_user
+
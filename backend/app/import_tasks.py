@@ -0,0 +1,34 @@
+import argparse
+import asyncio
+import sys
+from collections.abc import AsyncIterator
+
+from app.core.config import settings
+from app.db.session import Session, shard_router
+from app.utils.export import DataFormat
+from app.utils.task_import import import_tasks
+
+
+async def _read_file(path: str, chunk_size: int = 1 << 20) -> AsyncIterator[bytes]:
+    with open(path, 'rb') as file:
+        while chunk := await asyncio.to_thread(file.read, chunk_size):
+            yield chunk
+
+
+async def main(path: str, data_format: DataFormat, batch_size: int) -> int:
+    async with Session() as db:
+        report = await import_tasks(_read_file(path), data_format=data_format, db=db, batch_size=batch_size)
+    await shard_router.dispose()
+    for error in report.rejected:
+        print(f'row {error.index}: {error.detail}', file=sys.stderr)
+    print(f'Imported {report.imported} tasks, rejected {len(report.rejected)} rows')
+    return 1 if report.rejected else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bulk import tasks with PostgreSQL COPY')
+    parser.add_argument('path')
+    parser.add_argument('--format', type=DataFormat, choices=list(DataFormat), default=DataFormat.ndjson)
+    parser.add_argument('--batch-size', type=int, default=settings.IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.path, args.format, args.batch_size)))
@@ -0,0 +1,40 @@
+from typing import Any
+
+from app.crud.deletion_crud import deletion
+from app.crud.task_crud import task
+from app.db.session import Session, shard_router
+from app.jobs.queue import job
+from app.models.user_model import User
+from app.schemas.task_schema import BulkItemError, TaskAssign, TaskBulkResponse
+from app.schemas.user_schema import UserPrincipal
+from app.utils.exceptions import JobFailedPermanentlyError
+
+
+@job('purge_deletion')
+async def purge_deletion(payload: dict[str, Any]) -> dict[str, Any]:
+    # note: groups are purged on their shard, users on the primary and then on every other one
+    shard = payload.get('shard', 0)
+    async with shard_router.session(shard) as db:
+        pending = await deletion.purge(id=payload['deletion_id'], db=db)
+    if not pending:
+        raise JobFailedPermanentlyError(f'Deletion {payload["deletion_id"]} not found')
+    deleted_rows = pending.deleted_rows
+    if pending.entity == User.__tablename__:
+        deleted_rows += await deletion.purge_replicas(entity=pending.entity, entity_id=pending.entity_id)
+    return {'entity': pending.entity, 'entity_id': pending.entity_id, 'deleted_rows': deleted_rows}
+
+
+@job('bulk_assign_tasks')
+async def bulk_assign_tasks(payload: dict[str, Any]) -> dict[str, Any]:
+    objs_in = {int(index): TaskAssign.model_validate(item) for index, item in payload['items'].items()}
+    errors = [BulkItemError.model_validate(error) for error in payload['errors']]
+    async with Session() as db:
+        updated, assign_errors = await task.bulk_assign_users(
+            objs_in=objs_in,
+            current_user=UserPrincipal.model_validate(payload['current_user']),
+            db=db
+        )
+    return TaskBulkResponse(
+        items=updated,
+        errors=sorted(errors + assign_errors, key=lambda error: error.index)
+    ).model_dump(mode='json')
@@ -0,0 +1,171 @@
+import json
+import time
+import uuid
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from redis.asyncio import Redis
+
+from app.core.config import settings
+
+QUEUED_KEY = 'jobs:queued'
+PROCESSING_KEY = 'jobs:processing'
+
+# note: queued is a sorted set scored by the time a job becomes runnable, so retries with backoff are just
+# re-scheduled entries; processing is scored by the visibility deadline of the worker holding the job
+RESERVE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local deadline = tonumber(ARGV[2])
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, 1)
+if #ids == 0 then
+    return nil
+end
+local job_id = ids[1]
+redis.call('ZREM', KEYS[1], job_id)
+redis.call('ZADD', KEYS[2], deadline, job_id)
+redis.call('HSET', 'job:' .. job_id, 'status', 'running', 'updated_at', ARGV[3])
+local attempt = redis.call('HINCRBY', 'job:' .. job_id, 'attempts', 1)
+return {job_id, attempt}
+"""
+
+REQUEUE_EXPIRED_SCRIPT = """
+local now = tonumber(ARGV[1])
+local ids = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)
+for _, job_id in ipairs(ids) do
+    redis.call('ZREM', KEYS[2], job_id)
+    redis.call('ZADD', KEYS[1], now, job_id)
+    redis.call('HSET', 'job:' .. job_id, 'status', 'queued', 'error', 'Visibility timeout expired', 'updated_at', ARGV[2])
+end
+return #ids
+"""
+
+# note: finishing is conditional on the attempt number, so a worker whose visibility timeout expired
+# cannot overwrite the outcome of the attempt that replaced it
+COMPLETE_SCRIPT = """
+if redis.call('HGET', KEYS[2], 'attempts') ~= ARGV[2] then
+    return 0
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HSET', KEYS[2], 'status', 'succeeded', 'result', ARGV[3], 'error', '', 'updated_at', ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+return 1
+"""
+
+FAIL_SCRIPT = """
+if redis.call('HGET', KEYS[3], 'attempts') ~= ARGV[2] then
+    return 0
+end
+redis.call('ZREM', KEYS[2], ARGV[1])
+local attempts = tonumber(ARGV[2])
+local max_attempts = tonumber(redis.call('HGET', KEYS[3], 'max_attempts'))
+if ARGV[6] == '1' and attempts < max_attempts then
+    local backoff = math.min(tonumber(ARGV[8]) * 2 ^ (attempts - 1), tonumber(ARGV[9]))
+    redis.call('ZADD', KEYS[1], tonumber(ARGV[7]) + backoff, ARGV[1])
+    redis.call('HSET', KEYS[3], 'status', 'retrying', 'error', ARGV[3], 'updated_at', ARGV[4])
+else
+    redis.call('HSET', KEYS[3], 'status', 'failed', 'error', ARGV[3], 'updated_at', ARGV[4])
+    redis.call('EXPIRE', KEYS[3], ARGV[5])
+end
+return 1
+"""
+
+JobHandler = Callable[[dict[str, Any]], Awaitable[Any]]
+
+handlers: dict[str, JobHandler] = {}
+
+
+def job(name: str) -> Callable[[JobHandler], JobHandler]:
+    def register(handler: JobHandler) -> JobHandler:
+        handlers[name] = handler
+        return handler
+    return register
+
+
+def status_url(job_id: str) -> str:
+    return f'/api/v1/job/{job_id}'
+
+
+def _job_key(job_id: str) -> str:
+    return f'job:{job_id}'
+
+
+def _now() -> str:
+    return f'{time.time():.3f}'
+
+
+async def enqueue(
+    redis_client: Redis,
+    name: str,
+    payload: dict[str, Any],
+    *,
+    owner_id: int | None = None,
+    max_attempts: int | None = None
+) -> str:
+    job_id = uuid.uuid4().hex
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.hset(_job_key(job_id), mapping={
+            'name': name,
+            'payload': json.dumps(payload),
+            'status': 'queued',
+            'attempts': 0,
+            'max_attempts': max_attempts or settings.JOB_MAX_ATTEMPTS,
+            'owner_id': '' if owner_id is None else owner_id,
+            'created_at': _now(),
+            'updated_at': _now()
+        })
+        pipe.zadd(QUEUED_KEY, {job_id: time.time()})
+        await pipe.execute()
+    return job_id
+
+
+async def get_job(redis_client: Redis, job_id: str) -> dict[str, Any] | None:
+    data = await redis_client.hgetall(_job_key(job_id))
+    return data or None
+
+
+async def reserve(redis_client: Redis) -> tuple[str, int] | None:
+    now = time.time()
+    script = redis_client.register_script(RESERVE_SCRIPT)
+    reserved = await script(
+        keys=[QUEUED_KEY, PROCESSING_KEY],
+        args=[now, now + settings.JOB_VISIBILITY_TIMEOUT_SECONDS, _now()]
+    )
+    if not reserved:
+        return None
+    job_id, attempt = reserved
+    return job_id, int(attempt)
+
+
+async def extend_visibility(redis_client: Redis, job_id: str):
+    await redis_client.zadd(PROCESSING_KEY, {job_id: time.time() + settings.JOB_VISIBILITY_TIMEOUT_SECONDS}, xx=True)
+
+
+async def requeue_expired(redis_client: Redis) -> int:
+    script = redis_client.register_script(REQUEUE_EXPIRED_SCRIPT)
+    return await script(keys=[QUEUED_KEY, PROCESSING_KEY], args=[time.time(), _now()])
+
+
+async def complete(redis_client: Redis, job_id: str, attempt: int, result: Any) -> bool:
+    script = redis_client.register_script(COMPLETE_SCRIPT)
+    return bool(await script(
+        keys=[PROCESSING_KEY, _job_key(job_id)],
+        args=[job_id, attempt, json.dumps(result), _now(), settings.JOB_RESULT_TTL_SECONDS]
+    ))
+
+
+async def fail(redis_client: Redis, job_id: str, attempt: int, error: str, *, retry: bool = True) -> bool:
+    script = redis_client.register_script(FAIL_SCRIPT)
+    return bool(await script(
+        keys=[QUEUED_KEY, PROCESSING_KEY, _job_key(job_id)],
+        args=[
+            job_id,
+            attempt,
+            error,
+            _now(),
+            settings.JOB_RESULT_TTL_SECONDS,
+            int(retry),
+            time.time(),
+            settings.JOB_RETRY_BACKOFF_SECONDS,
+            settings.JOB_RETRY_BACKOFF_MAX_SECONDS
+        ]
+    ))
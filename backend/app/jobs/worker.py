@@ -0,0 +1,128 @@
+import asyncio
+import json
+import logging
+import signal
+from contextlib import suppress
+
+from redis.exceptions import RedisError
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.archive_tasks import archive_done_tasks
+from app.core.config import settings
+from app.db.partitioning import create_future_partitions
+from app.db.session import close_redis, redis_client, shard_router
+from app.jobs import handlers, queue  # noqa: F401 - importing handlers registers them
+from app.utils.exceptions import JobFailedPermanentlyError
+
+logger = logging.getLogger(__name__)
+
+
+async def _keep_visible(job_id: str):
+    while True:
+        await asyncio.sleep(settings.JOB_VISIBILITY_TIMEOUT_SECONDS / 3)
+        try:
+            await queue.extend_visibility(redis_client, job_id)
+        except RedisError:
+            logger.warning('Could not extend the visibility timeout of job %s', job_id)
+
+
+async def run_job(job_id: str, attempt: int):
+    data = await queue.get_job(redis_client, job_id)
+    handler = queue.handlers.get(data['name']) if data else None
+    if handler is None:
+        await queue.fail(redis_client, job_id, attempt, f'Unknown job {data and data["name"]}', retry=False)
+        return
+
+    heartbeat = asyncio.create_task(_keep_visible(job_id))
+    try:
+        result = await handler(json.loads(data['payload']))
+    except JobFailedPermanentlyError as e:
+        await queue.fail(redis_client, job_id, attempt, e.detail, retry=False)
+    except Exception as e:
+        logger.exception('Job %s (%s) failed on attempt %s', job_id, data['name'], attempt)
+        await queue.fail(redis_client, job_id, attempt, repr(e))
+    else:
+        await queue.complete(redis_client, job_id, attempt, result)
+    finally:
+        heartbeat.cancel()
+
+
+async def _consume(stopping: asyncio.Event):
+    while not stopping.is_set():
+        try:
+            reserved = await queue.reserve(redis_client)
+        except RedisError:
+            logger.warning('Could not reserve a job, retrying')
+            reserved = None
+        if reserved is None:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(stopping.wait(), settings.JOB_POLL_INTERVAL_SECONDS)
+            continue
+        try:
+            await run_job(*reserved)
+        except RedisError:
+            # note: the job stays reserved and is retried once its visibility timeout expires
+            logger.warning('Lost the queue while running job %s', reserved[0])
+
+
+async def _requeue_expired(stopping: asyncio.Event):
+    while not stopping.is_set():
+        try:
+            if requeued := await queue.requeue_expired(redis_client):
+                logger.warning('Requeued %s jobs whose visibility timeout expired', requeued)
+        except RedisError:
+            logger.warning('Could not requeue expired jobs')
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(stopping.wait(), settings.JOB_VISIBILITY_TIMEOUT_SECONDS / 2)
+
+
+async def _archive_done_tasks(stopping: asyncio.Event):
+    # note: every worker runs this, batches skip rows another worker has locked so the runs do not collide
+    while not stopping.is_set():
+        try:
+            if archived := await archive_done_tasks(
+                older_than_days=settings.TASK_ARCHIVE_AFTER_DAYS,
+                batch_size=settings.TASK_ARCHIVE_BATCH_SIZE
+            ):
+                logger.info('Archived %s done tasks', archived)
+        except (SQLAlchemyError, OSError):
+            logger.exception('Archiving done tasks failed')
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(stopping.wait(), settings.TASK_ARCHIVE_INTERVAL_SECONDS)
+
+
+async def _create_task_partitions(stopping: asyncio.Event):
+    while not stopping.is_set():
+        try:
+            for shard in shard_router.shards:
+                async with shard_router.session(shard) as db:
+                    await create_future_partitions(
+                        db,
+                        table='tasks',
+                        months_ahead=settings.TASK_PARTITION_MONTHS_AHEAD
+                    )
+        except (SQLAlchemyError, OSError):
+            logger.exception('Creating task partitions failed')
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(stopping.wait(), settings.TASK_PARTITION_CHECK_INTERVAL_SECONDS)
+
+
+async def run_worker(concurrency: int):
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+    # note: running jobs are finished before exiting, anything cut short is retried after its visibility timeout
+    await asyncio.gather(
+        *(_consume(stopping) for _ in range(concurrency)),
+        _requeue_expired(stopping),
+        _archive_done_tasks(stopping),
+        _create_task_partitions(stopping)
+    )
+    await close_redis()
+    await shard_router.dispose()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_worker(settings.JOB_WORKER_CONCURRENCY))
@@ -1,11 +1,60 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
+
 from fastapi import FastAPI
+from starlette.responses import Response
 
 from app.api.v1.routers import user
 from app.api.v1.routers import login
 from app.api.v1.routers import task
 from app.api.v1.routers import group
+from app.api.v1.routers import job
+from app.core.config import settings
+from app.core.instrumentation import RequestMetricsMiddleware
+from app.core.metrics import PROMETHEUS_CONTENT_TYPE, registry
+from app.core.security import hashing_pool
+from app.db.session import (
+    PrimaryPinMiddleware,
+    close_redis,
+    read_engine,
+    redis_client,
+    replica_health,
+    shard_router
+)
+from app.utils.change_feed import change_hub
+from app.utils.invalidation import listen_for_invalidations
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await redis_client.ping()
+    background_tasks = [
+        asyncio.create_task(listen_for_invalidations(redis_client)),
+        asyncio.create_task(change_hub.run(redis_client))
+    ]
+    if read_engine is not None:
+        background_tasks.append(
+            asyncio.create_task(replica_health.monitor(settings.REPLICA_HEALTH_CHECK_INTERVAL_SECONDS))
+        )
+    yield
+    change_hub.close_all('shutdown')
+    for background_task in background_tasks:
+        background_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await background_task
+    hashing_pool.shutdown()
+    await close_redis()
+    await shard_router.dispose()
+    if read_engine is not None:
+        await read_engine.dispose()
+
 
-app = FastAPI(docs_url='/api/v1/docs')
+app = FastAPI(docs_url='/api/v1/docs', lifespan=lifespan)
+
+
+app.add_middleware(PrimaryPinMiddleware)
+# note: added last so it wraps every other middleware and its time counts too
+app.add_middleware(RequestMetricsMiddleware)
 
 
 @app.get('/', include_in_schema=False)
@@ -16,7 +65,12 @@ async def root():
 async def healthcheck():
     return {'status': '200'}
 
+@app.get('/api/v1/metrics', include_in_schema=False)
+async def metrics():
+    return Response(content=registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
 app.include_router(user.router, prefix='/api/v1/user')
 app.include_router(login.router, prefix='/api/v1/login')
 app.include_router(task.router, prefix='/api/v1/task')
-app.include_router(group.router, prefix='/api/v1/group')
\ No newline at end of file
+app.include_router(group.router, prefix='/api/v1/group')
+app.include_router(job.router, prefix='/api/v1/job')
\ No newline at end of file
@@ -0,0 +1,19 @@
+from sqlalchemy import Column, DateTime, Integer, String, UniqueConstraint, func
+
+from app.db.session import Base
+
+
+class Deletion(Base):
+    __tablename__ = 'deletions'
+    __table_args__ = (
+        UniqueConstraint('entity', 'entity_id', name='uq_deletions_entity_entity_id'),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    entity = Column(String, nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    stage = Column(String, nullable=True) # note: the stage to resume at, NULL before the first batch
+    deleted_rows = Column(Integer, default=0, server_default='0', nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True, index=True)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, DateTime, Integer, String, func, ForeignKey, Table
+from sqlalchemy import Column, DateTime, Index, Integer, String, func, ForeignKey, Table
 from sqlalchemy.orm import relationship
 
 from app.db.session import Base
@@ -8,7 +8,8 @@ user_group = Table(
     'user_group',
     Base.metadata,
     Column('user_id', Integer, ForeignKey('users.id'), primary_key=True),
-    Column('group_id', Integer, ForeignKey('groups.id'), primary_key=True)
+    Column('group_id', Integer, ForeignKey('groups.id'), primary_key=True),
+    Index('ix_user_group_group_id', 'group_id')
 )
 
 class Group(Base):
@@ -18,6 +19,8 @@ class Group(Base):
     title = Column(String, nullable=False)
     created_at = Column(DateTime(timezone=True), index=True, server_default=func.now())
     creator_id = Column(Integer, ForeignKey('users.id'), nullable=True, index=True)
+    version = Column(Integer, default=1, server_default='1', nullable=False)
+    deleted_at = Column(DateTime(timezone=True), nullable=True)
     users = relationship(
         'User',
         secondary='user_group',
@@ -0,0 +1,13 @@
+from sqlalchemy import Boolean, Column, DateTime, Integer, func
+
+from app.db.session import Base
+
+
+# note: lives on the primary only, a group without a row is on the primary
+class GroupShard(Base):
+    __tablename__ = 'group_shards'
+
+    group_id = Column(Integer, primary_key=True) # note: no foreign key, the group itself may be on another shard
+    shard = Column(Integer, nullable=False, index=True)
+    frozen = Column(Boolean, default=False, server_default='false', nullable=False) # note: set while it is moved
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
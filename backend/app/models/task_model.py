@@ -1,13 +1,23 @@
-from sqlalchemy import Boolean, Column, DateTime, Integer, String, func, ForeignKey, column
+from sqlalchemy import BigInteger, Boolean, Column, DateTime, Index, Integer, String, func, ForeignKey, column, text
 from sqlalchemy.orm import relationship
 
 from app.db.session import Base
 
+# note: id of the writing transaction, used as the delta sync watermark
+CURRENT_XID = text('pg_current_xact_id()::text::bigint')
+
 
 class Task(Base):
     __tablename__ = 'tasks'
+    __table_args__ = (
+        Index('ix_tasks_group_id_created_at_id', 'group_id', 'created_at', 'id'),
+        Index('ix_tasks_group_id_change_xid_id', 'group_id', 'change_xid', 'id'),
+        # note: monthly partitions, created ahead of time by the worker, see app.db.partitioning. Rows past the last
+        # one land in tasks_default until their month is created
+        {'postgresql_partition_by': 'RANGE (created_at)'}
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     title = Column(String(256), nullable=False)
     description = Column(String(500), nullable=True)
     status = Column(String, default='new', nullable=False)
@@ -15,11 +25,57 @@ class Task(Base):
     assignee_id = Column(Integer, ForeignKey('users.id', ondelete='SET NULL'), nullable=True, index=True) # note: ispolnitel
     reporter_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True) # note: sozdatel
     is_done = Column(Boolean, default=False, nullable=False)
-    created_at = Column(DateTime(timezone=True), index=True, server_default=func.now())
+    # note: part of the primary key because it is the partition key
+    created_at = Column(DateTime(timezone=True), primary_key=True, index=True, server_default=func.now())
+    # note: time of the last write, done tasks are archived by how long they have not been touched
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
     group_id = Column(Integer, ForeignKey('groups.id'))
+    version = Column(Integer, default=1, server_default='1', nullable=False)
+    change_xid = Column(BigInteger, server_default=CURRENT_XID, nullable=False)
     group = relationship(
         'Group',
         back_populates='tasks'
     )
     assignee = relationship('User', foreign_keys=[assignee_id], back_populates='assigned_tasks')
     reporter = relationship('User', foreign_keys=[reporter_id], back_populates='reported_tasks')
+
+
+class TaskTombstone(Base):
+    __tablename__ = 'task_tombstones'
+    __table_args__ = (
+        Index('ix_task_tombstones_group_id_change_xid_task_id', 'group_id', 'change_xid', 'task_id'),
+    )
+
+    task_id = Column(Integer, primary_key=True)
+    group_id = Column(Integer, nullable=True)
+    change_xid = Column(BigInteger, server_default=CURRENT_XID, nullable=False)
+    deleted_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+# note: the partition key of every live task, kept by triggers on tasks. An id alone cannot prune partitions, joined
+# through here the matching partition is picked at run time and every other one is skipped
+class TaskKey(Base):
+    __tablename__ = 'task_keys'
+
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+
+
+# note: cold storage for done tasks, without foreign keys so moving rows in costs no constraint checks
+class TaskArchive(Base):
+    __tablename__ = 'tasks_archive'
+
+    id = Column(Integer, primary_key=True)
+    title = Column(String(256), nullable=False)
+    description = Column(String(500), nullable=True)
+    status = Column(String, nullable=False)
+    priority = Column(String, nullable=True)
+    assignee_id = Column(Integer, nullable=True, index=True)
+    reporter_id = Column(Integer, nullable=False, index=True)
+    is_done = Column(Boolean, nullable=False)
+    created_at = Column(DateTime(timezone=True))
+    updated_at = Column(DateTime(timezone=True))
+    group_id = Column(Integer, nullable=True, index=True)
+    version = Column(Integer, nullable=False)
+    change_xid = Column(BigInteger, nullable=False)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
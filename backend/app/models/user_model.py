@@ -13,6 +13,8 @@ class User(Base):
     role = Column(String, default='user', nullable=False)
     created_at = Column(DateTime(timezone=True), index=True, server_default=func.now())
     is_active = Column(Boolean, default=True, nullable=False)
+    version = Column(Integer, default=1, server_default='1', nullable=False)
+    deleted_at = Column(DateTime(timezone=True), nullable=True)
     groups = relationship(
         'Group',
         secondary='user_group',
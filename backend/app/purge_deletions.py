@@ -0,0 +1,22 @@
+import argparse
+import asyncio
+
+from app.core.config import settings
+from app.crud.deletion_crud import deletion
+from app.db.session import shard_router
+
+
+async def main(batch_size: int):
+    for shard in shard_router.shards:
+        async with shard_router.session(shard) as db:
+            for id in await deletion.list_unfinished(db=db):
+                pending = await deletion.purge(id=id, db=db, batch_size=batch_size)
+                print(f'Purged {pending.entity} {pending.entity_id} on shard {shard}: {pending.deleted_rows} rows')
+    await shard_router.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Resume chunked deletions that did not finish')
+    parser.add_argument('--batch-size', type=int, default=settings.DELETION_BATCH_SIZE)
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size))
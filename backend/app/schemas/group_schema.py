@@ -30,8 +30,17 @@ class GroupResponse(OrmBaseModel):
     id: int
     title: str
     created_at: datetime
-    creator_id: int
+    creator_id: int | None
+    version: int
 
 
 class GroupWithUsers(GroupResponse):
-    users: List[UserResponse]
\ No newline at end of file
+    users: List[UserResponse]
+
+
+class GroupMembershipReport(OrmBaseModel):
+    group_id: int
+    added: List[int] = []
+    removed: List[int] = []
+    already_members: List[int] = []
+    not_found: List[int] = []
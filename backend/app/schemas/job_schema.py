@@ -0,0 +1,25 @@
+from datetime import datetime
+from typing import Any
+
+from pydantic import BaseModel, ConfigDict
+
+
+class OrmBaseModel(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+
+class JobAccepted(OrmBaseModel):
+    job_id: str
+    status_url: str
+
+
+class JobStatus(OrmBaseModel):
+    id: str
+    name: str
+    status: str
+    attempts: int
+    max_attempts: int
+    result: Any = None
+    error: str | None = None
+    created_at: datetime
+    updated_at: datetime
@@ -1,4 +1,5 @@
-from pydantic import BaseModel, ConfigDict, field_validator
+from typing import List
+from pydantic import BaseModel, ConfigDict, field_validator, model_validator
 from datetime import datetime
 
 
@@ -23,8 +24,8 @@ class TaskCreate(OrmBaseModel):
         return v
 
     @field_validator('description')
-    def description_validator(cls, v: str) -> str:
-        if len(v) > 500:
+    def description_validator(cls, v: str | None) -> str | None:
+        if v is not None and len(v) > 500:
             raise ValueError('Description must have less than 500 characters.')
         return v
 
@@ -36,8 +37,18 @@ class TaskUpdate(OrmBaseModel):
     priority: str | None = None
     is_done: bool | None = None
 
+    # note: None means "leave unchanged" only when the field is left out, an explicit null would clear the column
+    @model_validator(mode='after')
+    def nullable_validator(self) -> 'TaskUpdate':
+        for field in self.model_fields_set - {'description'}:
+            if field in TaskUpdate.model_fields and getattr(self, field) is None:
+                raise ValueError(f'{field} cannot be null.')
+        return self
+
     @field_validator('title')
-    def title_validator(cls, v: str) -> str:
+    def title_validator(cls, v: str | None) -> str | None:
+        if v is None:
+            return v
         if len(v) > 256:
             raise ValueError('Title must have less than 256 characters.')
         if len(v) < 3:
@@ -45,8 +56,8 @@ class TaskUpdate(OrmBaseModel):
         return v
 
     @field_validator('description')
-    def description_validator(cls, v: str) -> str:
-        if len(v) > 500:
+    def description_validator(cls, v: str | None) -> str | None:
+        if v is not None and len(v) > 500:
             raise ValueError('Description must have less than 500 characters.')
         return v
 
@@ -57,3 +68,44 @@ class TaskResponse(OrmBaseModel):
     title: str
     reporter_id: int
     group_id: int
+    version: int
+
+
+class TaskPage(OrmBaseModel):
+    items: List[TaskResponse]
+    next_cursor: str | None = None
+
+
+class TaskBulkUpdate(TaskUpdate):
+    id: int
+
+
+class TaskAssign(OrmBaseModel):
+    task_id: int
+    user_id: int
+
+
+class BulkItemError(OrmBaseModel):
+    index: int
+    detail: str
+
+
+class TaskBulkResponse(OrmBaseModel):
+    items: List[TaskResponse]
+    errors: List[BulkItemError]
+
+
+class TaskChanges(OrmBaseModel):
+    items: List[TaskResponse]
+    deleted: List[int]
+    next_cursor: str
+
+
+class TaskImport(TaskCreate):
+    reporter_id: int
+    is_done: bool = False
+
+
+class TaskImportReport(OrmBaseModel):
+    imported: int = 0
+    rejected: List[BulkItemError] = []
@@ -46,3 +46,10 @@ class UserResponse(UserBase):
     created_at: datetime
     is_active: bool = Field(default=True)
     role: str
+    version: int
+
+
+class UserPrincipal(OrmBaseModel):
+    id: int
+    is_active: bool
+    role: str
@@ -0,0 +1,247 @@
+import argparse
+import asyncio
+import logging
+
+from sqlalchemy import ColumnElement, Table, delete, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.crud.task_crud import SNAPSHOT_XMIN
+from app.db.session import close_redis, shard_router
+from app.models.group_model import Group, user_group
+from app.models.task_model import CURRENT_XID, Task, TaskArchive, TaskTombstone
+from app.models.user_model import User
+
+logger = logging.getLogger(__name__)
+
+
+def _upsert(table: Table, rows: list[dict]):
+    # note: tasks and tombstones get a fresh xid on the shard they land on, xids are per database and clients keep
+    # one watermark per shard. The archive keeps its rows as they are
+    fresh_xid = 'change_xid' in table.c and table.c.change_xid.server_default is not None
+    if fresh_xid:
+        rows = [{name: value for name, value in row.items() if name != 'change_xid'} for row in rows]
+    statement = insert(table).values(rows)
+    keys = [column.name for column in table.primary_key]
+    values = {name: statement.excluded[name] for name in rows[0] if name not in keys}
+    if fresh_xid:
+        values['change_xid'] = CURRENT_XID
+    return statement.on_conflict_do_update(index_elements=keys, set_=values)
+
+
+async def _read(db: AsyncSession, query) -> list[dict]:
+    rows = [dict(row._mapping) for row in (await db.execute(query)).all()]
+    # note: end the read transaction so a long copy does not hold back vacuum on the source
+    await db.rollback()
+    return rows
+
+
+async def _copy(
+    source: AsyncSession,
+    target: AsyncSession,
+    table: Table,
+    where: ColumnElement[bool],
+    *,
+    key: str,
+    batch_size: int
+) -> list:
+    copied, after = [], None
+    while True:
+        query = select(*table.c).where(where).order_by(table.c[key]).limit(batch_size)
+        if after is not None:
+            query = query.where(table.c[key] > after)
+        rows = await _read(source, query)
+        if not rows:
+            return copied
+        await target.execute(_upsert(table, rows))
+        await target.commit()
+        copied += [row[key] for row in rows]
+        after = rows[-1][key]
+
+
+async def _catch_up(
+    source: AsyncSession,
+    target: AsyncSession,
+    group_id: int,
+    *,
+    since: int,
+    batch_size: int
+) -> tuple[int, int]:
+    # note: applies task changes and deletions with an xid >= since and returns the next watermark. Transactions
+    # still running when the pass starts have an xid >= this mark, so the next pass re-reads them
+    mark = await source.scalar(select(SNAPSHOT_XMIN))
+    changed = await _copy(
+        source,
+        target,
+        Task.__table__,
+        (Task.group_id == group_id) & (Task.change_xid >= since),
+        key='id',
+        batch_size=batch_size
+    )
+    if changed:
+        # note: a restored task leaves the archive
+        await target.execute(delete(TaskArchive).where(TaskArchive.id.in_(changed)))
+    removed = await _copy(
+        source,
+        target,
+        TaskTombstone.__table__,
+        (TaskTombstone.group_id == group_id) & (TaskTombstone.change_xid >= since),
+        key='task_id',
+        batch_size=batch_size
+    )
+    if removed:
+        await target.execute(delete(Task).where(Task.id.in_(removed)))
+        await target.execute(delete(TaskArchive).where(TaskArchive.id.in_(removed)))
+    await target.commit()
+    return mark, len(changed) + len(removed)
+
+
+async def _sync_archive(source: AsyncSession, target: AsyncSession, group_id: int, *, batch_size: int):
+    # note: archiving moves rows without touching their xid, so the archive is compared by id instead
+    query = select(TaskArchive.id).where(TaskArchive.group_id == group_id)
+    source_ids = {row['id'] for row in await _read(source, query)}
+    target_ids = {row['id'] for row in await _read(target, query)}
+    missing = sorted(source_ids - target_ids)
+    for start in range(0, len(missing), batch_size):
+        ids = missing[start:start + batch_size]
+        rows = await _read(source, select(*TaskArchive.__table__.c).where(TaskArchive.id.in_(ids)))
+        if rows:
+            await target.execute(_upsert(TaskArchive.__table__, rows))
+        await target.execute(delete(Task).where(Task.id.in_(ids)))
+        await target.commit()
+    extra = sorted(target_ids - source_ids)
+    if extra:
+        await target.execute(delete(TaskArchive).where(TaskArchive.id.in_(extra)))
+        await target.commit()
+
+
+async def _sync_group(source: AsyncSession, target: AsyncSession, group_id: int):
+    rows = await _read(source, select(*Group.__table__.c).where(Group.id == group_id))
+    members = select(user_group.c.user_id).where(user_group.c.group_id == group_id)
+    source_members = {row['user_id'] for row in await _read(source, members)}
+    target_members = {row['user_id'] for row in await _read(target, members)}
+    await target.execute(_upsert(Group.__table__, rows))
+    if source_members - target_members:
+        await target.execute(
+            insert(user_group)
+            .values([{'user_id': user_id, 'group_id': group_id} for user_id in source_members - target_members])
+            .on_conflict_do_nothing()
+        )
+    if target_members - source_members:
+        await target.execute(
+            delete(user_group)
+            .where(user_group.c.group_id == group_id)
+            .where(user_group.c.user_id.in_(target_members - source_members))
+        )
+    await target.commit()
+
+
+async def _delete_batches(db: AsyncSession, table: Table, key: str, where: ColumnElement[bool], batch_size: int) -> int:
+    # note: plain deletes without tombstones, clients already get these rows from the new shard
+    deleted = 0
+    while True:
+        response = await db.execute(
+            delete(table).where(where, table.c[key].in_(select(table.c[key]).where(where).limit(batch_size)))
+        )
+        await db.commit()
+        deleted += response.rowcount
+        if response.rowcount < batch_size:
+            return deleted
+        await asyncio.sleep(settings.DELETION_BATCH_PAUSE_SECONDS)
+
+
+async def move_group(group_id: int, *, to: int, batch_size: int):
+    source_shard = await shard_router.shard_for_group(group_id)
+    if source_shard == to:
+        print(f'Group {group_id} is already on shard {to}')
+        return
+    async with shard_router.session(source_shard) as source, shard_router.session(to) as target:
+        group_rows = await _read(source, select(Group.deleted_at).where(Group.id == group_id))
+        if not group_rows or group_rows[0]['deleted_at'] is not None:
+            raise SystemExit(f'Group {group_id} not found on shard {source_shard}')
+
+        # note: bulk copy while the group stays writable, then replay what changed meanwhile until little is left
+        since = await source.scalar(select(SNAPSHOT_XMIN))
+        await _sync_group(source, target, group_id)
+        for table, key in ((Task.__table__, 'id'), (TaskArchive.__table__, 'id'), (TaskTombstone.__table__, 'task_id')):
+            copied = await _copy(source, target, table, table.c.group_id == group_id, key=key, batch_size=batch_size)
+            logger.info('Copied %s rows of %s', len(copied), table.name)
+        applied = batch_size
+        while applied >= batch_size:
+            since, applied = await _catch_up(source, target, group_id, since=since, batch_size=batch_size)
+            logger.info('Caught up %s changes', applied)
+
+        # note: writers check the freeze flag, the pause lets requests that routed before it finish
+        await shard_router.place_group(group_id, shard=source_shard, frozen=True)
+        await asyncio.sleep(settings.SHARD_MOVE_FREEZE_SECONDS)
+        try:
+            while applied:
+                since, applied = await _catch_up(source, target, group_id, since=since, batch_size=batch_size)
+            await _sync_archive(source, target, group_id, batch_size=batch_size)
+            await _sync_group(source, target, group_id)
+        except BaseException:
+            await shard_router.place_group(group_id, shard=source_shard)
+            raise
+        await shard_router.place_group(group_id, shard=to)
+        print(f'Group {group_id} now lives on shard {to}')
+
+        # note: a process that missed the invalidation routes by its cached entry until it expires
+        await asyncio.sleep(settings.SHARD_DIRECTORY_CACHE_TTL_SECONDS)
+        deleted = 0
+        for table, key, where in (
+            (Task.__table__, 'id', Task.group_id == group_id),
+            (TaskArchive.__table__, 'id', TaskArchive.group_id == group_id),
+            (TaskTombstone.__table__, 'task_id', TaskTombstone.group_id == group_id),
+            (user_group, 'user_id', user_group.c.group_id == group_id),
+            (Group.__table__, 'id', Group.id == group_id)
+        ):
+            deleted += await _delete_batches(source, table, key, where, batch_size)
+        print(f'Removed {deleted} rows of group {group_id} from shard {source_shard}')
+
+
+async def init_shards(*, batch_size: int):
+    # note: every shard allocates task ids from its own block, and gets a copy of the users table
+    for shard in shard_router.replicas:
+        async with shard_router.session(shard) as db:
+            await db.execute(
+                text("SELECT setval('tasks_id_seq', :start) WHERE (SELECT last_value FROM tasks_id_seq) < :start"),
+                {'start': shard * settings.SHARD_TASK_ID_BLOCK_SIZE}
+            )
+            await db.commit()
+    copied, after = 0, 0
+    async with shard_router.session(0) as db:
+        while rows := await _read(
+            db,
+            select(*User.__table__.c).where(User.id > after).order_by(User.id).limit(batch_size)
+        ):
+            await shard_router.replicate(User.__table__, rows)
+            copied += len(rows)
+            after = rows[-1]['id']
+    print(f'Copied {copied} users to {len(shard_router.replicas)} shards')
+
+
+async def main(args: argparse.Namespace):
+    try:
+        if args.command == 'init':
+            await init_shards(batch_size=args.batch_size)
+        else:
+            await move_group(args.group_id, to=args.to, batch_size=args.batch_size)
+    finally:
+        await shard_router.dispose()
+        await close_redis()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Manage group shards')
+    parser.add_argument('--batch-size', type=int, default=settings.SHARD_MOVE_BATCH_SIZE)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('init', help='Set up task id blocks and copy users to every shard')
+    move = commands.add_parser('move-group', help='Move one group, its tasks and members to another shard online')
+    move.add_argument('group_id', type=int)
+    move.add_argument('--to', type=int, required=True)
+    args = parser.parse_args()
+    if args.command == 'move-group' and args.to not in shard_router.shards:
+        parser.error(f'--to must be one of the {len(shard_router.shards)} configured shards')
+    asyncio.run(main(args))
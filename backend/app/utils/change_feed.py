@@ -0,0 +1,120 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from typing import Any
+
+from redis.asyncio import Redis
+from redis.exceptions import ConnectionError as RedisConnectionError, RedisError
+
+from app.core.config import settings
+from app.core.metrics import registry
+from app.db.session import redis_client
+
+CHANGE_CHANNEL = 'changes'
+
+logger = logging.getLogger(__name__)
+
+subscribers_gauge = registry.gauge(
+    'change_feed_subscribers',
+    'Open change feed subscriptions on this worker'
+)
+events_total = registry.counter(
+    'change_feed_events_total',
+    'Change events received from Redis by this worker'
+)
+dropped_total = registry.counter(
+    'change_feed_dropped_subscribers_total',
+    'Subscribers disconnected because their queue was full'
+)
+
+
+async def publish_changes(events: list[dict[str, Any]]):
+    if not events:
+        return
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for event in events:
+                pipe.publish(CHANGE_CHANNEL, json.dumps(event, separators=(',', ':')))
+            await pipe.execute()
+    except RedisError:
+        logger.warning('Could not publish %s change events', len(events))
+
+
+class Subscriber:
+    def __init__(self, group_id: int, user_id: int, max_size: int):
+        self.group_id = group_id
+        self.user_id = user_id
+        self.queue: asyncio.Queue[dict[str, Any] | None] = asyncio.Queue(maxsize=max_size)
+        self.close_reason: str | None = None
+
+    def close(self, reason: str):
+        if self.close_reason:
+            return
+        self.close_reason = reason
+        # note: a full queue is discarded to make room for the close marker, the client resyncs after reconnecting
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class ChangeHub:
+    def __init__(self):
+        self._subscribers: dict[int, set[Subscriber]] = defaultdict(set)
+
+    def subscribe(self, group_id: int, user_id: int) -> Subscriber:
+        subscriber = Subscriber(group_id, user_id, settings.CHANGE_FEED_QUEUE_SIZE)
+        self._subscribers[group_id].add(subscriber)
+        subscribers_gauge.inc()
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        group_subscribers = self._subscribers.get(subscriber.group_id)
+        if group_subscribers is None or subscriber not in group_subscribers:
+            return
+        group_subscribers.discard(subscriber)
+        if not group_subscribers:
+            del self._subscribers[subscriber.group_id]
+        subscribers_gauge.dec()
+
+    def dispatch(self, event: dict[str, Any]):
+        for subscriber in list(self._subscribers.get(event.get('group_id'), ())):
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                dropped_total.inc()
+                subscriber.close('slow_consumer')
+                self.unsubscribe(subscriber)
+                continue
+            if event['entity'] == 'group' and event['op'] == 'deleted':
+                subscriber.close('group_deleted')
+                self.unsubscribe(subscriber)
+            elif event['op'] == 'members_removed' and subscriber.user_id in event.get('user_ids', ()):
+                subscriber.close('removed_from_group')
+                self.unsubscribe(subscriber)
+
+    def close_all(self, reason: str):
+        for group_subscribers in list(self._subscribers.values()):
+            for subscriber in list(group_subscribers):
+                subscriber.close(reason)
+                self.unsubscribe(subscriber)
+
+    async def run(self, redis_client: Redis, retry_delay: float = 1.0):
+        while True:
+            try:
+                async with redis_client.pubsub() as pubsub:
+                    await pubsub.subscribe(CHANGE_CHANNEL)
+                    async for message in pubsub.listen():
+                        if message['type'] != 'message':
+                            continue
+                        events_total.inc()
+                        self.dispatch(json.loads(message['data']))
+            except (RedisConnectionError, OSError):
+                logger.warning('Change feed lost Redis connection, retrying in %ss', retry_delay)
+            # note: events were missed, subscribers have to reconnect and resync
+            self.close_all('feed_interrupted')
+            await asyncio.sleep(retry_delay)
+
+
+change_hub = ChangeHub()
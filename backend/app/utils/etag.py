@@ -0,0 +1,39 @@
+from fastapi import Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud.base_crud import CRUDBase
+
+
+def make_etag(table: str, id: int, version: int) -> str:
+    return f'"{table}-{id}-{version}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # note: If-None-Match uses the weak comparison, so W/ prefixes are ignored
+    return any(candidate.strip().removeprefix('W/') == etag for candidate in if_none_match.split(','))
+
+
+async def not_modified_response(
+    crud: CRUDBase,
+    *,
+    id: int,
+    if_none_match: str | None,
+    db: AsyncSession
+) -> Response | None:
+    if not if_none_match:
+        return None
+    version = await crud.get_version(id=id, db=db)
+    if version is None:
+        return None
+    etag = make_etag(crud.model.__tablename__, id, version)
+    if not etag_matches(if_none_match, etag):
+        return None
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+
+def set_etag(response: Response, crud: CRUDBase, obj) -> None:
+    response.headers['ETag'] = make_etag(crud.model.__tablename__, obj.id, obj.version)
@@ -1,9 +1,3 @@
-class UserAlreadyInGroupError(Exception):
-    def __init__(self, user_id: int, group_id: int):
-        self.user_id = user_id
-        self.group_id = group_id
-        super().__init__(f'User {user_id} already in group {group_id}')
-
 class TaskNotInDatabaseError(Exception):
     def __init__(self, task_id: int):
         self.task_id = task_id
@@ -29,4 +23,42 @@ class UserIsGroupCreator(Exception):
     def __init__(self, user_id: int, group_id: int):
         self.user_id = user_id
         self.group_id = group_id
-        super().__init__(f'User {user_id} is a creator of group {group_id}')
\ No newline at end of file
+        super().__init__(f'User {user_id} is a creator of group {group_id}')
+
+class HashingQueueFullError(Exception):
+    def __init__(self, pending: int):
+        self.pending = pending
+        super().__init__(f'Password hashing queue is full ({pending} pending)')
+
+class InvalidCursorError(Exception):
+    def __init__(self, cursor: str):
+        self.cursor = cursor
+        super().__init__(f'Cursor {cursor} is invalid')
+
+class ObjectAlreadyExistsError(Exception):
+    def __init__(self, table: str, constraint: str | None = None):
+        self.table = table
+        self.constraint = constraint
+        super().__init__(f'Object in {table} violates unique constraint {constraint}')
+
+class RelatedObjectNotFoundError(Exception):
+    def __init__(self, table: str, constraint: str | None = None):
+        self.table = table
+        self.constraint = constraint
+        super().__init__(f'Object in {table} references a missing row through {constraint}')
+
+class RequiredValueMissingError(Exception):
+    def __init__(self, table: str, column: str | None = None):
+        self.table = table
+        self.column = column
+        super().__init__(f'Object in {table} has no value for required column {column}')
+
+class JobFailedPermanentlyError(Exception):
+    def __init__(self, detail: str):
+        self.detail = detail
+        super().__init__(detail)
+
+class GroupIsMovingError(Exception):
+    def __init__(self, group_id: int):
+        self.group_id = group_id
+        super().__init__(f'Group {group_id} is being moved to another shard')
@@ -0,0 +1,53 @@
+import csv
+import io
+import json
+from collections.abc import AsyncIterator, Sequence
+from datetime import datetime
+from enum import Enum
+
+from sqlalchemy import Row
+
+
+class DataFormat(str, Enum):
+    ndjson = 'ndjson'
+    csv = 'csv'
+
+
+EXPORT_MEDIA_TYPES = {
+    DataFormat.ndjson: 'application/x-ndjson',
+    DataFormat.csv: 'text/csv'
+}
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+async def encode_ndjson(batches: AsyncIterator[Sequence[Row]]) -> AsyncIterator[str]:
+    async for rows in batches:
+        yield ''.join(json.dumps(row._asdict(), default=_json_default) + '\n' for row in rows)
+
+
+async def encode_csv(batches: AsyncIterator[Sequence[Row]], columns: Sequence[str]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    async for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def encode_export(
+    batches: AsyncIterator[Sequence[Row]],
+    data_format: DataFormat,
+    columns: Sequence[str]
+) -> AsyncIterator[str]:
+    if data_format == DataFormat.csv:
+        return encode_csv(batches, columns)
+    return encode_ndjson(batches)
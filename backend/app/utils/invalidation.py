@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from collections.abc import Callable
+
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+INVALIDATION_CHANNEL = 'cache:invalidate'
+
+logger = logging.getLogger(__name__)
+
+_handlers: dict[str, tuple[Callable[[str], None], Callable[[], None]]] = {}
+
+
+def register_handler(namespace: str, on_key: Callable[[str], None], on_reset: Callable[[], None]):
+    _handlers[namespace] = (on_key, on_reset)
+
+
+def _dispatch(message: str):
+    namespace, _, key = message.partition(':')
+    handler = _handlers.get(namespace)
+    if handler:
+        handler[0](key)
+
+
+def _reset_all():
+    for _, on_reset in _handlers.values():
+        on_reset()
+
+
+async def publish_invalidation(redis_client: Redis, namespace: str, key: int | str):
+    message = f'{namespace}:{key}'
+    _dispatch(message)
+    await redis_client.publish(INVALIDATION_CHANNEL, message)
+
+
+def queue_invalidation(pipe: Pipeline, namespace: str, key: int | str):
+    message = f'{namespace}:{key}'
+    _dispatch(message)
+    pipe.publish(INVALIDATION_CHANNEL, message)
+
+
+async def listen_for_invalidations(redis_client: Redis, retry_delay: float = 1.0):
+    while True:
+        try:
+            async with redis_client.pubsub() as pubsub:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # note: messages may have been missed while we were disconnected
+                _reset_all()
+                async for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        _dispatch(message['data'])
+        except (RedisConnectionError, OSError):
+            logger.warning('Invalidation listener lost Redis connection, retrying in %ss', retry_delay)
+        _reset_all()
+        await asyncio.sleep(retry_delay)
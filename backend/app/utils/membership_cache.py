@@ -0,0 +1,105 @@
+import logging
+from collections.abc import Iterable
+
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+from app.db.session import redis_client
+
+logger = logging.getLogger(__name__)
+
+# note: every removal bumps the group's generation. A fill carries the generation read before its database read
+# and is dropped if a removal landed in between, otherwise a member removed meanwhile would be cached again
+ADD_MEMBERS_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('SADD', KEYS[1], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+REMOVE_MEMBERS_SCRIPT = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+if #ARGV > 1 then
+    redis.call('SREM', KEYS[1], unpack(ARGV, 2))
+else
+    redis.call('DEL', KEYS[1])
+end
+"""
+
+
+def _members_key(group_id: int) -> str:
+    return f'group:{group_id}:members'
+
+
+def _generation_key(group_id: int) -> str:
+    return f'group:{group_id}:members:generation'
+
+
+# note: the set only ever holds confirmed members, so a miss falls back to the database. The generation returned
+# with a miss is what a later add_members must pass, None when the cache is off or unreachable
+async def lookup_member(group_id: int, user_id: int) -> tuple[bool, str | None]:
+    if not settings.MEMBERSHIP_CACHE_ENABLED:
+        return False, None
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.get(_generation_key(group_id))
+            pipe.sismember(_members_key(group_id), user_id)
+            generation, is_member = await pipe.execute()
+    except RedisError:
+        logger.warning('Membership cache lookup failed for group %s', group_id)
+        return False, None
+    return bool(is_member), str(generation or '0')
+
+
+async def generation(group_id: int) -> str | None:
+    if not settings.MEMBERSHIP_CACHE_ENABLED:
+        return None
+    try:
+        return str(await redis_client.get(_generation_key(group_id)) or '0')
+    except RedisError:
+        logger.warning('Membership cache lookup failed for group %s', group_id)
+        return None
+
+
+async def add_members(group_id: int, user_ids: Iterable[int], *, generation: str | None):
+    user_ids = list(user_ids)
+    if not settings.MEMBERSHIP_CACHE_ENABLED or not user_ids or generation is None:
+        return
+    try:
+        script = redis_client.register_script(ADD_MEMBERS_SCRIPT)
+        await script(
+            keys=[_members_key(group_id), _generation_key(group_id)],
+            args=[generation, settings.MEMBERSHIP_CACHE_TTL_SECONDS, *user_ids]
+        )
+    except RedisError:
+        logger.warning('Membership cache update failed for group %s', group_id)
+
+
+async def _remove(group_id: int, user_ids: list[int]):
+    script = redis_client.register_script(REMOVE_MEMBERS_SCRIPT)
+    await script(
+        keys=[_members_key(group_id), _generation_key(group_id)],
+        args=[settings.MEMBERSHIP_CACHE_TTL_SECONDS, *user_ids]
+    )
+
+
+async def remove_members(group_id: int, user_ids: Iterable[int]):
+    user_ids = list(user_ids)
+    if not settings.MEMBERSHIP_CACHE_ENABLED or not user_ids:
+        return
+    try:
+        await _remove(group_id, user_ids)
+    except RedisError:
+        await drop_group(group_id)
+
+
+async def drop_group(group_id: int):
+    if not settings.MEMBERSHIP_CACHE_ENABLED:
+        return
+    try:
+        await _remove(group_id, [])
+    except RedisError:
+        logger.warning('Membership cache invalidation failed for group %s', group_id)
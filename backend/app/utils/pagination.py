@@ -0,0 +1,58 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any
+
+from sqlalchemy import BigInteger, Column, Integer
+
+from app.utils.exceptions import InvalidCursorError
+
+
+def encode_cursor(values: list[Any]) -> str:
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def _decode_value(column: Column, value: Any) -> Any:
+    python_type = column.type.python_type
+    if python_type is datetime:
+        if not isinstance(value, str):
+            raise TypeError(f'{column.name} must be a timestamp')
+        return datetime.fromisoformat(value)
+    # note: bool is an int to isinstance but not to the database, and an int outside the column's range fails there
+    if type(value) is not python_type:
+        raise TypeError(f'{column.name} must be {python_type.__name__}')
+    if isinstance(column.type, Integer):
+        bits = 64 if isinstance(column.type, BigInteger) else 32
+        if not -2 ** (bits - 1) <= value < 2 ** (bits - 1):
+            raise ValueError(f'{column.name} is out of range')
+    return value
+
+
+def decode_cursor(cursor: str, columns: list[Column]) -> list[Any]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(payload, list) or len(payload) != len(columns):
+            raise InvalidCursorError(cursor)
+        return [_decode_value(column, value) for column, value in zip(columns, payload)]
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError(cursor) from e
+
+
+def encode_shard_cursors(cursors: list[str | None]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(cursors).encode()).decode()
+
+
+def decode_shard_cursors(cursor: str | None, shards: int) -> list[str | None]:
+    if not cursor:
+        return [None] * shards
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError(cursor) from e
+    # note: a cursor from before the shard count changed cannot be resumed, the client starts over
+    if not isinstance(payload, list) or len(payload) != shards:
+        raise InvalidCursorError(cursor)
+    if not all(value is None or isinstance(value, str) for value in payload):
+        raise InvalidCursorError(cursor)
+    return payload
@@ -0,0 +1,29 @@
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+
+from app.core.config import settings
+from app.schemas.user_schema import UserPrincipal
+from app.utils.cache import TTLCache
+from app.utils.invalidation import publish_invalidation, queue_invalidation, register_handler
+
+PRINCIPAL_NAMESPACE = 'principal'
+
+principal_cache: TTLCache[str, UserPrincipal] = TTLCache(
+    max_size=settings.PRINCIPAL_CACHE_MAX_SIZE,
+    ttl=settings.PRINCIPAL_CACHE_TTL_SECONDS
+)
+
+
+def _drop_user(user_id: str):
+    principal_cache.discard_if(lambda principal: str(principal.id) == user_id)
+
+
+register_handler(PRINCIPAL_NAMESPACE, _drop_user, principal_cache.clear)
+
+
+async def invalidate_principal(redis_client: Redis, user_id: int | str):
+    await publish_invalidation(redis_client, PRINCIPAL_NAMESPACE, user_id)
+
+
+def queue_principal_invalidation(pipe: Pipeline, user_id: int | str):
+    queue_invalidation(pipe, PRINCIPAL_NAMESPACE, user_id)
@@ -0,0 +1,138 @@
+import logging
+from collections.abc import Awaitable, Callable, Iterable
+from typing import Generic, TypeVar
+
+from pydantic import BaseModel
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+from app.core.metrics import registry
+from app.db.session import redis_client
+from app.utils.cache import TTLCache
+from app.utils.invalidation import queue_invalidation, register_handler
+
+RESPONSE_NAMESPACE = 'response'
+
+SchemaType = TypeVar('SchemaType', bound=BaseModel)
+
+logger = logging.getLogger(__name__)
+
+cache_hits_total = registry.counter(
+    'response_cache_hits_total',
+    'Entity responses served from cache, by cache and tier'
+)
+cache_misses_total = registry.counter(
+    'response_cache_misses_total',
+    'Entity responses loaded from the database'
+)
+cache_evictions_total = registry.counter(
+    'response_cache_evictions_total',
+    'Entity responses evicted from the in-process tier to stay within its size'
+)
+
+_caches: dict[str, 'ResponseCache'] = {}
+
+
+class ResponseCache(Generic[SchemaType]):
+    def __init__(self, name: str, schema: type[SchemaType]):
+        self.name = name
+        self.schema = schema
+        self.local: TTLCache[str, SchemaType] = TTLCache(
+            max_size=settings.RESPONSE_CACHE_MAX_SIZE,
+            ttl=settings.RESPONSE_CACHE_TTL_SECONDS,
+            on_evict=lambda key, value: cache_evictions_total.inc(cache=self.name)
+        )
+        # note: bumped on every invalidation so a load that raced with a write is not stored
+        self.generation = 0
+        _caches[name] = self
+
+    def _redis_key(self, key: int | str) -> str:
+        return f'cache:{self.name}:{key}'
+
+    def drop(self, key: str):
+        self.generation += 1
+        self.local.pop(key)
+
+    def reset(self):
+        self.generation += 1
+        self.local.clear()
+
+    async def get(self, key: int | str) -> SchemaType | None:
+        if not settings.RESPONSE_CACHE_ENABLED:
+            return None
+        cached = self.local.get(str(key))
+        if cached is not None:
+            cache_hits_total.inc(cache=self.name, tier='local')
+            return cached
+
+        if settings.RESPONSE_CACHE_REDIS_ENABLED:
+            try:
+                payload = await redis_client.get(self._redis_key(key))
+            except RedisError:
+                logger.warning('Response cache lookup failed for %s %s', self.name, key)
+                payload = None
+            if payload is not None:
+                cache_hits_total.inc(cache=self.name, tier='redis')
+                cached = self.schema.model_validate_json(payload)
+                self.local.set(str(key), cached)
+                return cached
+        return None
+
+    async def get_or_load(
+        self,
+        key: int | str,
+        loader: Callable[[], Awaitable[SchemaType | None]],
+        *,
+        store: bool = True
+    ) -> SchemaType | None:
+        if not settings.RESPONSE_CACHE_ENABLED:
+            return await loader()
+        cached = await self.get(key)
+        if cached is not None:
+            return cached
+
+        cache_misses_total.inc(cache=self.name)
+        generation = self.generation
+        loaded = await loader()
+        if loaded is None or not store or generation != self.generation:
+            return loaded
+        self.local.set(str(key), loaded)
+        if settings.RESPONSE_CACHE_REDIS_ENABLED:
+            try:
+                await redis_client.set(
+                    self._redis_key(key),
+                    loaded.model_dump_json(),
+                    ex=settings.RESPONSE_CACHE_REDIS_TTL_SECONDS
+                )
+            except RedisError:
+                logger.warning('Response cache store failed for %s %s', self.name, key)
+        return loaded
+
+    async def invalidate(self, keys: Iterable[int | str]):
+        keys = list(keys)
+        if not settings.RESPONSE_CACHE_ENABLED or not keys:
+            return
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                if settings.RESPONSE_CACHE_REDIS_ENABLED:
+                    pipe.delete(*[self._redis_key(key) for key in keys])
+                for key in keys:
+                    queue_invalidation(pipe, RESPONSE_NAMESPACE, f'{self.name}:{key}')
+                await pipe.execute()
+        except RedisError:
+            logger.warning('Response cache invalidation failed for %s %s', self.name, keys)
+
+
+def _drop_key(key: str):
+    name, _, entity_key = key.partition(':')
+    cache = _caches.get(name)
+    if cache:
+        cache.drop(entity_key)
+
+
+def _reset_all():
+    for cache in _caches.values():
+        cache.reset()
+
+
+register_handler(RESPONSE_NAMESPACE, _drop_key, _reset_all)
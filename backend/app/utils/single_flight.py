@@ -0,0 +1,72 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Generic, TypeVar
+
+from app.core.metrics import registry
+
+T = TypeVar('T')
+
+coalesced_total = registry.counter(
+    'single_flight_coalesced_total',
+    'Calls that awaited an identical in-flight load instead of starting their own'
+)
+timeouts_total = registry.counter(
+    'single_flight_timeouts_total',
+    'Calls that gave up waiting on an in-flight load and ran it themselves'
+)
+
+
+class _LeaderCancelled(Exception):
+    pass
+
+
+class SingleFlight(Generic[T]):
+    def __init__(self, name: str, *, timeout: float):
+        self.name = name
+        self.timeout = timeout
+        self._flights: dict[Hashable, asyncio.Future] = {}
+
+    def _forget(self, key: Hashable, flight: asyncio.Future):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    @staticmethod
+    def _consume_result(flight: asyncio.Future):
+        # note: every waiter may have timed out, retrieve the exception so it is not logged as lost
+        if not flight.cancelled():
+            flight.exception()
+
+    async def do(self, key: Hashable, loader: Callable[[], Awaitable[T]], timeout: float | None = None) -> T:
+        # note: the first caller loads in its own task, so the load can use that caller's session and connection.
+        # Followers only wait on the result and load for themselves if the leader is cancelled or too slow
+        flight = self._flights.get(key)
+        if flight is None:
+            return await self._lead(key, loader)
+        coalesced_total.inc(flight=self.name)
+        try:
+            # note: shielded so a cancelled follower does not cancel the shared result for the others
+            return await asyncio.wait_for(asyncio.shield(flight), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            timeouts_total.inc(flight=self.name)
+            self._forget(key, flight)
+        except _LeaderCancelled:
+            pass
+        return await loader()
+
+    async def _lead(self, key: Hashable, loader: Callable[[], Awaitable[T]]) -> T:
+        flight = asyncio.get_running_loop().create_future()
+        flight.add_done_callback(self._consume_result)
+        self._flights[key] = flight
+        try:
+            result = await loader()
+        except asyncio.CancelledError:
+            flight.set_exception(_LeaderCancelled())
+            raise
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            self._forget(key, flight)
@@ -0,0 +1,114 @@
+import codecs
+import csv
+import json
+from collections.abc import AsyncIterator, Sequence
+from typing import Any
+
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud.task_crud import IMPORT_COLUMNS, task
+from app.schemas.task_schema import BulkItemError, TaskImport, TaskImportReport
+from app.utils.export import DataFormat
+
+ParsedRow = tuple[int, dict[str, Any] | None, str | None]
+
+
+async def _iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = ''
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split('\n')
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+async def parse_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[ParsedRow]:
+    index = 0
+    async for line in _iter_lines(chunks):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield index, None, f'Invalid JSON: {e.msg}'
+        else:
+            if isinstance(row, dict):
+                yield index, row, None
+            else:
+                yield index, None, 'Row must be a JSON object'
+        index += 1
+
+
+async def parse_csv(chunks: AsyncIterator[bytes]) -> AsyncIterator[ParsedRow]:
+    header = None
+    index = 0
+    record = ''
+    async for line in _iter_lines(chunks):
+        record += line
+        # note: an odd number of quotes means a quoted field continues on the next line
+        if record.count('"') % 2:
+            continue
+        values = next(csv.reader([record]), [])
+        record = ''
+        if not values:
+            continue
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            yield index, None, f'Expected {len(header)} columns, got {len(values)}'
+        else:
+            yield index, {name: value for name, value in zip(header, values) if value != ''}, None
+        index += 1
+    if record.strip():
+        yield index, None, 'Unterminated quoted field'
+
+
+def validate_batch(rows: Sequence[ParsedRow]) -> tuple[list[tuple], list[BulkItemError]]:
+    records, errors = [], []
+    for index, row, parse_error in rows:
+        if parse_error:
+            errors.append(BulkItemError(index=index, detail=parse_error))
+            continue
+        try:
+            obj_in = TaskImport.model_validate(row)
+        except ValidationError as e:
+            errors.append(BulkItemError(index=index, detail='; '.join(error['msg'] for error in e.errors())))
+            continue
+        records.append((index, *(getattr(obj_in, name) for name in IMPORT_COLUMNS)))
+    return records, errors
+
+
+async def import_tasks(
+    chunks: AsyncIterator[bytes],
+    *,
+    data_format: DataFormat,
+    db: AsyncSession,
+    batch_size: int = 5000
+) -> TaskImportReport:
+    rows = parse_csv(chunks) if data_format == DataFormat.csv else parse_ndjson(chunks)
+    report = TaskImportReport()
+    batch: list[ParsedRow] = []
+
+    async def flush():
+        records, errors = validate_batch(batch)
+        report.rejected.extend(errors)
+        if records:
+            imported, rejected = await task.import_batch(records=records, db=db)
+            report.imported += imported
+            report.rejected.extend(rejected)
+        batch.clear()
+
+    async for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            await flush()
+    if batch:
+        await flush()
+    report.rejected.sort(key=lambda error: error.index)
+    return report
@@ -1,38 +1,128 @@
+import hashlib
+import logging
+import time
+
 from redis.asyncio import Redis
-from app.models.user_model import User
-from datetime import timedelta
-from app.core.config import TokenType
+from redis.exceptions import RedisError
+from app.core.config import settings, TokenType
+from app.core.metrics import registry
+from app.utils.principal_cache import queue_principal_invalidation
+from app.utils.token_epoch import queue_epoch_bump
+
+# note: every token lives under its own key with its own TTL, the per-user sorted set
+# (score = expiry timestamp) is only an index used to revoke them. Rotation replaces the
+# whole index, so it holds the current token at most and never needs compacting
+REPLACE_TOKENS_SCRIPT = """
+local user_id = ARGV[1]
+local now = tonumber(ARGV[2])
+for i, index_key in ipairs(KEYS) do
+    local offset = 2 + (i - 1) * 3
+    local prefix = ARGV[offset + 1]
+    local token_hash = ARGV[offset + 2]
+    local ttl = tonumber(ARGV[offset + 3])
+    for _, old_hash in ipairs(redis.call('ZRANGE', index_key, 0, -1)) do
+        redis.call('DEL', prefix .. old_hash)
+    end
+    redis.call('DEL', index_key)
+    if token_hash ~= '' then
+        redis.call('SET', prefix .. token_hash, user_id, 'EX', ttl)
+        redis.call('ZADD', index_key, now + ttl, token_hash)
+        redis.call('EXPIRE', index_key, ttl)
+    end
+end
+"""
+
+logger = logging.getLogger(__name__)
+
+token_memory_bytes = registry.histogram(
+    'redis_token_memory_bytes',
+    'Redis memory used by the token keys and index of one user, sampled on every rotation',
+    buckets=(256, 512, 1024, 2048, 4096, 8192, 16384, 65536, 262144)
+)
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
 
 
-async def add_tokens_to_redis(
+def _token_key(token_type: TokenType, token_hash: str) -> str:
+    return f'token:{token_type.value}:{token_hash}'
+
+
+def _index_key(user_id: int | str, token_type: TokenType) -> str:
+    return f'user:{user_id}:{token_type.value}:index'
+
+
+async def is_token_valid(
     redis_client: Redis,
-    user: User,
+    user_id: int | str,
     token: str,
-    token_type: TokenType,
-    expire_time: int | None = None
+    token_type: TokenType
+) -> bool:
+    owner_id = await redis_client.get(_token_key(token_type, hash_token(token)))
+    return owner_id is not None and str(owner_id) == str(user_id)
+
+
+async def _replace_tokens(
+    redis_client: Redis,
+    user_id: int | str,
+    tokens: dict[TokenType, tuple[str, int] | None],
+    bump_epoch: bool = False
 ):
-    token_key = f'user:{user.id}:{token_type}'
-    await redis_client.sadd(token_key, token)
-    if expire_time:
-        await redis_client.expire(token_key, timedelta(minutes=expire_time))
+    keys = []
+    args = [str(user_id), int(time.time())]
+    for token_type, token in tokens.items():
+        keys.append(_index_key(user_id, token_type))
+        if token:
+            args += [_token_key(token_type, ''), hash_token(token[0]), token[1] * 60]
+        else:
+            args += [_token_key(token_type, ''), '', 0]
 
+    script = redis_client.register_script(REPLACE_TOKENS_SCRIPT)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        await script(keys=keys, args=args, client=pipe)
+        if bump_epoch:
+            queue_epoch_bump(pipe, user_id)
+        queue_principal_invalidation(pipe, user_id)
+        await pipe.execute()
 
-async def get_valid_tokens(
+
+async def delete_tokens(
     redis_client: Redis,
     user_id: int,
     token_type: TokenType
 ):
-    token_key = f'user:{user_id}:{token_type}'
-    valid_token = await redis_client.smembers(token_key)
-    return valid_token
+    await _replace_tokens(redis_client, user_id, {token_type: None}, bump_epoch=True)
 
 
-async def delete_tokens(
+async def rotate_tokens(
     redis_client: Redis,
     user_id: int,
-    token_type: TokenType
+    access_token: str,
+    refresh_token: str | None = None
 ):
-    token_key = f'user:{user_id}:{token_type}'
-    valid_token = await redis_client.smembers(token_key)
-    if valid_token is not None:
-        await redis_client.delete(token_key)
\ No newline at end of file
+    tokens = {TokenType.access: (access_token, settings.ACCESS_TOKEN_EXPIRE_MINUTES)}
+    if refresh_token:
+        tokens[TokenType.refresh] = (refresh_token, settings.REFRESH_TOKEN_EXPIRE_MINUTES)
+    await _replace_tokens(redis_client, user_id, tokens)
+    try:
+        await get_user_token_memory(redis_client, user_id)
+    except RedisError:
+        logger.warning('Could not measure the token memory of user %s', user_id)
+
+
+async def get_user_token_memory(redis_client: Redis, user_id: int | str) -> int:
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for token_type in TokenType:
+            pipe.zrange(_index_key(user_id, token_type), 0, -1)
+        token_hashes = await pipe.execute()
+
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for token_type, hashes in zip(TokenType, token_hashes):
+            pipe.memory_usage(_index_key(user_id, token_type))
+            for token_hash in hashes:
+                pipe.memory_usage(_token_key(token_type, token_hash))
+        usage = sum(size or 0 for size in await pipe.execute())
+    token_memory_bytes.observe(usage)
+    return usage
+
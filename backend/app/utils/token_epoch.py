@@ -0,0 +1,53 @@
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+
+from app.core.config import settings
+from app.models.user_model import User
+from app.schemas.user_schema import UserPrincipal
+from app.utils.cache import TTLCache
+from app.utils.invalidation import queue_invalidation, register_handler
+from app.utils.principal_cache import queue_principal_invalidation
+
+EPOCH_NAMESPACE = 'epoch'
+
+epoch_cache: TTLCache[str, int] = TTLCache(
+    max_size=settings.PRINCIPAL_CACHE_MAX_SIZE,
+    ttl=settings.TOKEN_EPOCH_CACHE_TTL_SECONDS
+)
+
+register_handler(EPOCH_NAMESPACE, epoch_cache.pop, epoch_cache.clear)
+
+
+def _epoch_key(user_id: int | str) -> str:
+    return f'user:{user_id}:token_epoch'
+
+
+async def get_token_epoch(redis_client: Redis, user_id: int | str) -> int:
+    epoch = epoch_cache.get(str(user_id))
+    if epoch is None:
+        epoch = int(await redis_client.get(_epoch_key(user_id)) or 0)
+        epoch_cache.set(str(user_id), epoch)
+    return epoch
+
+
+def queue_epoch_bump(pipe: Pipeline, user_id: int | str):
+    pipe.incr(_epoch_key(user_id))
+    queue_invalidation(pipe, EPOCH_NAMESPACE, user_id)
+
+
+async def revoke_user_tokens(redis_client: Redis, user_id: int | str) -> int:
+    async with redis_client.pipeline(transaction=True) as pipe:
+        queue_epoch_bump(pipe, user_id)
+        queue_principal_invalidation(pipe, user_id)
+        epoch, *_ = await pipe.execute()
+    return epoch
+
+
+async def get_access_token_claims(redis_client: Redis, user: User | UserPrincipal) -> dict | None:
+    if not settings.STATELESS_ACCESS_TOKENS:
+        return None
+    return {
+        'role': user.role,
+        'active': user.is_active,
+        'epoch': await get_token_epoch(redis_client, user.id)
+    }
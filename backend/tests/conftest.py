@@ -0,0 +1,21 @@
+import pytest
+from fakeredis import FakeAsyncRedis
+
+from app.core.config import settings
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    client = FakeAsyncRedis(decode_responses=True)
+    monkeypatch.setattr('app.utils.membership_cache.redis_client', client)
+    return client
+
+
+@pytest.fixture
+def membership_cache_enabled(monkeypatch, fake_redis):
+    monkeypatch.setattr(settings, 'MEMBERSHIP_CACHE_ENABLED', True)
@@ -0,0 +1,80 @@
+import asyncio
+import uuid
+
+import httpx
+import pytest
+import uvicorn
+from redis.exceptions import RedisError
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.db.session import engine, redis_client, redis_pool
+from app.main import app
+from app.utils.principal_cache import principal_cache
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def client():
+    # note: a real server, the in-process transports buffer a whole response and never return from an endless stream.
+    # The lifespan is left out, its shutdown closes process wide pools for good. Pooled connections belong to this
+    # test's event loop and are closed here instead
+    try:
+        async with engine.connect() as connection:
+            await connection.execute(text('SELECT 1'))
+        await redis_client.ping()
+    except (SQLAlchemyError, OSError, RedisError) as e:
+        await engine.dispose()
+        await redis_pool.disconnect()
+        pytest.skip(f'needs a running database and redis: {e!r}')
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=0, lifespan='off', log_level='warning'))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        if serving.done():
+            pytest.skip(f'the app could not start: {serving.exception()!r}')
+        await asyncio.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}/api/v1') as client:
+        yield client
+    server.should_exit = True
+    await serving
+    await engine.dispose()
+    await redis_pool.disconnect()
+
+
+async def _group_owner(client: httpx.AsyncClient) -> tuple[int, dict[str, str]]:
+    email, password = f'{uuid.uuid4().hex[:12]}@example.com', 'Passw0rdX'
+    response = await client.post('/user/register', json={'email': email, 'password': password})
+    assert response.status_code == 201, response.text
+    response = await client.post('/login/access-token', data={'username': email, 'password': password})
+    headers = {'Authorization': f'Bearer {response.json()["access_token"]}'}
+    response = await client.post('/group', json={'title': 'streams', 'users': []}, headers=headers)
+    assert response.status_code == 201, response.text
+    group_id = response.json()['id']
+    # note: request scoped sessions are closed after the response is sent, wait for the setup requests' to be.
+    # The principal cache is emptied so the stream's own authentication reads the user from the database
+    for _ in range(100):
+        if engine.sync_engine.pool.checkedout() == 0:
+            break
+        await asyncio.sleep(0.01)
+    principal_cache.clear()
+    return group_id, headers
+
+
+async def test_event_stream_holds_no_pooled_connection(client):
+    group_id, headers = await _group_owner(client)
+
+    async with client.stream('GET', f'/group/{group_id}/events', headers=headers) as response:
+        assert response.status_code == 200
+        assert engine.sync_engine.pool.checkedout() == 0
+
+
+async def test_export_stream_releases_request_connections(client):
+    group_id, headers = await _group_owner(client)
+
+    async with client.stream('GET', f'/group/{group_id}/tasks/export', headers=headers) as response:
+        assert response.status_code == 200
+        # note: only the export's own session is open while rows are streamed
+        assert engine.sync_engine.pool.checkedout() <= 1
+        await response.aread()
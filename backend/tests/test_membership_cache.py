@@ -0,0 +1,48 @@
+import pytest
+
+from app.crud.group_crud import group
+from app.utils import membership_cache
+
+pytestmark = [pytest.mark.anyio, pytest.mark.usefixtures('membership_cache_enabled')]
+
+GROUP_ID = 1
+USER_ID = 2
+
+
+async def test_fill_is_cached_without_removal():
+    cached, generation = await membership_cache.lookup_member(GROUP_ID, USER_ID)
+    assert not cached
+
+    await membership_cache.add_members(GROUP_ID, [USER_ID], generation=generation)
+
+    assert (await membership_cache.lookup_member(GROUP_ID, USER_ID))[0]
+
+
+async def test_fill_read_before_removal_is_dropped():
+    _, generation = await membership_cache.lookup_member(GROUP_ID, USER_ID)
+    await membership_cache.remove_members(GROUP_ID, [USER_ID])
+
+    await membership_cache.add_members(GROUP_ID, [USER_ID], generation=generation)
+
+    assert not (await membership_cache.lookup_member(GROUP_ID, USER_ID))[0]
+
+
+async def test_fill_read_before_group_drop_is_dropped():
+    _, generation = await membership_cache.lookup_member(GROUP_ID, USER_ID)
+    await membership_cache.drop_group(GROUP_ID)
+
+    await membership_cache.add_members(GROUP_ID, [USER_ID], generation=generation)
+
+    assert not (await membership_cache.lookup_member(GROUP_ID, USER_ID))[0]
+
+
+async def test_is_member_does_not_recache_member_removed_during_check(monkeypatch):
+    # note: the database still saw the membership, the removal commits and evicts before the check writes back
+    async def read_then_removed(key, loader, *, db):
+        await membership_cache.remove_members(GROUP_ID, [USER_ID])
+        return True
+
+    monkeypatch.setattr(group, '_coalesce', read_then_removed)
+
+    assert await group.is_member(group_id=GROUP_ID, user_id=USER_ID, db=None)
+    assert not (await membership_cache.lookup_member(GROUP_ID, USER_ID))[0]
@@ -0,0 +1,20 @@
+from datetime import date
+
+from app.db.partitioning import create_partition_ddl, default_partition_name
+
+
+def test_rows_leave_the_default_partition_before_the_attach():
+    create, move, attach = create_partition_ddl(
+        'tasks',
+        date(2027, 1, 1),
+        date(2027, 2, 1),
+        default=default_partition_name('tasks')
+    )
+
+    assert create.startswith('CREATE TABLE IF NOT EXISTS tasks_p2027_01')
+    assert 'DELETE FROM tasks_default' in move and 'INSERT INTO tasks_p2027_01' in move
+    assert attach.startswith('ALTER TABLE tasks ATTACH PARTITION tasks_p2027_01')
+
+
+def test_without_a_default_partition_nothing_is_moved():
+    assert len(create_partition_ddl('tasks', date(2027, 1, 1), date(2027, 2, 1))) == 2
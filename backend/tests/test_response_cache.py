@@ -0,0 +1,32 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.crud.task_crud import task
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    loads = []
+
+    async def load_response(*, id: int, db) -> SimpleNamespace:
+        loads.append(db)
+        return SimpleNamespace(id=id, version=len(loads))
+
+    monkeypatch.setattr(task, '_load_response', load_response)
+    task.cache.reset()
+    yield loads
+    task.cache.reset()
+
+
+async def test_replica_loads_are_served_but_not_stored(monkeypatch, loads):
+    replica, primary = SimpleNamespace(bind=object()), SimpleNamespace(bind=object())
+    monkeypatch.setattr('app.crud.base_crud.read_engine', replica.bind)
+
+    assert (await task.get_cached(id=1, db=replica)).version == 1
+    assert (await task.get_cached(id=1, db=primary)).version == 2
+    assert (await task.get_cached(id=1, db=replica)).version == 2
+
+    assert loads == [replica, primary]
@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from app.utils.single_flight import SingleFlight
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_followers_share_the_leaders_load():
+    flights, calls = SingleFlight('test', timeout=1), []
+
+    async def load(caller: int) -> int:
+        calls.append(caller)
+        await asyncio.sleep(0.01)
+        return caller
+
+    results = await asyncio.gather(*(flights.do('key', lambda caller=caller: load(caller)) for caller in range(5)))
+
+    assert calls == [0]
+    assert results == [0] * 5
+
+
+async def test_followers_load_themselves_when_the_leader_is_cancelled():
+    flights, started = SingleFlight('test', timeout=1), asyncio.Event()
+
+    async def stuck() -> int:
+        started.set()
+        await asyncio.sleep(10)
+        return 0
+
+    async def load() -> int:
+        return 1
+
+    leader = asyncio.create_task(flights.do('key', stuck))
+    await started.wait()
+    follower = asyncio.create_task(flights.do('key', load))
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    assert await follower == 1
+    with pytest.raises(asyncio.CancelledError):
+        await leader
@@ -0,0 +1,28 @@
+import asyncio
+
+import pytest
+from redis.exceptions import RedisError
+
+from app.jobs import worker
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_consumer_outlives_a_queue_error_while_running_a_job(monkeypatch):
+    stopping, reserved = asyncio.Event(), [('job-1', 1), ('job-2', 1)]
+
+    async def reserve(redis_client):
+        if not reserved:
+            stopping.set()
+            return None
+        return reserved.pop(0)
+
+    async def run_job(job_id: str, attempt: int):
+        raise RedisError('connection lost')
+
+    monkeypatch.setattr(worker.queue, 'reserve', reserve)
+    monkeypatch.setattr(worker, 'run_job', run_job)
+
+    await asyncio.wait_for(worker._consume(stopping), 1)
+
+    assert not reserved